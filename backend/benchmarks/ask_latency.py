@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Ask Latency Benchmark
+Measures /ask latency and throughput of one session under a steady stream of questions, comparing
+
+  before : a workflow (RAG chain + compiled LangGraph app) built for every question and
+           invoked synchronously, which blocks the event loop so questions run one at a time
+  after  : the session's workflow built once, questions answered with `arun`, overlapping
+           while they wait on the model
+
+Embeddings and the chat model are local fakes with simulated latency, no API key is needed.
+
+    python benchmarks/ask_latency.py --questions 200 --rate 10 --llm-latency 0.2
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+import numpy as np
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+sys.path.insert(0, str(current_dir))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+## conversation threads stay in memory, each question starts its own thread so none is rewritten
+os.environ.setdefault("CONVERSATION_DB_PATH", ":memory:")
+
+from langchain_community.vectorstores import FAISS
+from workflow import workflow
+from fakes import FakeEmbeddings, FakeChatModel
+
+WORDS = ("loan interest rate credit card account deposit risk compliance mortgage branch customer "
+         "payment fee limit statement transfer balance regulation capital liquidity").split()
+
+
+def build_session(chunks, dimensions, embed_latency):
+    rng = np.random.default_rng(0)
+    texts = [" ".join(rng.choice(WORDS, size=60)) for _ in range(chunks)]
+    metadatas = [{"source": f"doc{i // 50}.pdf", "page": i // 5, "start_index": (i % 5) * 400} for i in range(chunks)]
+    embeddings = FakeEmbeddings(dimensions)
+    vector_store = FAISS.from_texts(texts, embeddings, metadatas=metadatas)
+    embeddings.latency = embed_latency
+    return vector_store.as_retriever()
+
+
+def summary(name, latencies, wall, setup=None):
+    latencies = np.array(latencies) * 1000
+    row = (f"| {name} | {np.percentile(latencies, 50):.0f} | {np.percentile(latencies, 95):.0f} "
+           f"| {len(latencies) / wall:.1f} |")
+    return row + (f" {np.mean(setup) * 1000:.1f} |" if setup else " - |")
+
+
+async def replay(questions, rate, answer):
+    """Questions arrive on a fixed schedule (`rate` per second); latency is counted from the
+    scheduled arrival, so time spent waiting for a blocked event loop is included."""
+    latencies = []
+    start = time.perf_counter()
+
+    async def ask(i, question):
+        arrival = start + i / rate
+        await asyncio.sleep(max(0.0, arrival - time.perf_counter()))
+        await answer(i, question)
+        latencies.append(time.perf_counter() - arrival)
+
+    await asyncio.gather(*(ask(i, question) for i, question in enumerate(questions)))
+    return latencies, time.perf_counter() - start
+
+
+async def before(retriever, llm, questions, rate):
+    setup = []
+
+    async def answer(i, question):
+        start = time.perf_counter()
+        obj = workflow(llm, retriever, "benchmark")
+        setup.append(time.perf_counter() - start)
+        obj.run(question, thread_id=f"benchmark:{i}")
+
+    latencies, wall = await replay(questions, rate, answer)
+    return latencies, wall, setup
+
+
+async def after(retriever, llm, questions, rate):
+    obj = workflow(llm, retriever, "benchmark")
+
+    async def answer(i, question):
+        await obj.arun(question, thread_id=f"benchmark:{i}")
+
+    return await replay(questions, rate, answer)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=10, help="questions arriving per second")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--embed-latency", type=float, default=0.02)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    args = parser.parse_args()
+
+    retriever = build_session(args.chunks, args.dimensions, args.embed_latency)
+    llm = FakeChatModel(latency=args.llm_latency)
+    rng = np.random.default_rng(1)
+    questions = [" ".join(rng.choice(WORDS, size=8)) + "?" for _ in range(args.questions)]
+
+    old_latencies, old_wall, setup = asyncio.run(before(retriever, llm, questions, args.rate))
+    new_latencies, new_wall = asyncio.run(after(retriever, llm, questions, args.rate))
+    print(f"\n{args.questions} questions, arriving at {args.rate:g}/s, {args.chunks} chunks, "
+          f"embedding {args.embed_latency * 1000:.0f} ms, llm {args.llm_latency * 1000:.0f} ms\n")
+    print("| path | p50 ms | p95 ms | questions/s | setup ms |")
+    print("|---|---|---|---|---|")
+    print(summary("per-request workflow, sync", old_latencies, old_wall, setup))
+    print(summary("per-session workflow, async", new_latencies, new_wall))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Chunking Benchmark
+Compares the previous splitter (RecursiveCharacterTextSplitter, 500 characters, 100 overlap) with
+the structure-aware chunker (CHUNKER=structure) on the text pages of the sample documents in
+backend/data:
+
+  chunks, tokens sent to the embedding model (overlap included), tokens per chunk,
+  chunks starting mid-sentence, chunks carrying section / date metadata,
+  bytes of the saved index (FAISS vectors, docstore, bm25 index) and chunking time.
+
+It also times a question filtered on one document against the same question unfiltered.
+Vectors come from fakes.FakeEmbeddings at --dimensions (3072 = text-embedding-3-large), so index
+sizes are the real ones for that model and no API key is needed.
+
+    python benchmarks/chunking.py
+"""
+
+import os
+import re
+import sys
+import time
+import tempfile
+import argparse
+from pathlib import Path
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+sys.path.insert(0, str(current_dir))
+
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from document_loader import text_splitter
+from session_store import save_vector_store, index_dir
+from lexical_index import LexicalIndex
+from context_builder import ContextBuilder
+from metadata_filter import parse_filters
+from tokens import count_tokens
+from fakes import FakeEmbeddings
+from retrieval_recall import sample_documents
+
+QUESTION = "delay in the release of the transfer points by the employer"
+
+
+def folder_bytes(folder):
+    return {name: os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder)}
+
+
+def timed_retrieve(builder, filters, repeat=20):
+    embedding = builder.embed(QUESTION)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        candidates = builder.retrieve(QUESTION, embedding, filters)
+    return (time.perf_counter() - start) * 1000 / repeat, len(candidates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dimensions", type=int, default=3072, help="size of the fake embeddings")
+    args = parser.parse_args()
+
+    documents = sample_documents()
+    embeddings = FakeEmbeddings(args.dimensions)
+    source = max({doc.metadata["source"] for doc in documents},
+                 key=lambda name: sum(doc.metadata["source"] == name for doc in documents))
+    filters = parse_filters({"source": source})
+    rows = []
+    for kind in ("recursive", "structure"):
+        start = time.perf_counter()
+        chunks = text_splitter(kind).split_documents(documents)
+        seconds = time.perf_counter() - start
+        tokens = np.array([count_tokens(chunk.page_content) for chunk in chunks])
+        mid_sentence = sum(bool(re.match(r"[a-z]", chunk.page_content.lstrip())) for chunk in chunks)
+        sections = sum("section" in chunk.metadata for chunk in chunks)
+        dated = sum("doc_date" in chunk.metadata for chunk in chunks)
+        vector_store = FAISS.from_documents(chunks, embeddings, normalize_L2=True)
+        with tempfile.TemporaryDirectory() as folder:
+            save_vector_store(vector_store, folder, hashes={})
+            sizes = folder_bytes(index_dir(folder))
+        lexical = LexicalIndex.build([vector_store.docstore.search(vector_store.index_to_docstore_id[i]).page_content
+                                      for i in range(len(chunks))])
+        builder = ContextBuilder(vector_store, mode="similarity", lexical=lexical)
+        builder.metadata()
+        unfiltered_ms, _ = timed_retrieve(builder, None)
+        filtered_ms, found = timed_retrieve(builder, filters)
+        rows.append((kind, len(chunks), int(tokens.sum()), tokens.mean(), int(np.percentile(tokens, 95)), int(tokens.max()),
+                     mid_sentence / len(chunks), sections / len(chunks), dated / len(chunks),
+                     sizes.get("index.faiss", 0), sum(sizes.values()), seconds, unfiltered_ms, filtered_ms))
+
+    print(f"\n{len(documents)} text pages of the sample documents, {args.dimensions}-d vectors\n")
+    print("| chunker | chunks | tokens embedded | tokens / chunk | p95 | max | starts mid-sentence | with section "
+          "| with date | vectors MB | index MB | chunking s | retrieve ms | filtered retrieve ms |")
+    print("|---|---|---|---|---|---|---|---|---|---|---|---|---|---|")
+    for row in rows:
+        kind, count, total, mean, p95, largest, mid, sections, dated, vectors, size, seconds, plain, filtered = row
+        print(f"| {kind} | {count} | {total} | {mean:.0f} | {p95} | {largest} | {mid:.0%} | {sections:.0%} | {dated:.0%} "
+              f"| {vectors / 2**20:.1f} | {size / 2**20:.1f} | {seconds:.2f} | {plain:.2f} | {filtered:.2f} |")
+    print(f"\nfiltered on source = {os.path.basename(source)}")
+
+
+if __name__ == "__main__":
+    main()
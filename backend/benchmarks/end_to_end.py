@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+End-to-End Benchmark
+Runs the real ingestion and question paths offline, over generated corpora of increasing size and
+over the sample files of backend/data, with the local stand-ins of fakes.py in place of
+OpenAIEmbeddings, ChatOpenAI and the OCR service (each with a configurable simulated latency):
+
+  ingest : Retriever.retriever() : parallel loading (OCR of the scanned pages included), chunking,
+           batched embedding, FAISS build and save
+  load   : Retriever.load() : the saved session opened from disk, as on its first question
+  query  : RAG.run over generated questions : retrieval, context assembly and the model call
+
+For every corpus and phase it reports the wall time, throughput and peak RSS of the process
+(the pdf parsing pool of LOADER_PROCESSES is not counted), and per pipeline stage the count,
+p50 and p95 of the telemetry spans. Results are compared with a stored baseline:
+
+    python benchmarks/end_to_end.py                    # compare with benchmarks/baseline.json
+    python benchmarks/end_to_end.py --save-baseline    # store this run as the baseline
+    python benchmarks/end_to_end.py --check            # exit 1 on a regression past --tolerance, e.g. in CI
+"""
+
+import os
+import sys
+import json
+import time
+import glob
+import random
+import shutil
+import tempfile
+import argparse
+import platform
+import threading
+import contextlib
+from pathlib import Path
+import numpy as np
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+sys.path.insert(0, str(current_dir))
+## offline and cold : no API key, no cache shared with earlier runs, spans kept in memory instead of logged
+SCRATCH = tempfile.mkdtemp(prefix="e2e-")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ["EMBED_CACHE"] = "false"
+os.environ["ANSWER_CACHE"] = "false"
+os.environ["TRACE_LOG"] = "false"
+os.environ["OCR_BACKEND"] = "fake"
+os.environ["OCR_CHECKPOINT_DIR"] = os.path.join(SCRATCH, "ocr")
+os.environ["DOCUMENT_STORE_DIR"] = os.path.join(SCRATCH, "store")
+
+import pymupdf
+import ocr
+import telemetry
+import Retriever as retriever_module
+from Retriever import Retriever
+from workflow import workflow
+from index_factory import EMBED_DIMENSIONS
+from fakes import FakeEmbeddings, FakeChatModel, FakeOCR
+
+DATA_DIR = current_dir.parent / "data"
+BASELINE = current_dir / "baseline.json"
+PAGES_PER_PDF = 50
+WORDS = ("contractor employer engineer delay notice claim extension time payment certificate variation "
+         "works site programme completion defects liability instruction valuation interim final "
+         "approval drawings specification materials equipment subcontractor insurance termination "
+         "dispute adjudication arbitration damages liquidated schedule milestone access possession").split()
+## stages whose spans are reported, in pipeline order
+STAGES = ("load_file", "ocr_range", "chunk", "embed_batch", "index_build", "ingest", "retrieve", "rerank",
+          "prompt_assembly", "llm")
+
+
+def sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(10, 22))
+    return " ".join(words).capitalize() + f" under clause {rng.randint(1, 30)}.{rng.randint(1, 9)}."
+
+
+def page_text(rng, document, number):
+    """Text of a generated page : a letter header on the first page, then numbered sections and clauses."""
+    lines = []
+    if number == 0:
+        lines += [f"Ref: PRJ/{document:03d}/{rng.randint(100, 999)}", f"{rng.randint(1, 28)} March 2024",
+                  f"Subject: {' '.join(rng.choices(WORDS, k=5)).title()}", "Dear Sir,"]
+    section = number + 1
+    lines.append(f"{section}. {' '.join(rng.choices(WORDS, k=3)).upper()}")
+    for clause in range(1, rng.randint(3, 5)):
+        lines.append(f"{section}.{clause} " + " ".join(sentence(rng) for _ in range(rng.randint(2, 4))))
+    return "\n".join(lines)
+
+
+def generate_corpus(folder, pages, scanned_share, seed=0):
+    """Writes `pages` pages as pdfs of PAGES_PER_PDF pages; a `scanned_share` of the pdfs' pages are image only."""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    pixmap = pymupdf.Pixmap(pymupdf.csGRAY, pymupdf.IRect(0, 0, 200, 280), False)
+    for document in range((pages + PAGES_PER_PDF - 1) // PAGES_PER_PDF):
+        count = min(PAGES_PER_PDF, pages - document * PAGES_PER_PDF)
+        scanned = set(rng.sample(range(count), int(count * scanned_share)))
+        path = os.path.join(folder, f"generated-{document:03d}.pdf")
+        with pymupdf.open() as doc:
+            for number in range(count):
+                page = doc.new_page()
+                if number in scanned:
+                    pixmap.set_rect(pixmap.irect, (number % 256,))
+                    page.insert_image(page.rect, pixmap=pixmap)
+                else:
+                    page.insert_textbox(page.rect + (50, 50, -50, -50), page_text(rng, document, number), fontsize=9)
+            doc.save(path, garbage=3, deflate=True)
+
+
+def copy_sample_data(folder):
+    """Copies the sample files of backend/data (a session folder gets its index written next to its files)."""
+    os.makedirs(folder, exist_ok=True)
+    files = sorted(set(glob.glob(str(DATA_DIR / "*")) + glob.glob(str(DATA_DIR / "upload" / "*" / "*"))))
+    taken = set()
+    for file in files:
+        if not os.path.isfile(file) or os.path.basename(file) in taken:
+            continue
+        taken.add(os.path.basename(file))
+        shutil.copy(file, folder)
+
+
+def make_questions(count, seed=1):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=6)) + f" clause {rng.randint(1, 30)}.{rng.randint(1, 9)}?" for _ in range(count)]
+
+
+class PeakRSS:
+    """Peak resident memory of the process during a block, from VmHWM of /proc/self/status reset through
+    /proc/self/clear_refs; elsewhere a thread samples the current RSS every few milliseconds."""
+
+    def __init__(self):
+        self.peak = 0
+
+    @staticmethod
+    def status(field):
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith(field + ":"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+    def __enter__(self):
+        self.exact = False
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            self.exact = self.status("VmHWM") is not None
+        except OSError:
+            pass
+        self.start = self.status("VmRSS") or 0
+        self.peak = self.start
+        self._stop = threading.Event()
+        if not self.exact:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(0.005):
+            self.peak = max(self.peak, self.status("VmRSS") or 0)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.exact:
+            self.peak = self.status("VmHWM")
+        else:
+            self._thread.join()
+        return False
+
+
+class SpanLog:
+    """Keeps the exact duration and sizes of every telemetry span of a phase."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, seconds, error, attributes):
+        with self._lock:
+            self.spans.append((stage, seconds, attributes))
+
+    def stages(self):
+        rows = {}
+        for stage in STAGES:
+            times = np.array([seconds for name, seconds, _ in self.spans if name == stage]) * 1000
+            if len(times):
+                rows[stage] = {"count": int(len(times)), "p50_ms": round(float(np.percentile(times, 50)), 2),
+                               "p95_ms": round(float(np.percentile(times, 95)), 2), "total_s": round(float(times.sum()) / 1000, 3)}
+        return rows
+
+    def total(self, stage, attribute):
+        return sum(attributes.get(attribute) or 0 for name, _, attributes in self.spans if name == stage)
+
+
+@contextlib.contextmanager
+def phase(results, name):
+    spans = SpanLog()
+    telemetry.add_listener(spans)
+    result = {}
+    try:
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            yield result, spans
+            result["seconds"] = round(time.perf_counter() - start, 3)
+    finally:
+        telemetry.remove_listener(spans)
+    result["peak_rss_mb"] = round(rss.peak / 2**20, 1)
+    result["stages"] = spans.stages()
+    results[name] = result
+
+
+def run_corpus(folder, args, quiet):
+    """Ingests, loads and questions one corpus folder; returns {phase: result}."""
+    results = {}
+    with quiet():
+        with phase(results, "ingest") as (result, spans):
+            Retriever(folder).retriever()
+        result["pages"] = spans.total("ingest", "pages")
+        result["chunks"] = spans.total("ingest", "chunks")
+        result["pages_per_s"] = round(result["pages"] / result["seconds"], 1)
+        result["chunks_per_s"] = round(result["chunks"] / result["seconds"], 1)
+
+        with phase(results, "load") as (result, spans):
+            retriever, llm = Retriever(folder).load()
+
+        rag = workflow(llm, retriever, folder).rag
+        questions = make_questions(args.questions)
+        ## first question builds the chain's lazy parts (bm25 index, metadata), not counted
+        rag.run(questions[0], use_cache=False)
+        latencies = []
+        with phase(results, "query") as (result, spans):
+            for question in questions:
+                start = time.perf_counter()
+                rag.run(question, use_cache=False)
+                latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        result["questions"] = len(questions)
+        result["p50_ms"] = round(float(np.percentile(latencies, 50)), 2)
+        result["p95_ms"] = round(float(np.percentile(latencies, 95)), 2)
+        result["questions_per_s"] = round(len(questions) / result["seconds"], 1)
+    return results
+
+
+## metric -> True when higher is better
+COMPARED = {("ingest", "seconds"): False, ("ingest", "pages_per_s"): True, ("ingest", "peak_rss_mb"): False,
+            ("load", "seconds"): False, ("load", "peak_rss_mb"): False,
+            ("query", "p50_ms"): False, ("query", "p95_ms"): False, ("query", "questions_per_s"): True,
+            ("query", "peak_rss_mb"): False}
+## changes smaller than this are noise whatever their ratio (e.g. a 3 ms load taking 5 ms)
+NOISE_FLOOR = {"seconds": 0.05, "p50_ms": 5, "p95_ms": 5, "peak_rss_mb": 10}
+
+
+def compare(report, baseline, tolerance):
+    """compare method returns the rows of the comparison with the baseline and the regressions past `tolerance`."""
+    rows, regressions = [], []
+    for corpus, phases in report["corpora"].items():
+        old_phases = baseline.get("corpora", {}).get(corpus)
+        if old_phases is None:
+            continue
+        for (name, metric), higher_better in COMPARED.items():
+            old = old_phases.get(name, {}).get(metric)
+            new = phases.get(name, {}).get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_better else change
+            flag = "regression" if worse > tolerance else ("better" if worse < -tolerance else "")
+            if abs(new - old) < NOISE_FLOOR.get(metric, 0):
+                flag = ""
+            rows.append((corpus, name, metric, old, new, change, flag))
+            if flag == "regression":
+                regressions.append(f"{corpus} {name} {metric} : {old} -> {new} ({change:+.0%})")
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", default="100,400,1600", help="sizes of the generated corpora, in pages")
+    parser.add_argument("--scanned-share", type=float, default=0.1, help="share of generated pages that are image only (OCR)")
+    parser.add_argument("--no-sample-data", action="store_true", help="skip the files of backend/data")
+    parser.add_argument("--questions", type=int, default=50)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--embed-latency-per-text", type=float, default=0.0002, help="seconds per embedded chunk")
+    parser.add_argument("--query-embed-latency", type=float, default=0.02, help="seconds per question embedding")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per answer")
+    parser.add_argument("--ocr-latency", type=float, default=0.2, help="seconds per ocr request")
+    parser.add_argument("--ocr-page-latency", type=float, default=0.01, help="seconds per ocr'd page")
+    parser.add_argument("--baseline", default=str(BASELINE))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true", help="exit 1 when a metric regressed past --tolerance")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own logs")
+    args = parser.parse_args()
+
+    ## the real code paths, with the hosted models swapped for the local stand-ins
+    class BenchmarkEmbeddings(FakeEmbeddings):
+        def embed_query(self, text):
+            time.sleep(args.query_embed_latency)
+            return self.vector(text)
+
+    retriever_module.build_embeddings = lambda dimensions=EMBED_DIMENSIONS, **kwargs: BenchmarkEmbeddings(
+        dimensions, latency=args.embed_latency, latency_per_text=args.embed_latency_per_text)
+    retriever_module.ChatOpenAI = lambda **kwargs: FakeChatModel(latency=args.llm_latency)
+    ocr_backend = FakeOCR(args.ocr_latency, args.ocr_page_latency)
+    ocr.register_ocr_backend("fake", lambda: ocr_backend)
+
+    null = open(os.devnull, "w")
+
+    def quiet():
+        return contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(null)
+
+    corpora = {}
+    try:
+        for pages in [int(size) for size in args.pages.split(",") if size]:
+            folder = os.path.join(SCRATCH, f"generated-{pages}")
+            generate_corpus(folder, pages, args.scanned_share)
+            corpora[f"generated-{pages}"] = folder
+        if not args.no_sample_data:
+            copy_sample_data(os.path.join(SCRATCH, "sample-data"))
+            corpora["sample-data"] = os.path.join(SCRATCH, "sample-data")
+        report = {
+            "config": {key: value for key, value in vars(args).items()
+                       if key not in ("baseline", "save_baseline", "check", "tolerance", "verbose")},
+            "machine": {"python": platform.python_version(), "cpus": os.cpu_count(), "platform": platform.platform()},
+            "corpora": {},
+        }
+        for name, folder in corpora.items():
+            print(f"INFO : {name} ...", file=sys.stderr)
+            report["corpora"][name] = run_corpus(folder, args, quiet)
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    config = report["config"]
+    print(f"\nembedding {config['embed_latency'] * 1000:g} ms + {config['embed_latency_per_text'] * 1000:g} ms/chunk, "
+          f"question embedding {config['query_embed_latency'] * 1000:g} ms, llm {config['llm_latency'] * 1000:g} ms, "
+          f"ocr {config['ocr_latency'] * 1000:g} ms + {config['ocr_page_latency'] * 1000:g} ms/page, "
+          f"{EMBED_DIMENSIONS}-d vectors, {os.cpu_count()} CPU\n")
+    print("| corpus | pages | chunks | ingest s | pages/s | chunks/s | ingest peak RSS MB | load s | load peak RSS MB "
+          "| query p50 ms | query p95 ms | questions/s | query peak RSS MB |")
+    print("|---|---|---|---|---|---|---|---|---|---|---|---|---|")
+    for name, phases in report["corpora"].items():
+        ingest, load, query = phases["ingest"], phases["load"], phases["query"]
+        print(f"| {name} | {ingest['pages']} | {ingest['chunks']} | {ingest['seconds']:.1f} | {ingest['pages_per_s']} "
+              f"| {ingest['chunks_per_s']} | {ingest['peak_rss_mb']} | {load['seconds']:.2f} | {load['peak_rss_mb']} "
+              f"| {query['p50_ms']} | {query['p95_ms']} | {query['questions_per_s']} | {query['peak_rss_mb']} |")
+    print("\n| corpus | stage | spans | p50 ms | p95 ms | total s |")
+    print("|---|---|---|---|---|---|")
+    for name, phases in report["corpora"].items():
+        for phase_name in ("ingest", "query"):
+            for stage, row in phases[phase_name]["stages"].items():
+                print(f"| {name} | {stage} | {row['count']} | {row['p50_ms']} | {row['p95_ms']} | {row['total_s']} |")
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows, regressions = compare(report, baseline, args.tolerance)
+        if baseline.get("config") != report["config"]:
+            print("\nINFO : the baseline was run with other settings, the comparison is indicative only")
+        print(f"\ncompared with {args.baseline} (tolerance {args.tolerance:.0%})\n")
+        print("| corpus | phase | metric | baseline | now | change | |")
+        print("|---|---|---|---|---|---|---|")
+        for corpus, name, metric, old, new, change, flag in rows:
+            print(f"| {corpus} | {name} | {metric} | {old} | {new} | {change:+.0%} | {flag} |")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nINFO : baseline saved to {args.baseline}")
+    if regressions:
+        print("\nERROR : regressions :\n  " + "\n  ".join(regressions))
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Deterministic local stand-ins for the hosted models, with configurable simulated latency.
+They let the benchmarks drive the real pipeline without API keys or network access.
+"""
+
+import os
+import time
+import random
+import asyncio
+import threading
+import zlib
+from typing import Any, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+import pymupdf
+from ocr import OCRBackend
+
+
+class FakeEmbeddings(Embeddings):
+    def __init__(self, dimensions: int = 3072, latency: float = 0.0, latency_per_text: float = 0.0):
+        """Hashed bag-of-words vectors: texts sharing words get similar unit vectors, identical texts
+        identical ones, so retrieval quality is meaningful without a model.
+
+        Args:
+            dimensions: size of the vectors
+            latency: simulated seconds per request
+            latency_per_text: simulated seconds per embedded text
+        """
+        self.dimensions = dimensions
+        self.latency = latency
+        self.latency_per_text = latency_per_text
+        self.calls = 0
+        self.texts = 0
+
+    def vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for word in text.lower().split():
+            digest = zlib.crc32(word.encode("utf-8"))
+            vector[digest % self.dimensions] += 1.0 if digest & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0] = 1.0
+            norm = 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        time.sleep(self.latency + self.latency_per_text * len(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers with a fixed text after `latency` seconds, streaming one word
+    every `token_latency` seconds."""
+
+    response: str = "This is a deterministic answer produced by the fake chat model for benchmarking."
+    latency: float = 0.0
+    token_latency: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _tokens(self):
+        words = self.response.split(" ")
+        return [word + (" " if i < len(words) - 1 else "") for i, word in enumerate(words)]
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency + self.token_latency * len(self._tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    async def _agenerate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency + self.token_latency * len(self._tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.response))])
+
+    def _stream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        time.sleep(self.latency)
+        for token in self._tokens():
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self.latency)
+        for token in self._tokens():
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeOCR(OCRBackend):
+    """Local stand-in of an OCR service. It returns the text layer of each page of the pdf it is given
+    (or a placeholder for pages without one) after `latency` seconds per request plus `page_latency`
+    per page, and fails a `fail_rate` share of the requests. Use it with OCR_BACKEND=fakes:FakeOCR
+    and the benchmarks folder on the Python path."""
+
+    name = "fake"
+
+    def __init__(self, latency : float = 0.0, page_latency : float = 0.0, fail_rate : float = 0.0, seed : int = 0):
+        self.latency = latency
+        self.page_latency = page_latency
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def ocr(self, pdf_path : str) -> list:
+        with pymupdf.open(pdf_path) as doc:
+            texts = [page.get_text().strip() or f"[ocr] {os.path.basename(pdf_path)} page {number + 1}"
+                     for number, page in enumerate(doc)]
+        with self._lock:
+            self.calls += 1
+            fail = self.random.random() < self.fail_rate
+        time.sleep(self.latency + self.page_latency * len(texts))
+        if fail:
+            raise ConnectionError("fake ocr service unavailable")
+        with self._lock:
+            self.pages += len(texts)
+        return texts
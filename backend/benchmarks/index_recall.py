@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Index Recall Benchmark
+Compares recall@k, query latency, memory per vector and build time of the index types
+produced by index_factory against the exact flat index, at several embedding sizes.
+
+Vectors are either synthetic (clustered, unit length) or, with --from-cache, real
+text-embedding-3-large vectors read from the embedding cache. Shortened sizes are
+obtained the Matryoshka way: keep the first d components and re-normalize, which is
+only meaningful for real text-embedding-3 vectors.
+
+    python benchmarks/index_recall.py --vectors 20000 --queries 200
+    python benchmarks/index_recall.py --from-cache data/cache/embeddings.sqlite
+"""
+
+import sys
+import time
+import sqlite3
+import argparse
+from pathlib import Path
+import numpy as np
+import faiss
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+
+import index_factory
+from index_factory import create_index, configure_search
+
+
+def synthetic_vectors(n, dimensions, clusters=200, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(n, dimensions)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def cached_vectors(path, limit):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT vector FROM embeddings LIMIT ?", (limit,)).fetchall()
+    conn.close()
+    if not rows:
+        sys.exit(f"no vectors in {path}")
+    return np.stack([np.frombuffer(row[0], dtype=np.float32) for row in rows]).copy()
+
+
+def shorten(vectors, dimensions):
+    short = np.ascontiguousarray(vectors[:, :dimensions])
+    faiss.normalize_L2(short)
+    return short
+
+
+def index_bytes(index):
+    return faiss.serialize_index(index).nbytes
+
+
+def measure(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append(ids[0])
+    return np.array(results), np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def recall(found, truth):
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dimensions", default="3072,1024,256")
+    parser.add_argument("--types", default="flat,hnsw,ivfpq,opq")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--from-cache", dest="cache_path")
+    args = parser.parse_args()
+
+    full_dimensions = 3072
+    if args.cache_path:
+        data = cached_vectors(args.cache_path, args.vectors + args.queries)
+        full_dimensions = data.shape[1]
+    else:
+        data = synthetic_vectors(args.vectors + args.queries, full_dimensions)
+    base, queries = data[:-args.queries], data[-args.queries:]
+    n = len(base)
+
+    ## ground truth: exact search at full size
+    exact = faiss.IndexFlatL2(full_dimensions)
+    exact.add(base)
+    _, truth = exact.search(queries, args.k)
+
+    configs = [("flat", {}), ("hnsw", {"HNSW_EF_SEARCH": 32}), ("hnsw", {"HNSW_EF_SEARCH": 128}),
+               ("hnsw", {"HNSW_EF_SEARCH": 256}), ("ivfpq", {"IVF_NPROBE": 8}), ("ivfpq", {"IVF_NPROBE": 32}),
+               ("opq", {"IVF_NPROBE": 32})]
+    configs = [(index_type, setting) for index_type, setting in configs if index_type in args.types.split(",")]
+    names = {"HNSW_EF_SEARCH": "efSearch", "IVF_NPROBE": "nprobe"}
+    print(f"{n} vectors, {len(queries)} queries, recall@{args.k} against exact search at {full_dimensions} dimensions\n")
+    print("| dims | index | setting | recall | p50 ms | p95 ms | bytes/vector | build s |")
+    print("|---|---|---|---|---|---|---|---|")
+    for dimensions in [int(d) for d in args.dimensions.split(",") if int(d) <= full_dimensions]:
+        base_d = shorten(base, dimensions) if dimensions < full_dimensions else base
+        queries_d = shorten(queries, dimensions) if dimensions < full_dimensions else queries
+        built = {}
+        for index_type, setting in configs:
+            for name, value in setting.items():
+                setattr(index_factory, name, value)
+            if index_type not in built:
+                start = time.perf_counter()
+                index = create_index(dimensions, n, index_type, "cosine")
+                if not index.is_trained:
+                    index.train(base_d)
+                index.add(base_d)
+                built[index_type] = (index, time.perf_counter() - start)
+            index, build_seconds = built[index_type]
+            configure_search(index)
+            found, p50, p95 = measure(index, queries_d, args.k)
+            label = ", ".join(f"{names[name]}={value}" for name, value in setting.items()) or "-"
+            print(f"| {dimensions} | {index_type} | {label} | {recall(found, truth):.3f} | {p50:.2f} | {p95:.2f} "
+                  f"| {index_bytes(index) / n:.0f} | {build_seconds:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+OCR Pages Benchmark
+OCRs a generated scanned pdf against the local stand-in OCR service (fakes.FakeOCR) and reports
+wall time per strategy:
+
+  sequential  : page ranges one after another (what the old 500-page loop did)
+  concurrent  : OCR_CONCURRENCY ranges in flight
+  crash+resume: a run where the service fails some ranges, then a second run that resumes
+                from the checkpointed ranges and only sends the missing ones
+
+    python benchmarks/ocr_pages.py --pages 400 --max-pages 50 --latency 1.0 --page-latency 0.01
+"""
+
+import sys
+import time
+import tempfile
+import argparse
+from pathlib import Path
+import pymupdf
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+sys.path.insert(0, str(current_dir))
+
+import ocr
+from ocr import ocr_pages
+from fakes import FakeOCR
+
+
+def scanned_pdf(path, pages):
+    """Writes a pdf of `pages` image-only pages."""
+    with pymupdf.open() as doc:
+        pixmap = pymupdf.Pixmap(pymupdf.csGRAY, pymupdf.IRect(0, 0, 200, 280), False)
+        for number in range(pages):
+            pixmap.set_rect(pixmap.irect, (number % 256,))
+            page = doc.new_page()
+            page.insert_image(page.rect, pixmap=pixmap)
+        doc.save(path, garbage=3, deflate=True)
+
+
+def run(name, pdf_path, pages, backend, concurrency, max_pages, max_retries=0):
+    start = time.perf_counter()
+    calls = backend.calls
+    texts = ocr_pages(pdf_path, list(range(pages)), backend=backend, concurrency=concurrency,
+                      max_retries=max_retries, max_pages=max_pages)
+    seconds = time.perf_counter() - start
+    return f"| {name} | {concurrency} | {backend.calls - calls} | {len(texts)}/{pages} | {seconds:.1f} |"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--max-pages", type=int, default=50, help="pages per ocr request")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=1.0, help="seconds per ocr request")
+    parser.add_argument("--page-latency", type=float, default=0.01, help="seconds per ocr'd page")
+    parser.add_argument("--fail-rate", type=float, default=0.3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        pdf_path = str(Path(scratch) / "scanned.pdf")
+        scanned_pdf(pdf_path, args.pages)
+        ocr.OCR_CHECKPOINT_DIR = str(Path(scratch) / "checkpoints")
+        rows = [
+            run("sequential", pdf_path, args.pages, FakeOCR(args.latency, args.page_latency), 1, args.max_pages),
+            run("concurrent", pdf_path, args.pages, FakeOCR(args.latency, args.page_latency), args.concurrency, args.max_pages),
+            run("failing service, no retries", pdf_path, args.pages,
+                FakeOCR(args.latency, args.page_latency, fail_rate=args.fail_rate), args.concurrency, args.max_pages),
+            run("resume from checkpoints", pdf_path, args.pages, FakeOCR(args.latency, args.page_latency),
+                args.concurrency, args.max_pages),
+        ]
+    print(f"\n{args.pages} scanned pages, {args.max_pages} pages per request, "
+          f"{args.latency * 1000:.0f} ms per request + {args.page_latency * 1000:.0f} ms per page\n")
+    print("| run | in flight | requests | pages ocr'd | seconds |")
+    print("|---|---|---|---|---|")
+    for row in rows:
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+PDF Split Benchmark
+Times splitting a large pdf into parts under a size limit:
+
+  before : the previous split_pdf_by_size loop, which rewrote the growing part to disk after
+           every added page to measure it (reproduced here, it no longer exists in src/)
+  after  : document_loader.split_pdf_by_size, page sizes measured in memory and each part
+           written once
+
+    python benchmarks/pdf_split.py --pages 300 --target-mb 4
+"""
+
+import os
+import sys
+import time
+import tempfile
+import argparse
+from pathlib import Path
+import numpy as np
+import pymupdf
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+
+from document_loader import split_pdf_by_size, PdfReader, PdfWriter
+
+
+def large_pdf(path, pages, seed=0):
+    """Writes a pdf of `pages` pages with a little text and an incompressible image each (~60 KB per page)."""
+    rng = np.random.default_rng(seed)
+    with pymupdf.open() as doc:
+        for number in range(pages):
+            samples = rng.integers(0, 256, size=140 * 140 * 3, dtype=np.uint8).tobytes()
+            pixmap = pymupdf.Pixmap(pymupdf.csRGB, 140, 140, samples, False)
+            page = doc.new_page()
+            page.insert_text((72, 72), f"Page {number + 1} of the claim bundle")
+            page.insert_image(pymupdf.Rect(72, 100, 500, 528), pixmap=pixmap)
+        doc.save(path)
+
+
+def split_rewriting_every_page(input_path, target_size_mb, output_dir):
+    """The previous algorithm: add a page, rewrite the whole part, measure it on disk."""
+    reader = PdfReader(input_path)
+    total_pages = len(reader.pages)
+    part = 1
+    writer = PdfWriter()
+    parts = []
+    for i in range(total_pages):
+        writer.add_page(reader.pages[i])
+        temp_path = os.path.join(output_dir, f"split_part_{part}.pdf")
+        with open(temp_path, "wb") as f:
+            writer.write(f)
+        size_mb = os.path.getsize(temp_path) / (1024 * 1024)
+        if size_mb >= target_size_mb or i == total_pages - 1:
+            parts.append(temp_path)
+            part += 1
+            writer = PdfWriter()
+        else:
+            os.remove(temp_path)
+    return parts
+
+
+def measure(split, input_path, target_size_mb):
+    with tempfile.TemporaryDirectory() as output_dir:
+        start = time.perf_counter()
+        parts = split(input_path, target_size_mb, output_dir)
+        seconds = time.perf_counter() - start
+        sizes = [os.path.getsize(part) / (1024 * 1024) for part in parts]
+    return seconds, len(parts), max(sizes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--target-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as scratch:
+        input_path = os.path.join(scratch, "bundle.pdf")
+        large_pdf(input_path, args.pages)
+        size_mb = os.path.getsize(input_path) / (1024 * 1024)
+        before = measure(split_rewriting_every_page, input_path, args.target_mb)
+        after = measure(lambda path, target, output: split_pdf_by_size(path, output, target_size_mb=target),
+                        input_path, args.target_mb)
+    print(f"\n{args.pages} pages, {size_mb:.1f} MB, parts of at most {args.target_mb:g} MB\n")
+    print("| splitter | seconds | parts | largest part MB |")
+    print("|---|---|---|---|")
+    print(f"| rewrite part after every page | {before[0]:.1f} | {before[1]} | {before[2]:.2f} |")
+    print(f"| in-memory page sizes, one write per part | {after[0]:.1f} | {after[1]} | {after[2]:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Retrieval Recall Benchmark
+Measures recall@k of the context builder's candidate ranking over the sample documents in
+backend/data, comparing
+
+  vector : FAISS similarity only
+  hybrid : FAISS similarity fused with the session's BM25 index (reciprocal rank fusion)
+  hybrid + rerank : the hybrid candidates reordered by a reranker (--rerank lexical by default)
+
+Two question sets are generated from the chunks themselves:
+
+  identifier : questions citing a rare identifier of a chunk (clause / letter numbers, amounts,
+               dates) among a few of its words, relevant chunks are the ones containing it
+  content    : a shuffled run of words of a chunk, the relevant chunk is that chunk
+
+With --embeddings fake (default) vectors come from fakes.FakeEmbeddings, a hashed bag-of-words
+model, so no API key is needed; --embeddings openai uses text-embedding-3-large.
+
+    python benchmarks/retrieval_recall.py --questions 200
+"""
+
+import os
+import re
+import sys
+import glob
+import time
+import random
+import argparse
+from pathlib import Path
+from collections import Counter
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+sys.path.insert(0, str(current_dir))
+
+from langchain_community.vectorstores import FAISS
+from document_loader import file_kind, load_pdf, load_text_file, Chunking
+from lexical_index import LexicalIndex, tokenize, STOPWORDS
+from context_builder import ContextBuilder
+from reranker import get_reranker
+from fakes import FakeEmbeddings
+
+DATA_DIR = current_dir.parent / "data"
+KS = (5, 10, 20, 60)
+
+
+def sample_documents():
+    """Text pages of the pdf / docx / txt files of backend/data (scanned pages are skipped, there is no ocr here)."""
+    files = sorted(set(glob.glob(str(DATA_DIR / "*")) + glob.glob(str(DATA_DIR / "upload" / "*" / "*"))))
+    documents = []
+    for file in files:
+        kind = file_kind(file)
+        if kind == "pdf":
+            pages, _ = load_pdf(file)
+            documents.extend(page for page in pages if page.page_content.strip())
+        elif kind == "text":
+            documents.extend(load_text_file(file))
+    return documents
+
+
+def make_questions(texts, count, seed=0):
+    rng = random.Random(seed)
+    terms = [Counter(tokenize(text)) for text in texts]
+    df = Counter(term for counts in terms for term in counts)
+    identifier_questions, content_questions = [], []
+    for position in rng.sample(range(len(texts)), len(texts)):
+        words = [word for word in re.findall(r"[A-Za-z]{4,}", texts[position]) if word.lower() not in STOPWORDS]
+        if len(words) < 8:
+            continue
+        identifiers = [term for term in terms[position]
+                       if re.search(r"\d", term) and len(term) >= 4 and df[term] <= 3 and "." not in term[-1:]]
+        if identifiers and len(identifier_questions) < count:
+            identifier = rng.choice(identifiers)
+            relevant = {i for i, counts in enumerate(terms) if identifier in counts}
+            question = f"What does the document say about {identifier} regarding {' '.join(rng.sample(words, 2))}?"
+            identifier_questions.append((question, relevant))
+        if len(content_questions) < count:
+            start = rng.randrange(0, len(words) - 7)
+            run = words[start:start + 8]
+            rng.shuffle(run)
+            content_questions.append((" ".join(run), {position}))
+        if len(identifier_questions) >= count and len(content_questions) >= count:
+            break
+    return identifier_questions, content_questions
+
+
+def recall(builder, positions, questions):
+    found = {k: 0 for k in KS}
+    start = time.perf_counter()
+    for question, relevant in questions:
+        candidates = builder.retrieve(question)
+        if builder.reranker is not None:
+            candidates = builder.rerank(question, candidates)
+        ranked = [positions[doc.id] for doc, _ in candidates]
+        for k in KS:
+            found[k] += bool(relevant & set(ranked[:k]))
+    milliseconds = (time.perf_counter() - start) * 1000 / len(questions)
+    return {k: found[k] / len(questions) for k in KS}, milliseconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=200, help="questions per set")
+    parser.add_argument("--embeddings", choices=("fake", "openai"), default="fake")
+    parser.add_argument("--dimensions", type=int, default=256, help="size of the fake embeddings")
+    parser.add_argument("--mode", choices=("similarity", "mmr"), default="similarity")
+    parser.add_argument("--rerank", default="lexical", help="reranker of the third row (none to skip it)")
+    args = parser.parse_args()
+
+    chunks = Chunking(sample_documents())
+    texts = [chunk.page_content for chunk in chunks]
+    if args.embeddings == "openai":
+        from Retriever import build_embeddings
+        embeddings = build_embeddings()
+    else:
+        embeddings = FakeEmbeddings(args.dimensions)
+    vector_store = FAISS.from_documents(chunks, embeddings)
+    positions = {doc_id: position for position, doc_id in vector_store.index_to_docstore_id.items()}
+    lexical = LexicalIndex.build([vector_store.docstore.search(vector_store.index_to_docstore_id[position]).page_content
+                                  for position in range(len(texts))])
+    vector = ContextBuilder(vector_store, fetch_k=max(KS), mode=args.mode)
+    hybrid = ContextBuilder(vector_store, fetch_k=max(KS), mode=args.mode, lexical=lexical)
+    builders = [("vector", vector), ("hybrid (bm25 + rrf)", hybrid)]
+    reranker = get_reranker(args.rerank)
+    if reranker is not None:
+        builders.append((f"hybrid + {args.rerank} rerank", ContextBuilder(
+            vector_store, fetch_k=max(KS), mode=args.mode, lexical=lexical, reranker=reranker,
+            rerank_candidates=max(KS), rerank_top_n=max(KS))))
+
+    print(f"\n{len(texts)} chunks of the sample documents, {args.embeddings} embeddings, {args.mode} search\n")
+    print("| questions | retrieval | " + " | ".join(f"recall@{k}" for k in KS) + " | ms / question |")
+    print("|---|---|" + "---|" * (len(KS) + 1))
+    for name, questions in zip(("identifier", "content"), make_questions(texts, args.questions)):
+        for label, builder in builders:
+            result, milliseconds = recall(builder, positions, questions)
+            print(f"| {name} ({len(questions)}) | {label} | " + " | ".join(f"{result[k]:.2f}" for k in KS)
+                  + f" | {milliseconds:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
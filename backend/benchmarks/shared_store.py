@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Shared Document Store Benchmark
+Uploads the same bundle of documents to --sessions sessions, as when several users (or one user,
+again and again) open a session over a common set of files, and compares
+
+  isolated : SHARED_STORE=false, every session loads, chunks, embeds and indexes its own copy
+  shared   : the sessions are views over the shared document store, each file is embedded and
+             stored once and the later sessions only save the list of their documents
+
+For each mode it reports the ingestion time of the first and of the later sessions, the chunks sent
+to the embedding model, the disk taken by the uploads, indexes and store (a file linked several times
+counted once), and the memory of all sessions loaded together : the estimate the session LRU budgets
+with, and the growth of the process RSS once every session answered a question.
+
+The bundle is a generated corpus plus the sample files of backend/data, embeddings / OCR are the
+local stand-ins of fakes.py with simulated latency, no API key is needed.
+
+    python benchmarks/shared_store.py --sessions 5 --pages 400
+"""
+
+import os
+import gc
+import sys
+import time
+import shutil
+import argparse
+import contextlib
+from pathlib import Path
+import numpy as np
+
+current_dir = Path(__file__).parent
+sys.path.insert(0, str(current_dir.parent / "src"))
+sys.path.insert(0, str(current_dir))
+## end_to_end sets up the offline environment : scratch folder and store, fake OCR, no embedding cache
+from end_to_end import SCRATCH, PeakRSS, generate_corpus, copy_sample_data
+import ocr
+import document_store
+import Retriever as retriever_module
+from Retriever import Retriever
+from index_factory import EMBED_DIMENSIONS
+from session_store import SessionStore, disk_usage, file_hash, record_upload_hashes
+from fakes import FakeEmbeddings, FakeChatModel, FakeOCR
+
+
+def upload(bundle, folder):
+    """Copies the bundle into a session folder the way /upload commits it : hashed, shared with the store, recorded."""
+    os.makedirs(folder)
+    hashes = {}
+    for name in sorted(os.listdir(bundle)):
+        shutil.copy(os.path.join(bundle, name), folder)
+        hashes[name] = file_hash(os.path.join(folder, name))
+    document_store.share_files(folder, hashes)
+    record_upload_hashes(folder, hashes)
+
+
+def run(mode, bundle, args, embedded, quiet):
+    shared = mode == "shared"
+    document_store.SHARED_STORE = retriever_module.SHARED_STORE = shared
+    upload_dir = os.path.join(SCRATCH, mode)
+    times = []
+    embedded.clear()
+    with quiet():
+        for number in range(args.sessions):
+            folder = os.path.join(upload_dir, f"00000000-0000-4000-8000-{number:012d}")
+            upload(bundle, folder)
+            start = time.perf_counter()
+            Retriever(folder).retriever()
+            times.append(time.perf_counter() - start)
+        seen = set()
+        disk = disk_usage(upload_dir, seen) + (disk_usage(document_store.DOCUMENT_STORE_DIR, seen) if shared else 0)
+        gc.collect()
+        rss = PeakRSS.status("VmRSS") or 0
+        store = SessionStore(upload_dir, lambda folder: Retriever(folder).load())
+        for session_id in store.session_ids():
+            store.get(session_id)["retriever"].invoke("delay notice under the contract")
+        gc.collect()
+        growth = (PeakRSS.status("VmRSS") or 0) - rss
+        estimate = store.loaded_bytes()
+    return {
+        "first_s": times[0],
+        "next_s": float(np.mean(times[1:])) if len(times) > 1 else None,
+        "embedded": sum(embedded),
+        "disk_mb": disk / 2**20,
+        "estimate_mb": estimate / 2**20,
+        "rss_mb": growth / 2**20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=400, help="pages of the generated corpus of the bundle")
+    parser.add_argument("--scanned-share", type=float, default=0.1, help="share of generated pages that are image only (OCR)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--embed-latency-per-text", type=float, default=0.0002, help="seconds per embedded chunk")
+    parser.add_argument("--ocr-latency", type=float, default=0.2, help="seconds per ocr request")
+    parser.add_argument("--ocr-page-latency", type=float, default=0.01, help="seconds per ocr'd page")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own logs")
+    args = parser.parse_args()
+
+    embedded = []
+
+    class CountingEmbeddings(FakeEmbeddings):
+        def embed_documents(self, texts):
+            embedded.append(len(texts))
+            return super().embed_documents(texts)
+
+    retriever_module.build_embeddings = lambda dimensions=EMBED_DIMENSIONS, **kwargs: CountingEmbeddings(
+        dimensions, latency=args.embed_latency, latency_per_text=args.embed_latency_per_text)
+    retriever_module.ChatOpenAI = lambda **kwargs: FakeChatModel()
+    ocr_backend = FakeOCR(args.ocr_latency, args.ocr_page_latency)
+    ocr.register_ocr_backend("fake", lambda: ocr_backend)
+    null = open(os.devnull, "w")
+
+    def quiet():
+        return contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(null)
+
+    try:
+        bundle = os.path.join(SCRATCH, "bundle")
+        generate_corpus(bundle, args.pages, args.scanned_share)
+        copy_sample_data(bundle)
+        results = {}
+        for mode in ("isolated", "shared"):
+            print(f"INFO : {mode} ...", file=sys.stderr)
+            results[mode] = run(mode, bundle, args, embedded, quiet)
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+    print(f"\n{args.sessions} sessions of the same bundle ({args.pages} generated pages + sample data), "
+          f"embedding {args.embed_latency * 1000:g} ms + {args.embed_latency_per_text * 1000:g} ms/chunk, "
+          f"ocr {args.ocr_latency * 1000:g} ms + {args.ocr_page_latency * 1000:g} ms/page, "
+          f"{EMBED_DIMENSIONS}-d vectors, {os.cpu_count()} CPU\n")
+    print("| mode | first ingest s | next ingests s | chunks embedded | disk MB | memory estimate MB | RSS growth MB |")
+    print("|---|---|---|---|---|---|---|")
+    for mode, row in results.items():
+        next_s = f"{row['next_s']:.2f}" if row["next_s"] is not None else "-"
+        print(f"| {mode} | {row['first_s']:.2f} | {next_s} | {row['embedded']} | {row['disk_mb']:.1f} "
+              f"| {row['estimate_mb']:.1f} | {row['rss_mb']:.1f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark
+How long a worker takes to start, each run in a fresh process without OPENAI_API_KEY:
+
+  import main       : importing the app, what every uvicorn worker and RELOAD=true restart pays
+  eager imports     : importing main, Retriever and workflow, what the app imported before they were lazy
+  first response    : from launching uvicorn to the first answer of /health (port open)
+  warm              : from launching uvicorn to /health reporting the warm-up (modules + recent sessions) done
+
+The slowest modules imported by main are listed from `python -X importtime`. With --check the run
+fails when the median `import main` is over --budget seconds, e.g. in CI.
+
+    python benchmarks/startup.py --runs 5 --budget 1.0
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import subprocess
+import urllib.request
+from pathlib import Path
+import numpy as np
+
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+
+
+def environment():
+    env = {key: value for key, value in os.environ.items() if key != "OPENAI_API_KEY"}
+    env["PYTHONPATH"] = str(src_dir)
+    ## no sweeps, and no .env credentials either
+    env["SESSION_SWEEP_INTERVAL_S"] = "0"
+    env["OPENAI_API_KEY"] = ""
+    return env
+
+
+def import_seconds(modules):
+    code = f"import time; start = time.perf_counter(); import {', '.join(modules)}; print(time.perf_counter() - start)"
+    result = subprocess.run([sys.executable, "-c", code], cwd=src_dir, env=environment(),
+                            capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(count):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=src_dir, env=environment(),
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        ## modules imported by main itself, nested one level below it
+        if cumulative.strip().isdigit() and name.startswith("   ") and not name.startswith("    "):
+            rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_times(timeout=120):
+    """Seconds from launching uvicorn to the first /health answer, and to /health reporting warm."""
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                              cwd=src_dir, env=environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first = warm = None
+    try:
+        while time.perf_counter() - start < timeout and warm is None:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    body = response.read().decode()
+                first = first or time.perf_counter() - start
+                if '"warm":true' in body.replace(" ", ""):
+                    warm = time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.02)
+    finally:
+        server.terminate()
+        server.wait()
+    return first, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed for `import main`")
+    parser.add_argument("--check", action="store_true", help="exit 1 when `import main` is over the budget")
+    parser.add_argument("--top", type=int, default=8, help="slowest modules listed")
+    args = parser.parse_args()
+
+    rows = {"import main": [], "eager imports": [], "first response": [], "warm": []}
+    for _ in range(args.runs):
+        rows["import main"].append(import_seconds(["main"]))
+        rows["eager imports"].append(import_seconds(["main", "Retriever", "workflow"]))
+        first, warm = server_times()
+        rows["first response"].append(first)
+        rows["warm"].append(warm)
+
+    print(f"\n{args.runs} runs, fresh process each, {os.cpu_count()} CPU\n")
+    print("| step | p50 s | max s |")
+    print("|---|---|---|")
+    for name, times in rows.items():
+        times = [value for value in times if value is not None]
+        if times:
+            print(f"| {name} | {np.percentile(times, 50):.2f} | {max(times):.2f} |")
+    print("\n| module (cumulative) | s |")
+    print("|---|---|")
+    for seconds, name in slowest_imports(args.top):
+        print(f"| {name} | {seconds:.3f} |")
+
+    median = float(np.percentile(rows["import main"], 50))
+    print(f"\nimport main : {median:.2f}s, budget {args.budget:.2f}s")
+    if median > args.budget:
+        print("ERROR : import main is over its budget")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
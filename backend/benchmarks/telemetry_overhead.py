@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Telemetry Overhead Benchmark
+Cost of the spans recorded on every question, measured two ways:
+
+  per call : record() and span() alone, with and without their json log line
+  per question : the session's RAG chain answering questions back to back (fake models, no latency,
+                 so the pipeline's own work is all that is timed), with telemetry off, metrics only
+                 (TRACE_LOG=false) and metrics + json logs
+
+Log lines go to /dev/null, so the cost measured is formatting them, not the terminal.
+
+    python benchmarks/telemetry_overhead.py --questions 300
+"""
+
+import os
+import sys
+import time
+import argparse
+import contextlib
+from pathlib import Path
+import numpy as np
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+sys.path.insert(0, str(current_dir))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import telemetry
+import context_builder
+import RAG
+from workflow import workflow
+from fakes import FakeChatModel
+from ask_latency import build_session, WORDS
+
+
+def per_call(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def time_span():
+    with telemetry.span("benchmark", chunks=10, tokens=500):
+        pass
+
+
+def answer_times(rag, questions):
+    times = []
+    for question in questions:
+        start = time.perf_counter()
+        rag.run(question, use_cache=False)
+        times.append(time.perf_counter() - start)
+    return np.array(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=300)
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    rows = []
+    with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+        for log in (False, True):
+            telemetry.TRACE_LOG = log
+            rows.append((f"record(), log {'on' if log else 'off'}",
+                         per_call(lambda: telemetry.record("benchmark", 0.001, chunks=10), args.calls)))
+            rows.append((f"span(), log {'on' if log else 'off'}", per_call(time_span, args.calls)))
+
+        retriever = build_session(args.chunks, args.dimensions, 0.0)
+        rag = workflow(FakeChatModel(), retriever, "benchmark").rag
+        rng = np.random.default_rng(1)
+        questions = [" ".join(rng.choice(WORDS, size=8)) + "?" for _ in range(args.questions)]
+        answer_times(rag, questions[:20])
+        recorders = (context_builder.record, RAG.record, RAG.span)
+        results = []
+        for name, log, enabled in (("off", False, False), ("metrics", False, True), ("metrics + json logs", True, True)):
+            telemetry.TRACE_LOG = log
+            if enabled:
+                context_builder.record, RAG.record, RAG.span = recorders
+            else:
+                context_builder.record = RAG.record = lambda *args, **kwargs: None
+                RAG.span = lambda *args, **kwargs: contextlib.nullcontext(telemetry.Span("off", {}))
+            results.append((name, answer_times(rag, questions)))
+
+    print(f"\nper call, {args.calls} calls\n")
+    print("| call | µs |")
+    print("|---|---|")
+    for name, micros in rows:
+        print(f"| {name} | {micros:.1f} |")
+    print(f"\nper question, {args.questions} questions, {args.chunks} chunks of {args.dimensions}-d vectors\n")
+    print("| telemetry | p50 ms | p95 ms | overhead p50 |")
+    print("|---|---|---|---|")
+    base = np.percentile(results[0][1], 50)
+    for name, times in results:
+        p50 = np.percentile(times, 50)
+        print(f"| {name} | {p50:.2f} | {np.percentile(times, 95):.2f} | {(p50 - base) / base:+.1%} |")
+
+
+if __name__ == "__main__":
+    main()
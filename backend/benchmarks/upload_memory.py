@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Upload Memory Benchmark
+Peak Python memory and time of writing the files of one upload request to a session folder:
+
+  read : the previous handler, `f.write(await file.read())` for each file in turn
+  streamed : uploads.stage_uploads, blocks of UPLOAD_BLOCK_KB copied and hashed, UPLOAD_CONCURRENCY files at a time
+
+The files are what Starlette hands the endpoint : spooled temporary files, already on disk
+past 1 MB. Memory is measured with tracemalloc (allocations of the copy, not the spool).
+
+    python benchmarks/upload_memory.py --files 4 --mb 100
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+# Add the src directory to the Python path
+current_dir = Path(__file__).parent
+src_dir = current_dir.parent / "src"
+sys.path.insert(0, str(src_dir))
+
+from fastapi import UploadFile
+from uploads import stage_uploads
+
+
+def make_uploads(count, size_mb):
+    block = os.urandom(1024 * 1024)
+    uploads = []
+    for i in range(count):
+        spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+        for _ in range(size_mb):
+            spool.write(block)
+        spool.seek(0)
+        uploads.append(UploadFile(spool, filename=f"scan-{i}.pdf", size=size_mb * 1024 * 1024))
+    return uploads
+
+
+async def read_whole(files, folder):
+    for file in files:
+        with open(os.path.join(folder, file.filename), "wb") as f:
+            f.write(await file.read())
+
+
+async def streamed(files, folder):
+    for item in await stage_uploads(files, folder):
+        item.commit()
+
+
+def measure(handler, count, size_mb):
+    files = make_uploads(count, size_mb)
+    with tempfile.TemporaryDirectory() as folder:
+        tracemalloc.start()
+        start = time.perf_counter()
+        asyncio.run(handler(files, folder))
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    for file in files:
+        file.file.close()
+    return peak / 2**20, seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=4)
+    parser.add_argument("--mb", type=int, default=100, help="size of each file")
+    args = parser.parse_args()
+    print(f"\n{args.files} files of {args.mb} MB\n")
+    print("| handler | peak MB | seconds |")
+    print("|---|---|---|")
+    for name, handler in (("read whole file", read_whole), ("streamed + sha256", streamed)):
+        peak, seconds = measure(handler, args.files, args.mb)
+        print(f"| {name} | {peak:.1f} | {seconds:.2f} |")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,52 @@
 import os
-import faiss
-from dotenv import load_dotenv
-from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.document_loaders import PyMuPDFLoader
-from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
+import time
+import asyncio
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI,OpenAI
-from document_loader import document_loaders,Chunking
-# Load environment variables
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if openai_api_key is not None:
-    os.environ["OPENAI_API_KEY"] = openai_api_key
-else:
-    raise EnvironmentError("OPENAI_API_KEY not found in environment variables.")
+from langchain_core.runnables import RunnableLambda
+from context_builder import ContextBuilder,CONTEXT_SEPARATOR
+from tabular import TableQA,TABULAR_QUERY_ENABLED
+from session_store import load_lexical
+from reranker import get_reranker,is_registered
+from answer_cache import get_answer_cache,EXACT,SEMANTIC,MISS,BYPASS
+from telemetry import span,record
+from tokens import count_tokens
 
 class RAG:
-    def __init__(self, folder_path,retriever,llm):
+    def __init__(self, folder_path,retriever,llm,fingerprint=None,cache=None,settings=None):
         """This is init method for module 1 and 2 
 
         Args:
             folder_path (_type_): _description_
+            fingerprint (str, optional): document set fingerprint of the session, enables the answer cache
+            cache (AnswerCache, optional): answer cache. Defaults to the process-wide one.
+            settings (dict, optional): session options : rerank (none, lexical, cross-encoder), rerank_candidates, rerank_top_n
         """
         self.folder_path = folder_path
         self.retriever = retriever
         self.llm = llm
+        ## packs the retrieved chunks into a token budget instead of passing all of them
+        settings = settings or {}
+        self.context_builder = ContextBuilder(
+            retriever.vectorstore,
+            lexical=load_lexical(folder_path),
+            ## a session can only name a registered reranker, any other saved name gets the default
+            reranker=get_reranker(settings.get("rerank") if is_registered(settings.get("rerank")) else None),
+            rerank_candidates=settings.get("rerank_candidates"),
+            rerank_top_n=settings.get("rerank_top_n"),
+        )
+        ## questions about the rows of csv / xlsx tables are answered by a query on the table
+        self.tables = TableQA(folder_path,llm) if TABULAR_QUERY_ENABLED else None
+        ## answers are cached per document set, without a fingerprint there is nothing safe to key them on
+        self.fingerprint = fingerprint
+        self.cache = (cache or get_answer_cache()) if fingerprint else None
+        self.model = getattr(llm,"model_name",None) or getattr(llm,"model",None) or llm._llm_type
+        ## the prompt and chain are built once and reused for every question of the session
+        self.answer_chain = self.prompt() | self.llm | StrOutputParser()
 
-    def run(self,query : str) -> str:
-        """This run method for ModuleFourAndFive class.
-        Args:
-            query (_String_): asked query by user.
-        Returns:
-            ans (_string_): llm response
-
-        """
-        prompt = PromptTemplate(
+    def prompt(self) -> PromptTemplate:
+        """prompt method returns the banking expert prompt, filled with `text` (context) and `question`."""
+        return PromptTemplate(
         template="""
         You are a highly experienced Banking Domain Expert with deep knowledge of
         retail banking, corporate banking, risk management, compliance, loans, 
@@ -60,16 +69,131 @@ class RAG:
         input_variables=["text", "question"]
         )
 
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-        rag_chain = (
-        {"text": self.retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | self.llm
-        | StrOutputParser()
-        )
-        ans = rag_chain.invoke(query)
+    def context(self,query : str,embedding : list = None,filters : dict = None) -> tuple:
+        """context method returns (context text, stats) of a question : the retrieved passages (among the chunks
+        matching `filters`), followed by the result of a query on the tables whose summaries were retrieved."""
+        context,stats = self.context_builder.assemble(query,embedding,filters)
+        if self.tables is not None and stats["tables"]:
+            result = self.tables.context(query,stats["tables"])
+            if result:
+                context = context + CONTEXT_SEPARATOR + result
+        return context,stats
+
+    def cached_answer(self,query : str,use_cache : bool = True,filters : dict = None) -> tuple:
+        """cached_answer method looks a question up in the answer cache, exactly and then by similarity.
+
+        Args:
+            query (_String_): asked query by user.
+            use_cache (bool, optional): False to bypass the cache (the fresh answer still replaces the cached one).
+            filters (dict, optional): metadata filters of the question; filtered answers are not cached
+        Returns:
+            tuple: (cached answer or None, outcome, query embedding or None); on a miss the
+            embedding is handed to retrieval so the question is embedded only once
+        """
+        if self.cache is None or filters:
+            return None,None,None
+        if use_cache:
+            answer = self.cache.get(self.fingerprint,self.model,query)
+            if answer is not None:
+                self.cache.record(EXACT)
+                return answer,EXACT,None
+        embedding = self.context_builder.embed(query) if self.cache.semantic else None
+        if use_cache and embedding is not None:
+            answer,score = self.cache.get_similar(self.fingerprint,self.model,embedding)
+            if answer is not None:
+                print(f"INFO : answer cache : semantic hit, similarity {score:.3f}")
+                self.cache.record(SEMANTIC)
+                return answer,SEMANTIC,embedding
+        outcome = MISS if use_cache else BYPASS
+        self.cache.record(outcome)
+        return None,outcome,embedding
+
+    def store_answer(self,query : str,answer : str,embedding : list,outcome : str):
+        """store_answer method caches a freshly generated answer."""
+        if self.cache is not None and outcome in (MISS,BYPASS) and answer:
+            self.cache.put(self.fingerprint,self.model,query,answer,embedding)
+
+    def run(self,query : str,use_cache : bool = True,filters : dict = None) -> str:
+        """This run method for ModuleFourAndFive class.
+        Args:
+            query (_String_): asked query by user.
+            use_cache (bool, optional): False to bypass the answer cache.
+            filters (dict, optional): metadata filters applied before retrieval, see metadata_filter.parse_filters
+        Returns:
+            ans (_string_): llm response
+
+        """
+        ans,outcome,embedding = self.cached_answer(query,use_cache,filters)
+        if ans is not None:
+            return ans
+        context,context_stats = self.context(query,embedding,filters)
+        with span("llm",model=self.model,context_tokens=context_stats["tokens"]) as current:
+            ans = self.answer_chain.invoke({"text": context, "question": query})
+            current.set(tokens=count_tokens(ans))
+        self.store_answer(query,ans,embedding,outcome)
+        return ans
+
+    async def arun(self,query : str,use_cache : bool = True,filters : dict = None) -> str:
+        """arun method is the async version of run; cache lookup and retrieval run in a worker thread and the llm call is awaited.
+        Args:
+            query (_String_): asked query by user.
+            use_cache (bool, optional): False to bypass the answer cache.
+            filters (dict, optional): metadata filters applied before retrieval
+        Returns:
+            ans (_string_): llm response
+        """
+        ans,outcome,embedding = await asyncio.to_thread(self.cached_answer,query,use_cache,filters)
+        if ans is not None:
+            return ans
+        context,context_stats = await asyncio.to_thread(self.context,query,embedding,filters)
+        with span("llm",model=self.model,context_tokens=context_stats["tokens"]) as current:
+            ans = await self.answer_chain.ainvoke({"text": context, "question": query})
+            current.set(tokens=count_tokens(ans))
+        await asyncio.to_thread(self.store_answer,query,ans,embedding,outcome)
         return ans
+
+    async def astream(self,query : str,metrics : dict = None,use_cache : bool = True,filters : dict = None):
+        """astream method streams the answer token by token as the llm emits it.
+
+        Retrieval runs first (in a worker thread), then the prompt is streamed through the llm.
+        Closing the generator (e.g. when the client disconnects) cancels the llm call.
+        A cached answer is sent as a single chunk.
+
+        Args:
+            query (_String_): asked query by user.
+            metrics (dict, optional): filled with retrieval_ms (of which rerank_ms), time_to_first_token_ms, generation_ms, total_ms, cache
+            use_cache (bool, optional): False to bypass the answer cache.
+            filters (dict, optional): metadata filters applied before retrieval
+        Yields:
+            str: answer tokens
+        """
+        metrics = {} if metrics is None else metrics
+        start = time.perf_counter()
+        ans,outcome,embedding = await asyncio.to_thread(self.cached_answer,query,use_cache,filters)
+        metrics["cache"] = outcome
+        if ans is not None:
+            metrics["time_to_first_token_ms"] = metrics["total_ms"] = round((time.perf_counter() - start) * 1000,1)
+            metrics["chunks_streamed"] = 1
+            yield ans
+            return
+        context,context_stats = await asyncio.to_thread(self.context,query,embedding,filters)
+        metrics["retrieval_ms"] = round((time.perf_counter() - start) * 1000,1)
+        tokens = 0
+        answer = []
+        async for token in self.answer_chain.astream({"text": context, "question": query}):
+            if tokens == 0:
+                metrics["time_to_first_token_ms"] = round((time.perf_counter() - start) * 1000,1)
+            tokens += 1
+            answer.append(token)
+            yield token
+        metrics["generation_ms"] = round((time.perf_counter() - start) * 1000 - metrics["retrieval_ms"],1)
+        metrics["total_ms"] = round((time.perf_counter() - start) * 1000,1)
+        metrics["chunks_streamed"] = tokens
+        metrics["context_tokens"] = context_stats["tokens"]
+        metrics["rerank_ms"] = context_stats["rerank_ms"]
+        record("llm",metrics["generation_ms"] / 1000,model=self.model,context_tokens=context_stats["tokens"],
+               tokens=count_tokens("".join(answer)),time_to_first_token_ms=metrics.get("time_to_first_token_ms"),streamed=True)
+        await asyncio.to_thread(self.store_answer,query,"".join(answer),embedding,outcome)
 # obj = ModuleFourAndFive("/Users/sameersingh/Documents/masin_ai/data/module1&2/Khabourah_school-_Final_EOT_report.pdf")
 # questions = """
 # write an EOT letter from the atteched report.
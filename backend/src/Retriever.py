@@ -1,58 +1,280 @@
 import os
-import faiss
-from dotenv import load_dotenv
+import glob
+import numpy as np
 # from langchain_anthropic import ChatAnthropic
 from langchain_community.docstore.in_memory import InMemoryDocstore
-from langchain_community.document_loaders import PyMuPDFLoader
 from langchain_community.vectorstores import FAISS
-from langchain_openai import OpenAIEmbeddings
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_openai import ChatOpenAI,OpenAI
-from document_loader import document_loaders,Chunking
-# Load environment variables
-load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
-if openai_api_key is not None:
-    os.environ["OPENAI_API_KEY"] = openai_api_key
-else:
-    raise EnvironmentError("OPENAI_API_KEY not found in environment variables.")
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_openai import OpenAIEmbeddings,ChatOpenAI
+from document_loader import iter_documents,iter_chunks
+from embedding_pipeline import EmbeddingPipeline
+from index_factory import AdaptiveIndex,EMBED_DIMENSIONS,INDEX_METRIC,resolve_type,build_index,describe
+from embedding_cache import get_embedding_cache
+from session_store import save_vector_store,save_view,load_vector_store,read_view,document_hashes,read_manifest,index_dir,disk_usage
+from document_store import SHARED_STORE,store_profile,document_key,claim_document,write_document,open_document,restore_table
+from telemetry import span,trace
+from context_builder import RETRIEVAL_FETCH_K
+from tabular import is_table,table_path
+from chunker import CHUNKER,CHUNK_TOKENS,CHUNK_MIN_TOKENS,CHUNK_OVERLAP_TOKENS,parse_date
+from ocr import OCR_BACKEND
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+CHAT_MODEL = "gpt-4.1-2025-04-14"
+
+def require_api_key():
+    """require_api_key method raises when OPENAI_API_KEY is missing. It is checked when a model is first built
+    rather than at import, so the server starts (and serves status, metrics...) without credentials."""
+    if not os.getenv("OPENAI_API_KEY"):
+        raise EnvironmentError("OPENAI_API_KEY not found in environment variables.")
+
+def build_embeddings(dimensions : int = EMBED_DIMENSIONS, **kwargs) -> OpenAIEmbeddings:
+    """build_embeddings method returns the embedding model, shortened to `dimensions` when below the full 3072."""
+    require_api_key()
+    if dimensions < 3072:
+        kwargs["dimensions"] = dimensions
+    return OpenAIEmbeddings(model=EMBEDDING_MODEL,**kwargs)
+
+def build_llm() -> ChatOpenAI:
+    """build_llm method returns the chat model that answers the questions of a session."""
+    require_api_key()
+    return ChatOpenAI(model=CHAT_MODEL,temperature=1)
 
 class Retriever:
-    def __init__(self,folder_path):
+    def __init__(self,folder_path,job=None):
         self.folder_path = folder_path
+        ## optional ingestion job, used to report progress and to stop early when cancelled
+        self.job = job
+        self.embedding_stats = {}
+        self.files_loaded = 0
+        self.failed_files = []
+        self.documents = 0
+        self.chunks_total = 0
 
-    def retriever(self):
+    def report(self,status=None,**progress):
+        if self.job is not None:
+            self.job.update(status,**progress)
+
+    def commit(self):
+        ## last point where a cancel stops the job, the saved index is replaced right after
+        if self.job is not None:
+            self.job.commit()
+
+    def file_loaded(self,file,pages,seconds,error):
+        """file_loaded method records the outcome of one file of the stream, a failed file does not stop the others."""
+        if error is None:
+            self.files_loaded += 1
+        else:
+            self.failed_files.append(os.path.basename(file))
+        self.report(files_loaded=self.files_loaded,failed_files=list(self.failed_files))
+
+    def chunked(self,document,chunks):
+        self.documents += 1
+        self.chunks_total += len(chunks)
+        ## the job is embedding as soon as the first document is chunked, while later files still load
+        self.report("embedding" if self.documents == 1 else None,documents=self.documents,chunks_total=self.chunks_total)
+
+    def embed_files(self,vector_store,index,names=None):
         """
-        retriever method is responsible for extracting text from documents, chunking and creating the embeddings and then store those embeddings into the vector database.
+        embed_files method loads, chunks and embeds the files of the folder (or only `names`) into the vector store.
         """
-        ## loading the files
+        ## loading the files, in parallel and as a stream : chunking and embedding start with the first file done
         print("INFO : loading the files......")
-        document = document_loaders(self.folder_path)
+        files_total = len(names) if names is not None else len(glob.glob(self.folder_path + "/*"))
+        self.report("loading",files_total=files_total)
+        documents = iter_documents(self.folder_path,on_file=self.file_loaded,names=names)
         ## creating Chunking
         print("INFO : creating Chunking......")
-        chunks = Chunking(document)
+        chunks = iter_chunks(documents,on_chunks=self.chunked)
+        ## embedding in token-budgeted batches, finished batches are streamed into the vector store
+        print("INFO : adding embeddings in vector store")
+        dimensions = vector_store.index.d
+        pipeline = EmbeddingPipeline(
+            vector_store.embedding_function.embed_documents,
+            on_progress=lambda done,stats: self.report(chunks_embedded=done),
+            cache=get_embedding_cache(EMBEDDING_MODEL,dimensions),
+        )
+        self.embedding_stats = pipeline.run(chunks,index.add)
+        self.report(
+            chunks_per_second=self.embedding_stats["chunks_per_second"],
+            tokens_per_second=self.embedding_stats["tokens_per_second"],
+            cache_hits=self.embedding_stats["cache_hits"],
+            cache_misses=self.embedding_stats["cache_misses"],
+        )
+
+    def save(self,vector_store,index,hashes):
+        """
+        save method finalizes the index and writes it next to the uploads, with the hashes of the files it holds.
+        """
+        print("INFO : saving index......")
+        self.report("indexing")
+        with span("index_build",chunks=vector_store.index.ntotal) as current:
+            index.finalize()
+            ## files that failed to load are left out of the manifest, so the next update retries them
+            hashes = {name: digest for name,digest in hashes.items() if name not in self.failed_files}
+            self.commit()
+            save_vector_store(vector_store,self.folder_path,hashes)
+            current.set(index=type(vector_store.index).__name__,bytes=disk_usage(index_dir(self.folder_path)))
+        retriever=vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_FETCH_K})
+        llm = build_llm()
+        return retriever,llm
+
+    def retriever(self):
+        """
+        retriever method is responsible for extracting text from documents, chunking and creating the embeddings and then store those embeddings into the vector database.
+        """
+        ## every span of the ingestion is tagged with the session id
+        with trace(os.path.basename(self.folder_path)),span("ingest",mode="build") as current:
+            result = self.build()
+            current.set(files=self.files_loaded,pages=self.documents,chunks=self.chunks_total)
+            return result
+
+    def build(self):
+        hashes = document_hashes(self.folder_path)
+        if SHARED_STORE:
+            return self.share(hashes)
         ## creating embeddings
         print("INFO : creating embeddings.......")
-        embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-        ## creating index 
-        print("INFO : creating index  ........")
-        index = faiss.IndexFlatL2(3072) 
+        ## retries are left to the pipeline so that rate limits lower its concurrency
+        embeddings = build_embeddings(max_retries=0)
         ## creating vector stores
         print("INFO : creating vector stores......")
-        vector_store=FAISS(
+        vector_store=self.new_store(embeddings)
+        ## creating index, flat at first and upgraded to hnsw / ivf-pq as the number of chunks grows
+        print("INFO : creating index  ........")
+        index = AdaptiveIndex(vector_store,EMBED_DIMENSIONS)
+        self.embed_files(vector_store,index)
+        if vector_store.index.ntotal == 0:
+            raise ValueError(f"no text could be extracted from the documents ({len(self.failed_files)} failed to load)")
+        ## saving index and docstore next to the uploads, sessions are served from this copy
+        return self.save(vector_store,index,hashes)
+
+    def update(self):
+        """
+        update method brings the saved index of the folder in line with its files : chunks of deleted or
+        replaced files are removed, new or replaced files are embedded, unchanged files are left as they are.
+        """
+        with trace(os.path.basename(self.folder_path)),span("ingest",mode="update") as current:
+            result = self.apply_update()
+            current.set(files=self.files_loaded,pages=self.documents,chunks=self.chunks_total)
+            return result
+
+    def apply_update(self):
+        hashes = document_hashes(self.folder_path)
+        if SHARED_STORE:
+            return self.share(hashes,update=True)
+        if read_view(self.folder_path) is not None:
+            ## a session over the shared store gets its own index back, from the embedding cache
+            return self.build()
+        ## a writable copy of the saved index, the one being served stays untouched until it is replaced
+        vector_store = load_vector_store(self.folder_path,lambda dimensions: build_embeddings(dimensions,max_retries=0),mmap=False)
+        indexed = read_manifest(self.folder_path)
+        if indexed is None:
+            ## index saved without a manifest : every file it holds is treated as changed
+            indexed = {os.path.basename(doc.metadata.get("source","")): None for doc in vector_store.docstore._dict.values()}
+        added = [name for name,digest in hashes.items() if indexed.get(name) != digest]
+        removed = [name for name,digest in indexed.items() if hashes.get(name) != digest]
+        print(f"INFO : updating index : {len(added)} new or changed files, {len(removed)} removed or replaced, "
+              f"{len(hashes) - len(added)} unchanged")
+        self.report(files_removed=len(removed),files_unchanged=len(hashes) - len(added))
+        index = AdaptiveIndex(vector_store,vector_store.index.d)
+        if removed:
+            removed = set(removed)
+            doc_ids = [doc_id for doc_id,doc in vector_store.docstore._dict.items()
+                       if os.path.basename(doc.metadata.get("source","")) in removed]
+            index.remove(doc_ids)
+            for name in removed:
+                ## the parquet copy of a deleted or replaced table goes with it
+                if is_table(name) and os.path.exists(table_path(os.path.join(self.folder_path,name))):
+                    os.remove(table_path(os.path.join(self.folder_path,name)))
+            print(f"INFO : removed {len(doc_ids)} chunks of {len(removed)} files")
+        if added:
+            self.embed_files(vector_store,index,names=added)
+        return self.save(vector_store,index,hashes)
+
+    def new_store(self,embeddings):
+        return FAISS(
             embedding_function=embeddings,
-            index=index,
+            index=None,
             docstore=InMemoryDocstore(),
             index_to_docstore_id={},
+            normalize_L2=INDEX_METRIC == "cosine",
+            distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT if INDEX_METRIC == "ip" else DistanceStrategy.EUCLIDEAN_DISTANCE,
         )
-        ## adding embeddings in vector store
-        print("INFO : adding embeddings in vector store")
-        vector_store.add_documents(chunks)
-        ## creating retriever
-        print("INFO :  creating retriever.......")
-        retriever=vector_store.as_retriever(search_kwargs={"k": 230})
-        print("INFO : intilizing llm's gpt 5..........")
-        llm = ChatOpenAI(model="gpt-4.1-2025-04-14",temperature=1)
-        return retriever,llm
\ No newline at end of file
+
+    def share(self,hashes,update=False):
+        """
+        share method builds the session as a view over the shared document store : files already stored (by this or
+        any other session) are reused as they are, only the others are loaded, chunked and embedded, then stored.
+        """
+        profile = store_profile(EMBEDDING_MODEL,EMBED_DIMENSIONS,INDEX_METRIC,
+                                (OCR_BACKEND,CHUNKER,CHUNK_TOKENS,CHUNK_MIN_TOKENS,CHUNK_OVERLAP_TOKENS))
+        keys = {name: document_key(digest,name if is_table(name) or parse_date(name) else None) for name,digest in hashes.items()}
+        if update:
+            indexed = read_manifest(self.folder_path) or {}
+            removed = [name for name,digest in indexed.items() if hashes.get(name) != digest]
+            for name in removed:
+                ## the parquet copy of a deleted or replaced table goes with it
+                if is_table(name) and os.path.exists(table_path(os.path.join(self.folder_path,name))):
+                    os.remove(table_path(os.path.join(self.folder_path,name)))
+            unchanged = sum(indexed.get(name) == digest for name,digest in hashes.items())
+            self.report(files_removed=len(removed),files_unchanged=unchanged)
+        missing = [name for name in hashes if not claim_document(profile,keys[name])]
+        print(f"INFO : {len(hashes) - len(missing)} of {len(hashes)} files are in the document store, embedding {len(missing)}")
+        self.report(files_shared=len(hashes) - len(missing))
+        if missing:
+            ## retries are left to the pipeline so that rate limits lower its concurrency
+            staging = self.new_store(build_embeddings(max_retries=0))
+            self.embed_files(staging,AdaptiveIndex(staging,EMBED_DIMENSIONS,index_type="flat"),names=missing)
+            self.store(staging,profile,keys,missing)
+        ## files that failed to load are left out of the view and the manifest, so the next update retries them
+        names = [name for name in hashes if name not in self.failed_files]
+        for name in names:
+            if is_table(name):
+                restore_table(profile,keys[name],table_path(os.path.join(self.folder_path,name)))
+        print("INFO : saving view......")
+        self.report("indexing")
+        documents = [open_document(profile,keys[name]) for name in names]
+        chunks = sum(len(document) for document in documents)
+        if chunks == 0 and not update:
+            raise ValueError(f"no text could be extracted from the documents ({len(self.failed_files)} failed to load)")
+        with span("index_build",chunks=chunks) as current:
+            ## an exact search of the shared vectors, unless the session is large enough for an approximate index of its own
+            index = None
+            if resolve_type(chunks) != "flat":
+                index = build_index([document.vectors for document in documents],EMBED_DIMENSIONS)
+            view = {"profile": profile, "dimensions": EMBED_DIMENSIONS, "metric": INDEX_METRIC,
+                    "documents": [[name,keys[name],len(document)] for name,document in zip(names,documents)]}
+            self.commit()
+            save_view(self.folder_path,view,[text for document in documents for text in document.texts],
+                      {name: hashes[name] for name in names},index)
+            current.set(index=describe(index) if index is not None else "shared",bytes=disk_usage(index_dir(self.folder_path)))
+        vector_store = load_vector_store(self.folder_path,build_embeddings)
+        retriever=vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_FETCH_K})
+        llm = build_llm()
+        return retriever,llm
+
+    def store(self,staging,profile,keys,names):
+        """
+        store method adds the files embedded into the staging store to the document store, one document per file.
+        """
+        chunks = {}
+        for position in range(staging.index.ntotal):
+            doc = staging.docstore.search(staging.index_to_docstore_id[position])
+            chunks.setdefault(os.path.basename(doc.metadata.get("source","")),[]).append((position,doc))
+        for name in names:
+            if name in self.failed_files:
+                continue
+            ## a file without text is stored too, as a document without chunks
+            positions = [position for position,_ in chunks.get(name,[])]
+            vectors = staging.index.reconstruct_batch(positions) if positions else np.zeros((0,EMBED_DIMENSIONS),dtype=np.float32)
+            table = table_path(os.path.join(self.folder_path,name)) if is_table(name) else None
+            write_document(profile,keys[name],name,[doc for _,doc in chunks.get(name,[])],vectors,table)
+
+    def load(self):
+        """
+        load method opens the index saved by `retriever` for this folder (memory-mapped) instead of rebuilding it.
+        """
+        vector_store = load_vector_store(self.folder_path,build_embeddings)
+        retriever=vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_FETCH_K})
+        llm = build_llm()
+        return retriever,llm
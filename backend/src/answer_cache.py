@@ -0,0 +1,194 @@
+## cache of answers to repeated questions, per document set
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from embedding_cache import normalize_text
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+## location of the cache database
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", os.path.join(PROJECT_ROOT, "data", "cache", "answers.sqlite"))
+## seconds an answer is served from the cache
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", 86400))
+## cached answers kept, least recently used ones are evicted above it
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 50000))
+## cosine similarity above which a differently worded question reuses an answer (above 1 disables it)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+## set ANSWER_CACHE=false to always run retrieval and the llm
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+
+EXACT = "exact"
+SEMANTIC = "semantic"
+MISS = "miss"
+BYPASS = "bypass"
+
+
+def normalize_question(question : str) -> str:
+    """normalize_question method makes case, whitespace and trailing punctuation variants of a question alike."""
+    return normalize_text(question).lower().rstrip("?!. ")
+
+
+def answer_key(fingerprint : str, model : str, question : str) -> str:
+    """answer_key method returns the address of a question asked to one model over one document set."""
+    payload = f"{fingerprint}\x00{model}\x00{normalize_question(question)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, path : str = None, ttl : float = None, max_entries : int = None, similarity : float = None):
+        """AnswerCache stores answers in SQLite keyed by (document set fingerprint, llm, question).
+
+        A question is first looked up exactly (after normalization), then by cosine similarity
+        of its embedding to the questions cached for the same document set and model. The
+        fingerprint changes with the documents of a session, so answers computed over another
+        document set are never served.
+
+        Args:
+            path (str, optional): database file. Defaults to ANSWER_CACHE_PATH.
+            ttl (float, optional): seconds an answer stays valid. Defaults to ANSWER_CACHE_TTL.
+            max_entries (int, optional): answers kept. Defaults to ANSWER_CACHE_MAX_ENTRIES.
+            similarity (float, optional): threshold of the similarity lookup. Defaults to ANSWER_CACHE_SIMILARITY.
+        """
+        self.path = path or ANSWER_CACHE_PATH
+        self.ttl = ANSWER_CACHE_TTL if ttl is None else ttl
+        self.max_entries = max_entries or ANSWER_CACHE_MAX_ENTRIES
+        self.similarity = ANSWER_CACHE_SIMILARITY if similarity is None else similarity
+        self.counts = {EXACT: 0, SEMANTIC: 0, MISS: 0, BYPASS: 0}
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, model TEXT NOT NULL, question TEXT NOT NULL,"
+            " embedding BLOB, answer TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_set ON answers (fingerprint, model)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_access ON answers (last_access)")
+        self._conn.commit()
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    @property
+    def semantic(self) -> bool:
+        return self.similarity <= 1.0
+
+    def get(self, fingerprint : str, model : str, question : str) -> str:
+        """get method returns the answer cached for exactly this question, or None."""
+        key = answer_key(fingerprint, model, question)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE key = ? AND created_at >= ?", (key, time.time() - self.ttl)
+            ).fetchone()
+            if row is not None:
+                self._touch(key)
+        return row[0] if row else None
+
+    def get_similar(self, fingerprint : str, model : str, embedding : list) -> tuple:
+        """get_similar method returns (answer, similarity) of the most similar cached question of the
+        document set, or (None, best similarity) when none reaches the threshold."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, embedding, answer FROM answers"
+                " WHERE fingerprint = ? AND model = ? AND created_at >= ? AND embedding IS NOT NULL",
+                (fingerprint, model, time.time() - self.ttl),
+            ).fetchall()
+            query = np.asarray(embedding, dtype=np.float32)
+            rows = [row for row in rows if len(row[1]) == query.nbytes]
+            if not rows:
+                return None, 0.0
+            vectors = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+            scores = vectors @ query / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query) + 1e-12)
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity:
+                return None, float(scores[best])
+            self._touch(rows[best][0])
+            return rows[best][2], float(scores[best])
+
+    def put(self, fingerprint : str, model : str, question : str, answer : str, embedding : list = None):
+        """put method caches the answer of a question, with the question's embedding for similarity lookups."""
+        now = time.time()
+        blob = None if embedding is None else np.asarray(embedding, dtype=np.float32).tobytes()
+        key = answer_key(fingerprint, model, question)
+        with self._lock:
+            exists = self._conn.execute("SELECT 1 FROM answers WHERE key = ?", (key,)).fetchone() is not None
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, fingerprint, model, question, blob, answer, now, now),
+            )
+            self._conn.commit()
+            self._entries += 0 if exists else 1
+            if self._entries > self.max_entries:
+                self._evict()
+
+    def record(self, outcome : str):
+        """record method counts the outcome (exact, semantic, miss, bypass) of one question."""
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def invalidate(self, fingerprint : str) -> int:
+        """invalidate method drops every answer computed over a document set that no longer exists."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM answers WHERE fingerprint = ?", (fingerprint,))
+            self._conn.commit()
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            self.invalidations += cursor.rowcount
+        if cursor.rowcount:
+            print(f"INFO : answer cache dropped {cursor.rowcount} answers of document set {fingerprint[:12]}")
+        return cursor.rowcount
+
+    def _touch(self, key : str):
+        self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+
+    def _evict(self):
+        """_evict method drops expired answers, then least recently used ones down to 90% of max_entries."""
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (time.time() - self.ttl,))
+        before = self._entries
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+        target = int(self.max_entries * 0.9)
+        if self._entries > target:
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access LIMIT ?)",
+                (self._entries - target,),
+            )
+            self._entries = target
+        self._conn.commit()
+        self.evictions += before - self._entries
+        print(f"INFO : answer cache evicted down to {self._entries} answers")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = counts[EXACT] + counts[SEMANTIC] + counts[MISS]
+        hits = counts[EXACT] + counts[SEMANTIC]
+        return {
+            "exact_hits": counts[EXACT],
+            "semantic_hits": counts[SEMANTIC],
+            "misses": counts[MISS],
+            "bypassed": counts[BYPASS],
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": self._entries,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    """get_answer_cache method returns the process-wide answer cache, or None when caching is disabled."""
+    global _cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
@@ -0,0 +1,264 @@
+## structure-aware chunking : headings, numbered clauses and letters, sized in tokens
+import os
+import re
+from collections import Counter
+from langchain_core.documents import Document
+from tokens import count_tokens
+
+## structure | recursive (the previous 500 character splitter)
+CHUNKER = os.getenv("CHUNKER", "structure").lower()
+## tokens a chunk is filled up to, and the smallest chunk a heading may close
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 350))
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", 40))
+## tokens of the previous chunk repeated at the start of the next one when a long passage is cut
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", 0))
+
+MONTHS = {name: number for number, names in enumerate((
+    ("january", "jan"), ("february", "feb"), ("march", "mar"), ("april", "apr"), ("may",), ("june", "jun"),
+    ("july", "jul"), ("august", "aug"), ("september", "sep", "sept"), ("october", "oct"),
+    ("november", "nov"), ("december", "dec")), start=1) for name in names}
+MONTH = "(" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+DATE_PATTERNS = (
+    (re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s+" + MONTH + r",?\s+(\d{4})\b", re.I), ("day", "month", "year")),
+    (re.compile(r"\b" + MONTH + r"\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b", re.I), ("month", "day", "year")),
+    (re.compile(r"(?<!\d)(\d{4})-(\d{1,2})-(\d{1,2})(?!\d)"), ("year", "month", "day")),
+    ## numeric dates are read day first (31.12.2024)
+    (re.compile(r"(?<![\d.])(\d{1,2})[./](\d{1,2})[./](\d{4})(?!\d)"), ("day", "month", "year")),
+)
+MARKDOWN_HEADING = re.compile(r"^#{1,6}\s+(.+?)\s*#*$")
+NUMBERED_HEADING = re.compile(
+    r"^((?:part|section|article|clause|chapter|schedule|annex(?:ure)?|appendix)\s*[-–]?\s*[\divx]+|\d+(?:\.\d+)*)[.):]?\s+"
+    r"([A-Z][^.!?;]{2,90})$", re.I)
+CLAUSE_NUMBER = re.compile(r"^(\d+(?:\.\d+)*)[.)]?$")
+CLAUSE_START = re.compile(r"^(\d+(?:\.\d+)+|\d+[.)]|\([a-z0-9]{1,4}\))\s+\S")
+LETTER_REF = re.compile(r"^(?:our\s+|your\s+)?(?:ref(?:erence)?|letter\s+no)\.?\s*(?:no\.?)?\s*[:\-–]\s*(.{2,120})$", re.I)
+SUBJECT = re.compile(r"^(?:subject|sub|re)\s*[:\-–]\s*(.{2,200})$", re.I)
+LETTER_START = re.compile(r"^(?:dear\s|to[,:]?$|from[,:]?$)", re.I)
+LETTER_MARK = re.compile(LETTER_REF.pattern + "|" + SUBJECT.pattern + "|" + LETTER_START.pattern, re.I)
+PAGE_LINE = re.compile(r"^(?:page\s+)?\d+(?:\s+of\s+\d+)?$", re.I)
+SENTENCE_END = re.compile(r"(?<=[.!?;])\s+")
+SMALL_WORDS = frozenset("a an and as at by for from in of on or the to with".split())
+
+
+def parse_date(text : str):
+    """parse_date method returns the first date of a text as YYYY-MM-DD, or None."""
+    found = []
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(text):
+            parts = dict(zip(order, match.groups()))
+            month = parts["month"]
+            month = MONTHS.get(month.lower().rstrip(".")) if not month.isdigit() else int(month)
+            day, year = int(parts["day"]), int(parts["year"])
+            if month and 1 <= month <= 12 and 1 <= day <= 31 and 1900 <= year <= 2100:
+                found.append((match.start(), f"{year:04d}-{month:02d}-{day:02d}"))
+                break
+    return min(found)[1] if found else None
+
+
+def is_heading(line : str) -> bool:
+    """is_heading method tells whether a line reads as a title : short, no closing punctuation, capitalized."""
+    if len(line) > 90 or not line[0].isupper() or line[-1] in ".,;:" or "[" in line or LETTER_START.match(line):
+        return False
+    words = [word for word in re.findall(r"[A-Za-z][A-Za-z'’&-]*", line)]
+    ## single words are table cells or labels, a closing small word is a wrapped line
+    if not 2 <= len(words) <= 12 or words[-1].lower() in SMALL_WORDS:
+        return False
+    if line.isupper():
+        return True
+    small = SMALL_WORDS
+    capitalized = sum(word[0].isupper() for word in words if word.lower() not in small)
+    return capitalized >= max(1, 0.75 * sum(word.lower() not in small for word in words))
+
+
+class Segment:
+    def __init__(self, start : int, kind : str = "text", clause : str = None):
+        """Segment is a run of lines that stays together : a heading, a clause, a list item or a paragraph."""
+        self.start = start
+        self.end = start
+        self.kind = kind
+        self.clause = clause
+        self.lines = []
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+
+class StructureChunker:
+    def __init__(self, chunk_tokens : int = None, min_tokens : int = None, overlap_tokens : int = None):
+        """StructureChunker cuts pages into chunks along their structure instead of every 500 characters.
+
+        Lines are grouped into segments (headings, numbered clauses and list items, letter
+        headers, paragraphs), and segments are packed into chunks of up to `chunk_tokens`
+        tokens. A heading closes the current chunk, a clause is only cut when it alone is
+        larger than a chunk (then at sentence ends). Lines repeated at the top or bottom of
+        the pages of a file (running headers, footers, page numbers) are left out.
+
+        Each chunk carries, besides the page metadata : section (last heading), clause (number
+        of the clause it starts in), doc_date (date of the letter / document, YYYY-MM-DD),
+        letter_ref, letter_subject, tokens and start_index. The chunker keeps this state across the pages of a file, so it
+        is used for one stream of documents and expects the pages of a file in order.
+
+        Args:
+            chunk_tokens (int, optional): Defaults to CHUNK_TOKENS.
+            min_tokens (int, optional): Defaults to CHUNK_MIN_TOKENS.
+            overlap_tokens (int, optional): Defaults to CHUNK_OVERLAP_TOKENS.
+        """
+        self.chunk_tokens = chunk_tokens or CHUNK_TOKENS
+        self.min_tokens = CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+        self.overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        self.files = {}
+
+    def file_state(self, source) -> dict:
+        if source not in self.files:
+            ## a date in the file name (31.12.2024__report.pdf) dates the document until a letter says otherwise
+            name = os.path.basename(str(source)) if source else ""
+            self.files[source] = {"section": None, "date": parse_date(name), "letter_ref": None, "subject": None,
+                                  "edges": Counter(), "pages": 0}
+        return self.files[source]
+
+    def boilerplate(self, lines : list, state : dict) -> set:
+        """boilerplate method returns the positions of running header / footer lines of a page."""
+        edges = [i for i in range(len(lines)) if i < 6 or i >= len(lines) - 3]
+        skip = {i for i in edges if PAGE_LINE.match(lines[i][1])}
+        if state["pages"] >= 2:
+            skip |= {i for i in edges if state["edges"][lines[i][1]] >= 2}
+        state["edges"].update({lines[i][1] for i in edges if len(lines[i][1]) > 3})
+        state["pages"] += 1
+        return skip
+
+    def segments(self, text : str, state : dict) -> list:
+        lines = [(match.start(), match.group(0).strip()) for match in re.finditer(r"[^\n]+", text)]
+        lines = [(start, line) for start, line in lines if line]
+        skip = self.boilerplate(lines, state)
+        segments = []
+        current = None
+        pending_number = None
+        for i, (start, line) in enumerate(lines):
+            if i in skip:
+                continue
+            if pending_number is not None:
+                ## paragraph numbers on a line of their own ("83.") belong to the next line
+                current = Segment(pending_number[0], "clause", pending_number[1])
+                current.lines.append(f"{pending_number[1]}. {line}")
+                current.end = start + len(line)
+                segments.append(current)
+                pending_number = None
+                continue
+            number = CLAUSE_NUMBER.match(line)
+            if number:
+                pending_number = (start, number.group(1))
+                continue
+            if state["date"] is None:
+                state["date"] = parse_date(line)
+            elif len(line) <= 30 and any(LETTER_MARK.match(following) for _, following in lines[i + 1:i + 9]):
+                ## a date line just above a letter header dates a new letter
+                state["date"] = parse_date(line) or state["date"]
+            reference = LETTER_REF.match(line)
+            if reference:
+                state["letter_ref"] = reference.group(1).strip()
+            subject = SUBJECT.match(line)
+            if subject:
+                state["subject"] = subject.group(1).strip()
+            heading = MARKDOWN_HEADING.match(line)
+            numbered = NUMBERED_HEADING.match(line)
+            if not (reference or subject) and (heading or (numbered and is_heading(numbered.group(2))) or is_heading(line)):
+                current = Segment(start, "heading", numbered.group(1) if numbered else None)
+                current.lines.append(heading.group(1) if heading else line)
+                current.end = start + len(line)
+                segments.append(current)
+                current = None
+                continue
+            clause = CLAUSE_START.match(line)
+            if clause or reference or subject or LETTER_START.match(line) or current is None:
+                current = Segment(start, "clause" if clause else "text", clause.group(1).rstrip(".)") if clause else None)
+                segments.append(current)
+            current.lines.append(line)
+            current.end = start + len(line)
+            if line.endswith((".", ":", "?", "!")) and len(line) < 60:
+                ## a short line closing a sentence ends its paragraph
+                current = None
+        if pending_number is not None:
+            current = Segment(pending_number[0], "text")
+            current.lines.append(pending_number[1])
+            current.end = current.start + len(pending_number[1])
+            segments.append(current)
+        return segments
+
+    def pieces(self, segment : Segment) -> list:
+        """pieces method cuts a segment larger than a chunk at sentence ends (at words for a huge sentence)."""
+        text = segment.text
+        if count_tokens(text) <= self.chunk_tokens:
+            return [text]
+        pieces, current = [], ""
+        for sentence in SENTENCE_END.split(text):
+            if count_tokens(sentence) > self.chunk_tokens:
+                words = sentence.split(" ")
+                step = max(1, len(words) * self.chunk_tokens // count_tokens(sentence))
+                parts = [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+            else:
+                parts = [sentence]
+            for part in parts:
+                if current and count_tokens(current + " " + part) > self.chunk_tokens:
+                    pieces.append(current)
+                    current = part
+                else:
+                    current = f"{current} {part}" if current else part
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def split(self, document : Document) -> list:
+        """split method returns the chunks of one page."""
+        source = document.metadata.get("source")
+        state = self.file_state(source)
+        chunks = []
+        ## parts are (start, end, text) with start / end offsets in the page
+        parts, tokens = [], 0
+        section, clause, body = state["section"], None, False
+
+        def flush():
+            nonlocal parts, tokens, body
+            ## a heading closing the page only opens the section of the next page
+            if parts and body:
+                text = "\n".join(part[2] for part in parts)
+                metadata = {**document.metadata, "start_index": parts[0][0], "end_index": parts[-1][1],
+                            "tokens": count_tokens(text)}
+                for key, value in (("section", section), ("clause", clause), ("doc_date", state["date"]),
+                                   ("letter_ref", state["letter_ref"]), ("letter_subject", state["subject"])):
+                    if value:
+                        metadata[key] = value
+                chunks.append(Document(page_content=text, metadata=metadata))
+            parts, tokens, body = [], 0, False
+
+        for segment in self.segments(document.page_content, state):
+            if segment.kind == "heading":
+                if body and tokens >= self.min_tokens:
+                    flush()
+                state["section"] = section = segment.text
+            offset = segment.start
+            pieces = self.pieces(segment)
+            for i, piece in enumerate(pieces):
+                ## offsets of the pieces of a cut segment are approximate
+                end = segment.end if i == len(pieces) - 1 else offset + len(piece)
+                size = count_tokens(piece)
+                if parts and body and tokens + size > self.chunk_tokens:
+                    overlap = parts[-1] if self.overlap_tokens and count_tokens(parts[-1][2]) <= self.overlap_tokens else None
+                    flush()
+                    if overlap:
+                        parts, tokens = [overlap], count_tokens(overlap[2])
+                    clause = segment.clause
+                if not parts:
+                    clause = segment.clause
+                parts.append((offset, end, piece))
+                tokens += size
+                body = body or segment.kind != "heading"
+                offset = end + 1
+        flush()
+        return chunks
+
+    def split_documents(self, documents : list) -> list:
+        chunks = []
+        for document in documents:
+            chunks.extend(self.split(document))
+        return chunks
@@ -0,0 +1,317 @@
+## token-budgeted assembly of the retrieved context of a question
+import os
+import time
+import hashlib
+import threading
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+from langchain_community.vectorstores.utils import DistanceStrategy
+from tokens import count_tokens
+from reranker import RERANK_CANDIDATES,RERANK_TOP_N
+from metadata_filter import MetadataTable
+from index_factory import search_parameters
+from document_store import SharedIndex
+from telemetry import record
+
+## tokens of retrieved text allowed into one prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 6000))
+## candidates fetched from the index before filtering
+RETRIEVAL_FETCH_K = int(os.getenv("RETRIEVAL_FETCH_K", 60))
+## mmr (diverse) | similarity
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "mmr").lower()
+## 1 = pure relevance, 0 = pure diversity
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", 0.7))
+## candidates below this cosine similarity are dropped (0 disables the filter)
+RETRIEVAL_MIN_SIMILARITY = float(os.getenv("RETRIEVAL_MIN_SIMILARITY", 0))
+## set RETRIEVAL_HYBRID=false to rank by vector similarity only, without the bm25 index
+RETRIEVAL_HYBRID = os.getenv("RETRIEVAL_HYBRID", "true").lower() == "true"
+## reciprocal rank fusion constant : a candidate scores 1 / (RRF_K + rank) in each ranking
+RRF_K = int(os.getenv("RRF_K", 60))
+## a filtered question is searched with an id selector; on hnsw / ivf indexes, filters matching up to
+## this many chunks are scored exactly instead, as the graph / probed lists may hold too few of them
+PREFILTER_EXACT_MAX = int(os.getenv("PREFILTER_EXACT_MAX", 500))
+
+CONTEXT_SEPARATOR = "\n\n"
+## chunks of the same page less than this many characters apart are joined into one passage
+MERGE_GAP = 5
+
+
+def chunk_key(doc : Document) -> tuple:
+    """chunk_key method returns the (source, page) a chunk was cut from; only chunks with the same key are merged."""
+    return (doc.metadata.get("source"), doc.metadata.get("page"))
+
+
+def overlap_length(left : str, right : str, max_overlap : int = 400) -> int:
+    """overlap_length method returns the length of the longest suffix of `left` that is a prefix of `right`."""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class ContextBlock:
+    def __init__(self, doc : Document, rank : int):
+        """ContextBlock is a run of adjacent chunks of one source/page merged into a single passage."""
+        self.key = chunk_key(doc)
+        self.table = doc.metadata.get("table")
+        self.rank = rank
+        self.start = doc.metadata.get("start_index")
+        ## structure chunks are rebuilt from the page lines and give their end, cut chunks are page slices
+        self.stop = doc.metadata.get("end_index")
+        self.text = doc.page_content
+        self.chunks = 1
+
+    @property
+    def end(self):
+        if self.stop is not None:
+            return self.stop
+        return None if self.start is None else self.start + len(self.text)
+
+    def try_merge(self, doc : Document, rank : int) -> bool:
+        """try_merge method appends `doc` if it overlaps or directly follows this block. Returns True if merged."""
+        if chunk_key(doc) != self.key:
+            return False
+        start = doc.metadata.get("start_index")
+        text = doc.page_content
+        if self.start is not None and start is not None:
+            ## positions are known (chunks cut with add_start_index)
+            gap = start - self.end
+            if start < self.start or gap > MERGE_GAP:
+                return False
+            stop = doc.metadata.get("end_index")
+            if stop is not None:
+                if gap >= 0:
+                    self.text += "\n" + text
+                elif stop > self.end:
+                    self.text += text[overlap_length(self.text, text):]
+                self.stop = max(self.end, stop)
+            elif gap > 0:
+                self.text += " " + text
+            elif start + len(text) > self.end:
+                self.text += text[self.end - start:]
+        else:
+            ## older indexes have no positions, fall back to matching the overlapping text
+            if text not in self.text:
+                size = overlap_length(self.text, text)
+                if size == 0:
+                    return False
+                self.text += text[size:]
+        self.rank = min(self.rank, rank)
+        self.chunks += 1
+        return True
+
+
+class ContextBuilder:
+    def __init__(self, vector_store, token_budget : int = None, fetch_k : int = None, mode : str = None,
+                 lambda_mult : float = None, min_similarity : float = None, lexical=None,
+                 reranker=None, rerank_candidates : int = None, rerank_top_n : int = None):
+        """ContextBuilder retrieves candidates for a question and packs them into a token budget.
+
+        Candidates are fetched with MMR (or plain similarity) and, when the session has a
+        bm25 index, fused with its lexical matches by reciprocal rank fusion, so chunks citing
+        the exact clause numbers, codes or amounts of a question rank high. With a reranker,
+        the best candidates are scored against the question and only the top ones go on.
+        They are then filtered by similarity,
+        de-duplicated, and chunks that overlap because of the splitter's chunk_overlap (or
+        simply follow each other in the same source/page) are merged back into one passage.
+        Passages are then added in rank order until the budget is used up.
+
+        Args:
+            vector_store (FAISS): langchain FAISS store of the session
+            token_budget (int, optional): tokens of context per question. Defaults to CONTEXT_TOKEN_BUDGET.
+            fetch_k (int, optional): candidates fetched from the index. Defaults to RETRIEVAL_FETCH_K.
+            mode (str, optional): mmr or similarity. Defaults to RETRIEVAL_MODE.
+            lambda_mult (float, optional): MMR relevance/diversity trade-off. Defaults to MMR_LAMBDA.
+            min_similarity (float, optional): cosine similarity cut-off. Defaults to RETRIEVAL_MIN_SIMILARITY.
+            lexical (LexicalIndex, optional): bm25 index of the same chunks, ignored when RETRIEVAL_HYBRID=false
+            reranker (Reranker, optional): scorer of the rerank stage, None skips it
+            rerank_candidates (int, optional): candidates scored. Defaults to RERANK_CANDIDATES.
+            rerank_top_n (int, optional): candidates kept after reranking. Defaults to RERANK_TOP_N.
+        """
+        self.vector_store = vector_store
+        self.token_budget = token_budget or CONTEXT_TOKEN_BUDGET
+        self.fetch_k = fetch_k or RETRIEVAL_FETCH_K
+        self.mode = (mode or RETRIEVAL_MODE).lower()
+        self.lambda_mult = MMR_LAMBDA if lambda_mult is None else lambda_mult
+        self.min_similarity = RETRIEVAL_MIN_SIMILARITY if min_similarity is None else min_similarity
+        self.lexical = lexical if RETRIEVAL_HYBRID else None
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates or RERANK_CANDIDATES
+        self.rerank_top_n = rerank_top_n or RERANK_TOP_N
+        self._metadata = None
+        self._metadata_lock = threading.Lock()
+
+    def similarity(self, score : float) -> float:
+        """similarity method converts a FAISS score into cosine similarity (vectors are unit length)."""
+        if self.vector_store.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+            return score
+        ## FAISS returns squared L2 distances, and |a - b|^2 = 2 - 2 cos(a, b) for unit vectors
+        return 1.0 - score / 2.0
+
+    def embed(self, query : str) -> list:
+        return self.vector_store.embedding_function.embed_query(query)
+
+    def metadata(self) -> MetadataTable:
+        """metadata method returns the metadata columns of the session's chunks, built on the first filtered question."""
+        with self._metadata_lock:
+            if self._metadata is None or self._metadata.n != self.vector_store.index.ntotal:
+                start = time.perf_counter()
+                self._metadata = MetadataTable(self.vector_store)
+                print(f"INFO : metadata of {self._metadata.n} chunks loaded in {round(time.perf_counter() - start, 3)}s")
+            return self._metadata
+
+    def search_positions(self, embedding : list, positions : np.ndarray, k : int) -> list:
+        """search_positions method returns the [(Document, similarity)] of the k nearest chunks among `positions`.
+
+        The index is searched with an id selector, so every result matches the filter; a few
+        positions of an approximate index are scored exactly on their reconstructed vectors."""
+        store = self.vector_store
+        query = np.asarray([embedding], dtype=np.float32)
+        if store._normalize_L2:
+            faiss.normalize_L2(query)
+        inner_product = store.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT
+        if len(positions) <= PREFILTER_EXACT_MAX and not isinstance(store.index, (faiss.IndexFlat, SharedIndex)):
+            vectors = store.index.reconstruct_batch(positions)
+            scores = vectors @ query[0] if inner_product else ((vectors - query) ** 2).sum(axis=1)
+            order = np.argsort(-scores if inner_product else scores, kind="stable")[:k]
+            hits = [(int(positions[i]), float(scores[i])) for i in order]
+        else:
+            if isinstance(store.index, SharedIndex):
+                ## exact search over the shared vectors, restricted to the positions
+                scores, ids = store.index.search(query, k, positions=positions)
+            else:
+                scores, ids = store.index.search(query, k, params=search_parameters(store.index, positions))
+            hits = [(int(position), float(score)) for position, score in zip(ids[0], scores[0]) if position >= 0]
+        return [(store.docstore.search(store.index_to_docstore_id[position]), self.similarity(score))
+                for position, score in hits]
+
+    def retrieve(self, query : str, embedding : list = None, filters : dict = None) -> list:
+        """retrieve method returns [(Document, similarity)] candidates in rank order.
+        `embedding` is the query vector when the caller already computed it. Candidates found
+        only by the bm25 index have similarity None. With `filters` (see metadata_filter.parse_filters)
+        only the chunks matching them are searched, by similarity."""
+        if embedding is None:
+            embedding = self.embed(query)
+        n = self.vector_store.index.ntotal
+        fetch_k = min(self.fetch_k, n)
+        if fetch_k == 0:
+            return []
+        if filters:
+            positions = self.metadata().positions(filters)
+            if len(positions) == 0:
+                return []
+            candidates = self.search_positions(embedding, positions, min(fetch_k, len(positions)))
+            if self.lexical is not None:
+                candidates = self.fuse(candidates, self.lexical.search(query, fetch_k, positions))
+            return candidates
+        if self.mode == "mmr":
+            results = self.vector_store.max_marginal_relevance_search_with_score_by_vector(
+                embedding, k=fetch_k, fetch_k=min(fetch_k * 2, n), lambda_mult=self.lambda_mult
+            )
+        else:
+            results = self.vector_store.similarity_search_with_score_by_vector(embedding, k=fetch_k)
+        candidates = [(doc, self.similarity(score)) for doc, score in results]
+        if self.lexical is not None:
+            candidates = self.fuse(candidates, self.lexical.search(query, fetch_k))
+        return candidates
+
+    def fuse(self, candidates : list, hits : list) -> list:
+        """fuse method merges the vector candidates and the bm25 hits [(position, score)] by reciprocal rank fusion."""
+        scores, documents, similarities = {}, {}, {}
+        for rank, (doc, similarity) in enumerate(candidates):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            documents[doc.id] = doc
+            similarities[doc.id] = similarity
+        for rank, (position, _) in enumerate(hits):
+            doc_id = self.vector_store.index_to_docstore_id[position]
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+            if doc_id not in documents:
+                documents[doc_id] = self.vector_store.docstore.search(doc_id)
+        ranked = sorted(scores, key=scores.get, reverse=True)[:self.fetch_k]
+        return [(documents[doc_id], similarities.get(doc_id)) for doc_id in ranked]
+
+    def rerank(self, query : str, candidates : list) -> list:
+        """rerank method scores the first rerank_candidates candidates and returns the rerank_top_n best, best first."""
+        pool = candidates[:self.rerank_candidates]
+        scores = self.reranker.score(query, [doc.page_content for doc, _ in pool])
+        order = sorted(range(len(pool)), key=lambda i: -scores[i])
+        return [pool[i] for i in order[:self.rerank_top_n]]
+
+    def select(self, candidates : list) -> list:
+        """select method filters, de-duplicates and merges candidates into passages within the token budget.
+
+        Args:
+            candidates (list): [(Document, similarity)] in rank order
+
+        Returns:
+            tuple: (passages (str) in rank order, stats dict; stats["tables"] names the tables whose summaries were kept)
+        """
+        seen = set()
+        blocks = []
+        for rank, (doc, similarity) in enumerate(candidates):
+            if self.min_similarity and similarity is not None and similarity < self.min_similarity:
+                continue
+            digest = hashlib.sha1(doc.page_content.encode("utf-8")).hexdigest()
+            if digest in seen:
+                continue
+            seen.add(digest)
+            blocks.append((doc, rank))
+        ## merge in document order so overlapping neighbours meet, then go back to rank order
+        blocks.sort(key=lambda item: (str(item[0].metadata.get("source")), str(item[0].metadata.get("page")),
+                                      item[0].metadata.get("start_index") or 0))
+        merged = []
+        for doc, rank in blocks:
+            if merged and merged[-1].try_merge(doc, rank):
+                continue
+            merged.append(ContextBlock(doc, rank))
+        merged.sort(key=lambda block: block.rank)
+        passages, used, tables = [], 0, []
+        for block in merged:
+            tokens = count_tokens(block.text)
+            if used + tokens > self.token_budget:
+                continue
+            passages.append(block.text)
+            used += tokens
+            if block.table and block.table not in tables:
+                tables.append(block.table)
+        stats = {
+            "retrieved": len(candidates),
+            "unique": len(blocks),
+            "passages": len(merged),
+            "kept": len(passages),
+            "tokens": used,
+            "budget": self.token_budget,
+            "tables": tables,
+        }
+        return passages, stats
+
+    def assemble(self, query : str, embedding : list = None, filters : dict = None) -> tuple:
+        """assemble method returns (context text, stats) of a question, searched among the chunks matching
+        `filters` when given. Stats are per call, as one builder serves concurrent questions of a session."""
+        start = time.perf_counter()
+        candidates = self.retrieve(query, embedding, filters)
+        retrieved = time.perf_counter()
+        fetched = len(candidates)
+        if self.reranker is not None:
+            candidates = self.rerank(query, candidates)
+        reranked = time.perf_counter()
+        passages, stats = self.select(candidates)
+        stats["retrieved"] = fetched
+        stats["retrieve_ms"] = round((retrieved - start) * 1000, 1)
+        stats["rerank_ms"] = round((reranked - retrieved) * 1000, 1) if self.reranker is not None else None
+        stats["select_ms"] = round((time.perf_counter() - reranked) * 1000, 1)
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        record("retrieve", retrieved - start, chunks=fetched, filtered=bool(filters))
+        if self.reranker is not None:
+            record("rerank", reranked - retrieved, chunks=len(candidates), reranker=self.reranker.name)
+        record("prompt_assembly", time.perf_counter() - reranked, passages=stats["kept"], tokens=stats["tokens"])
+        rerank = f", reranked to {len(candidates)} in {stats['rerank_ms']}ms" if self.reranker is not None else ""
+        print(f"INFO : context : retrieved {stats['retrieved']}{rerank}, unique {stats['unique']}, "
+              f"merged into {stats['passages']}, kept {stats['kept']}, "
+              f"tokens {stats['tokens']}/{stats['budget']} in {stats['seconds']}s")
+        return CONTEXT_SEPARATOR.join(passages), stats
+
+    def build(self, query : str) -> str:
+        """build method returns the context text of a question; used as the `text` input of the RAG prompt."""
+        return self.assemble(query)[0]
@@ -0,0 +1,224 @@
+## conversation memory of the workflow : recent turns verbatim, older ones folded into a rolling summary, checkpointed in SQLite
+import os
+import asyncio
+import sqlite3
+import threading
+from langchain_core.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langgraph.checkpoint.sqlite import SqliteSaver
+from telemetry import span
+from tokens import count_tokens,truncate_tokens
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+## checkpoints of the conversation threads (":memory:" keeps them in the process)
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", os.path.join(PROJECT_ROOT, "data", "cache", "conversations.sqlite"))
+## last turns (question + answer) kept verbatim, older ones are folded into the summary
+CONVERSATION_RECENT_TURNS = int(os.getenv("CONVERSATION_RECENT_TURNS", 4))
+## token budget of the verbatim turns, long answers are folded sooner
+CONVERSATION_HISTORY_TOKENS = int(os.getenv("CONVERSATION_HISTORY_TOKENS", 1500))
+## token budget of the rolling summary of the older turns
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", 300))
+## set QUERY_REWRITE=false to retrieve with follow-up questions as asked
+QUERY_REWRITE = os.getenv("QUERY_REWRITE", "true").lower() == "true"
+
+CONDENSE_PROMPT = PromptTemplate(
+    template="""Given the conversation so far and a follow-up question, rewrite the follow-up question as a
+standalone question that can be understood and searched for without the conversation. Resolve pronouns and
+references ("it", "that letter", "the second one") to what they refer to. If the question is already standalone,
+return it unchanged. Return only the question.
+
+Conversation :
+{history}
+
+Follow-up question : {question}
+Standalone question :""",
+    input_variables=["history", "question"],
+)
+
+SUMMARY_PROMPT = PromptTemplate(
+    template="""Summarize the conversation below between a user and a banking documents assistant in at most
+{words} words. Keep the documents, parties, references, dates, amounts and conclusions discussed, so later
+questions can refer to them. Return only the summary.
+
+Summary so far :
+{summary}
+
+New turns :
+{turns}
+
+Updated summary :""",
+    input_variables=["summary", "turns", "words"],
+)
+
+
+def format_turns(turns : list) -> str:
+    return "\n".join(f"User : {question}\nAssistant : {answer}" for question,answer in turns)
+
+
+def format_history(summary : str, turns : list) -> str:
+    """format_history method returns the compact history of a thread : its summary, then its recent turns."""
+    parts = []
+    if summary:
+        parts.append(f"Summary of the earlier conversation : {summary}")
+    if turns:
+        parts.append(format_turns(turns))
+    return "\n".join(parts)
+
+
+class ConversationMemory:
+    def __init__(self,llm,recent_turns : int = None,history_tokens : int = None,summary_tokens : int = None,rewrite : bool = None):
+        """ConversationMemory keeps the history of a thread bounded : the last `recent_turns` turns verbatim (within
+        `history_tokens`) and a rolling summary of the older ones (within `summary_tokens`). Follow-up questions are
+        rewritten from that history into standalone questions, so retrieval and the answer cache see self-contained queries.
+
+        Args:
+            llm : chat model of the session, used to rewrite questions and to summarize
+            recent_turns (int, optional): Defaults to CONVERSATION_RECENT_TURNS.
+            history_tokens (int, optional): Defaults to CONVERSATION_HISTORY_TOKENS.
+            summary_tokens (int, optional): Defaults to CONVERSATION_SUMMARY_TOKENS.
+            rewrite (bool, optional): Defaults to QUERY_REWRITE.
+        """
+        self.recent_turns = CONVERSATION_RECENT_TURNS if recent_turns is None else recent_turns
+        self.history_tokens = history_tokens or CONVERSATION_HISTORY_TOKENS
+        self.summary_tokens = summary_tokens or CONVERSATION_SUMMARY_TOKENS
+        self.rewrite = QUERY_REWRITE if rewrite is None else rewrite
+        self.condense_chain = CONDENSE_PROMPT | llm | StrOutputParser()
+        self.summary_chain = SUMMARY_PROMPT | llm | StrOutputParser()
+
+    def split(self,turns : list) -> tuple:
+        """split method returns (turns to fold into the summary, turns kept verbatim), oldest first."""
+        kept = list(turns[-self.recent_turns:]) if self.recent_turns > 0 else []
+        while kept and count_tokens(format_turns(kept)) > self.history_tokens:
+            kept.pop(0)
+        return list(turns[:len(turns) - len(kept)]),kept
+
+    def condense_inputs(self,question : str,summary : str,turns : list) -> dict:
+        """condense_inputs method returns the inputs of the rewrite prompt, None when there is nothing to rewrite from."""
+        if not self.rewrite or not (summary or turns):
+            return None
+        return {"history": format_history(summary,turns), "question": question}
+
+    def summary_inputs(self,summary : str,folded : list) -> dict:
+        return {"summary": summary or "(none)", "turns": format_turns(folded), "words": int(self.summary_tokens * 0.75)}
+
+    def standalone(self,question : str,summary : str = "",turns : list = ()) -> str:
+        """standalone method rewrites a follow-up question into a standalone one; the question is kept as asked
+        without history, with QUERY_REWRITE=false or when the rewrite fails."""
+        inputs = self.condense_inputs(question,summary,turns)
+        if inputs is None:
+            return question
+        try:
+            with span("rewrite",turns=len(turns)):
+                return self.condense_chain.invoke(inputs).strip() or question
+        except Exception as exp:
+            print(f"ERROR : query rewrite failed, the question is used as asked : {exp}")
+            return question
+
+    async def astandalone(self,question : str,summary : str = "",turns : list = ()) -> str:
+        """astandalone method is the async version of standalone."""
+        inputs = self.condense_inputs(question,summary,turns)
+        if inputs is None:
+            return question
+        try:
+            with span("rewrite",turns=len(turns)):
+                return (await self.condense_chain.ainvoke(inputs)).strip() or question
+        except Exception as exp:
+            print(f"ERROR : query rewrite failed, the question is used as asked : {exp}")
+            return question
+
+    def fold(self,summary : str,turns : list,question : str,answer : str) -> tuple:
+        """fold method adds a turn to the history and folds the turns past the budgets into the summary.
+
+        Returns:
+            tuple: (summary, turns) of the thread
+        """
+        folded,kept = self.split(list(turns) + [[question,answer]])
+        if not folded:
+            return summary,kept
+        try:
+            with span("summarize",turns=len(folded)):
+                summary = self.summary_chain.invoke(self.summary_inputs(summary,folded)).strip()
+        except Exception as exp:
+            ## the folded turns are dropped rather than kept, so the history stays within its budget
+            print(f"ERROR : conversation summary failed, {len(folded)} turns dropped : {exp}")
+        return truncate_tokens(summary,self.summary_tokens),kept
+
+    async def afold(self,summary : str,turns : list,question : str,answer : str) -> tuple:
+        """afold method is the async version of fold."""
+        folded,kept = self.split(list(turns) + [[question,answer]])
+        if not folded:
+            return summary,kept
+        try:
+            with span("summarize",turns=len(folded)):
+                summary = (await self.summary_chain.ainvoke(self.summary_inputs(summary,folded))).strip()
+        except Exception as exp:
+            print(f"ERROR : conversation summary failed, {len(folded)} turns dropped : {exp}")
+        return truncate_tokens(summary,self.summary_tokens),kept
+
+
+class ConversationCheckpointer(SqliteSaver):
+    """ConversationCheckpointer is a SqliteSaver that keeps only the latest checkpoint of each thread, so the database
+    grows with the number of conversations, not with their length. SqliteSaver is sync only : its async methods,
+    used by the async graph, run the sync ones in a worker thread (the connection is shared under its lock)."""
+
+    def put(self,config,checkpoint,metadata,new_versions):
+        next_config = super().put(config,checkpoint,metadata,new_versions)
+        thread_id = next_config["configurable"]["thread_id"]
+        checkpoint_ns = next_config["configurable"]["checkpoint_ns"]
+        checkpoint_id = next_config["configurable"]["checkpoint_id"]
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                        (thread_id,checkpoint_ns,checkpoint_id))
+            cur.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?",
+                        (thread_id,checkpoint_ns,checkpoint_id))
+        return next_config
+
+    async def aget_tuple(self,config):
+        return await asyncio.to_thread(self.get_tuple,config)
+
+    async def alist(self,config,*,filter=None,before=None,limit=None):
+        checkpoints = await asyncio.to_thread(lambda: list(self.list(config,filter=filter,before=before,limit=limit)))
+        for checkpoint in checkpoints:
+            yield checkpoint
+
+    async def aput(self,config,checkpoint,metadata,new_versions):
+        return await asyncio.to_thread(self.put,config,checkpoint,metadata,new_versions)
+
+    async def aput_writes(self,config,writes,task_id,task_path=""):
+        return await asyncio.to_thread(self.put_writes,config,writes,task_id,task_path)
+
+    async def adelete_thread(self,thread_id):
+        return await asyncio.to_thread(self.delete_thread,thread_id)
+
+    def forget(self,prefix : str) -> int:
+        """forget method deletes the threads whose id starts with `prefix`, e.g. every conversation of a session. Returns the checkpoints deleted."""
+        self.setup()
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM writes WHERE substr(thread_id, 1, ?) = ?",(len(prefix),prefix))
+            cur.execute("DELETE FROM checkpoints WHERE substr(thread_id, 1, ?) = ?",(len(prefix),prefix))
+            return cur.rowcount
+
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def get_checkpointer() -> ConversationCheckpointer:
+    """get_checkpointer method returns the process-wide checkpointer of the conversation threads. Thread ids start
+    with the session id, so the sessions share one database."""
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            if CONVERSATION_DB_PATH != ":memory:":
+                os.makedirs(os.path.dirname(CONVERSATION_DB_PATH),exist_ok=True)
+            conn = sqlite3.connect(CONVERSATION_DB_PATH,check_same_thread=False,timeout=30)
+            _checkpointer = ConversationCheckpointer(conn)
+            _checkpointer.setup()
+        return _checkpointer
+
+
+def forget_sessions(session_ids : list) -> int:
+    """forget_sessions method deletes the conversations of deleted sessions. Returns the checkpoints deleted."""
+    checkpointer = get_checkpointer()
+    return sum(checkpointer.forget(f"{session_id}:") for session_id in session_ids)
@@ -1,16 +1,24 @@
 ## importing all importent lib
 import os
-import sys
 import glob
-import math
+import io
+import time
 import tempfile
-from pathlib import Path
-from mistralai import Mistral
+import threading
+import contextvars
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import pymupdf
 from pypdf import PdfReader, PdfWriter
-from langchain.schema import Document
-from PyPDF2 import PdfReader, PdfWriter
-from langchain_community.document_loaders import PyMuPDFLoader,TextLoader,Docx2txtLoader
+from langchain_core.documents import Document
+from langchain_community.document_loaders import TextLoader,Docx2txtLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from ocr import get_ocr_backend,classify_page,ocr_pages,page_count,SCRATCH_DIR
+from tabular import TABULAR_EXTENSIONS,load_table
+from chunker import CHUNKER,StructureChunker
+from telemetry import record
+from tokens import count_tokens
 
 
 
@@ -26,29 +34,9 @@ def ocr_scanned_pdf(pdf_path : str) -> str:
     """
     try:
         print(f"INFO : OCR start for file {pdf_path}")
-        api_key = "paste your mistral key here"
-        client = Mistral(api_key=api_key)
-        uploded_pdf = client.files.upload(
-        file={
-            "file_name":pdf_path,
-            "content":open(pdf_path,"rb")
-        },
-        purpose="ocr"
-        )
-        client.files.retrieve(file_id=uploded_pdf.id)
-        signed_url = client.files.get_signed_url(file_id=uploded_pdf.id)
-        ocr_response = client.ocr.process(
-        model = "mistral-ocr-latest",
-        document={
-            "type" : "document_url",
-            "document_url" : signed_url.url,
-        },
-        include_image_base64=False
-        )
-        text =""
-        for page in ocr_response.pages:
-            text = text + page.markdown + "\n"
-            # print(page.markdown + "\\n")
+        text = ""
+        for page in get_ocr_backend().ocr(pdf_path):
+            text = text + page + "\n"
         print(f"INFO : OCR completed for the file {pdf_path}")
         return text
     except Exception as exp:
@@ -74,190 +62,349 @@ def is_pdf_too_large(pdf_path : str, size_limit_mb=50) -> bool:
     except Exception as exp:
         print(f"INFO : is_pdf_too_large method faild due to :{exp}")
 
+## method for measuring how many bytes each page adds to a pdf
+def page_sizes(reader : PdfReader) -> list:
+    """page_sizes method returns the size of every page written on its own, measured in memory.
+
+    Resources shared between pages (fonts, logos) are counted once per page, so the sum over
+    a range of pages over-estimates the size of the pdf holding them, which keeps parts under
+    their target.
+
+    Args:
+        reader (PdfReader): the open pdf
+
+    Returns:
+        list: bytes per page
+    """
+    sizes = []
+    for page in reader.pages:
+        writer = PdfWriter()
+        writer.add_page(page)
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        sizes.append(buffer.tell())
+    return sizes
+
+
 ## method for reducing the size(mb) of the pdf if it is more than 50 mb
-def split_pdf_by_size(input_path, target_size_mb=48):
+def split_pdf_by_size(input_path, output_dir, target_size_mb=48) -> list:
     """split_pdf_by_size method is used for splitting pdf by size
 
+    Page sizes are measured in memory first, pages are then grouped greedily under the target
+    and every part is written once, in a single pass over the file. A part that still comes
+    out larger than the target (unusual, page sizes over-estimate) is split in two.
+
     Args:
-        input_path (_type_): _description_
-        target_size_mb (int, optional): _description_. Defaults to 48.
+        input_path (str): path of the pdf
+        output_dir (str): folder the parts are written to, e.g. a per-job `tempfile.TemporaryDirectory` the caller removes
+        target_size_mb (int, optional): size limit of a part. Defaults to 48.
+
+    Returns:
+        list: paths of the parts, in page order
     """
     try:
         print("INFO : split_pdf_by_size method started")
         reader = PdfReader(input_path)
-        total_pages = len(reader.pages)
-        part = 1
-        writer = PdfWriter()
-        # Get the directory of document.py
-        CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-        # Go one level up to reach project root
-        PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
-        ## path for the temp folder
-        temp_folder = PROJECT_ROOT +"/data"+"/temp_folder/"
-        ## first we need to deleting all files from temp folder
-        folder_path = PROJECT_ROOT +"/data"+"/temp_folder"
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                print(f" INFO : Deleted old files from temp folder: {file_path}")
-        for i in range(total_pages):
-            writer.add_page(reader.pages[i])
-            # temp_path = "/Users/sameersingh/Documents/MASIN/construction_claims_and_arbitration_expert/data/temp_folder/"+f"split_part_{part}.pdf"
-            temp_path = temp_folder + f"split_part_{part}.pdf"
+        target = target_size_mb * 1024 * 1024
+        groups, group, group_size = [], [], 0
+        for number, size in enumerate(page_sizes(reader)):
+            if group and group_size + size > target:
+                groups.append(group)
+                group, group_size = [], 0
+            group.append(number)
+            group_size += size
+        if group:
+            groups.append(group)
+        parts = []
+        while groups:
+            group = groups.pop(0)
+            writer = PdfWriter()
+            for number in group:
+                writer.add_page(reader.pages[number])
+            temp_path = os.path.join(output_dir, f"split_part_{len(parts) + 1}_{group[0] + 1}-{group[-1] + 1}.pdf")
             with open(temp_path, "wb") as f:
                 writer.write(f)
-
             size_mb = os.path.getsize(temp_path) / (1024 * 1024)
-
-            if size_mb >= target_size_mb or i == total_pages - 1:
-                print(f"✅ Part {part} saved: {temp_path} ({size_mb:.2f} MB)")
-                part += 1
-                writer = PdfWriter()
-            else:
-                os.remove(temp_path)  # Not final yet, keep adding pages
+            if size_mb > target_size_mb and len(group) > 1:
+                os.remove(temp_path)
+                middle = len(group) // 2
+                groups[:0] = [group[:middle], group[middle:]]
+                continue
+            print(f"✅ Part {len(parts) + 1} saved: {temp_path} ({size_mb:.2f} MB)")
+            parts.append(temp_path)
+        return parts
     except Exception as exp:
         print(f"ERROR : split_pdf_by_size method failed due to {exp}")
+        return []
+
+## file types document_loaders can read
+PDF_EXTENSIONS = (".pdf",)
+TEXT_EXTENSIONS = (".docx", ".txt")
+## csv / xlsx (TABULAR_EXTENSIONS) are stored as tables : only their schema and column summaries are embedded
+## processes parsing pdf's in parallel (0 parses them on threads instead, the default on a single core
+## where spawning workers costs more than it saves)
+LOADER_PROCESSES = int(os.getenv("LOADER_PROCESSES", os.cpu_count() if (os.cpu_count() or 1) > 1 else 0))
+## threads loading docx/txt/csv/xlsx files and waiting on ocr
+LOADER_THREADS = int(os.getenv("LOADER_THREADS", 8))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
 
-## method for splitting pdf's if pages are more than 1000 pages and then performing ocr
-def split_pdf_using_temp_files(pdf_path : str, max_pages_per_chunk=500) -> str:
-    """split_pdf_using_temp_files method is use for proceesing scanned pdf's if pages is more than 1000.
+
+def get_process_pool():
+    """get_process_pool method returns the process pool shared by all loads, or None when LOADER_PROCESSES=0.
+
+    Processes are spawned rather than forked, the loader runs inside a multi-threaded server.
+    """
+    global _process_pool
+    if LOADER_PROCESSES <= 0:
+        return None
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=LOADER_PROCESSES, mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def reset_process_pool():
+    """reset_process_pool method drops a pool broken by a crashed worker, the next load starts a new one."""
+    global _process_pool
+    with _process_pool_lock:
+        _process_pool = None
+
+
+def file_kind(file : str):
+    extension = os.path.splitext(file)[1].lower()
+    if extension in PDF_EXTENSIONS:
+        return "pdf"
+    if extension in TEXT_EXTENSIONS:
+        return "text"
+    if extension in TABULAR_EXTENSIONS:
+        return "table"
+    return None
+
+
+## method for extracting the text layer of a pdf, runs in a worker process
+def load_pdf(file : str) -> tuple:
+    """load_pdf method extracts the pages of a pdf and finds the scanned ones, in one PyMuPDF pass.
 
     Args:
-        pdf_path (str): path of the pdf's
-        max_pages_per_chunk (int, optional): _description_. Defaults to 900.
+        file (str): path of the pdf
 
     Returns:
-        str: _description_
+        tuple: (one Document per page, page numbers that need ocr)
     """
-    try:
-        print("INFO : split_pdf_using_temp_files method started")
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
-        num_chunks = math.ceil(total_pages / max_pages_per_chunk)
-        
-        final_text = ""
-
-        for chunk in range(num_chunks):
-            writer = PdfWriter()
-            start = chunk * max_pages_per_chunk
-            end = min((chunk + 1) * max_pages_per_chunk, total_pages)
+    page = []
+    needs_ocr = []
+    with pymupdf.open(file) as doc:
+        doc_metadata = {key: value for key, value in doc.metadata.items() if isinstance(value, (str, int))}
+        for number, pdf_page in enumerate(doc):
+            text, scanned, coverage = classify_page(pdf_page)
+            if scanned:
+                needs_ocr.append(number)
+            metadata = {**doc_metadata, "source": file, "file_path": file, "total_pages": len(doc), "page": number}
+            page.append(Document(page_content=text, metadata=metadata))
+    return page, needs_ocr
+
 
-            for i in range(start, end):
-                writer.add_page(reader.pages[i])
+## method for ocr of the scanned pages of a pdf, runs in a worker thread (it mostly waits on the ocr service)
+def ocr_scanned_pages(file : str, page : list, needs_ocr : list) -> list:
+    """ocr_scanned_pages method replaces the text of the scanned pages of a pdf by their ocr, keeping page order.
 
-            # Create temp file
-            with tempfile.NamedTemporaryFile(delete=True, suffix=".pdf") as temp_file:
-                writer.write(temp_file)
-                temp_file.flush()  # Ensure it's written
-                temp_path = temp_file.name
+    If the ocr fails the text pages of the file are still returned.
 
-                # 👇 Call your OCR function with the file path
-                print(f"INFO : 📄 Processing chunk {chunk + 1}/{num_chunks} | Pages: {end - start}")
-                chunk_text = ocr_scanned_pdf(temp_path)
-                final_text += chunk_text + "\n"
+    Args:
+        file (str): path of the pdf
+        page (list): Documents of all pages, from `load_pdf`
+        needs_ocr (list): page numbers to ocr
 
-        return final_text
+    Returns:
+        list: Documents of all pages, ocr pages marked with metadata["ocr"]
+    """
+    print(f"INFO : {len(needs_ocr)} of {len(page)} pages of {os.path.basename(file)} are scanned")
+    try:
+        texts = ocr_pages(file, needs_ocr)
     except Exception as exp:
-        print(f"ERROR : split_pdf_using_temp_files method failed : {exp}")
-        return ""
+        print(f"ERROR : OCR failed for {file}, keeping its text pages : {exp}")
+        texts = {}
+    for number, text in texts.items():
+        page[number] = Document(page_content=text, metadata={**page[number].metadata, "ocr": True})
+    if not any(doc.page_content.strip() for doc in page):
+        raise ValueError("no text found by pdf parsing or ocr")
+    return page
+
+
+## method for whole file ocr of a pdf PyMuPDF can't read, runs in a worker thread
+def ocr_pdf(file : str) -> list:
+    """ocr_pdf method extracts the text of a whole pdf with the ocr backend, splitting it first when it is too large.
+
+    Pages are counted and copied with pypdf, since PyMuPDF could not open the file.
+
+    Args:
+        file (str): path of the pdf
+
+    Returns:
+        list: one Document per page with text, in page order, with the page metadata of `load_pdf`
+    """
+    if not is_pdf_too_large(file):
+        total_pages = page_count(file)
+        texts = ocr_pages(file, list(range(total_pages)))
+    else:
+        texts, total_pages = ocr_large_pdf(file)
+    page = [Document(page_content=texts[number],
+                     metadata={"source": file, "file_path": file, "total_pages": total_pages, "page": number, "ocr": True})
+            for number in sorted(texts) if texts[number].strip()]
+    if not page:
+        raise ValueError("no text found by pdf parsing or ocr")
+    return page
+
+
+def ocr_large_pdf(file : str) -> tuple:
+    """ocr_large_pdf method runs ocr on a pdf over the size limit, part by part (see split_pdf_by_size).
+
+    Returns:
+        tuple: ({page number in the file: ocr text}, pages of the file)
+    """
+    print("INFO : file is large")
+    texts = {}
+    offset = 0
+    ## parts live in a scratch folder of this job only, removed when the ocr is done
+    with tempfile.TemporaryDirectory(prefix="split-", dir=SCRATCH_DIR) as scratch:
+        for part in split_pdf_by_size(file, scratch):
+            count = page_count(part)
+            texts.update({offset + number: text for number, text in ocr_pages(part, list(range(count))).items()})
+            offset += count
+    return texts, offset
+
+
+## method for loading docx and txt files
+def load_text_file(file : str) -> list:
+    if file.lower().endswith(".docx"):
+        print("INFO : docx......")
+        return Docx2txtLoader(file).load()
+    print("INFO : txt......")
+    return TextLoader(file).load()
+
+
+## method for loading all files of a folder in parallel, as a stream
+def iter_documents(folder_path : str, on_file=None, names=None):
+    """iter_documents method loads every file of a folder in parallel and yields their Documents as files finish.
+
+    PDF text extraction is CPU bound and runs on a process pool (LOADER_PROCESSES); docx/txt files, csv/xlsx tables and the OCR
+    of scanned pdf pages (which waits on the OCR service) run on a thread pool. Only the pages classified
+    as scanned are sent to OCR. Documents are
+    yielded as soon as their file is done, so chunking and embedding start before the last
+    file is parsed. A file that fails is logged and reported, the other files still load.
+
+    Args:
+        folder_path (str): folder of the files
+        on_file (callable, optional): on_file(file, pages, seconds, error) once per file, error is None on success
+        names (list, optional): load only these file names of the folder. Defaults to every file.
+
+    Yields:
+        Document: one per page (or per OCR part) of each file
+    """
+    print("INFO : document_loader method started")
+    files = sorted(file for file in glob.glob(folder_path + "/*") if os.path.isfile(file))
+    if names is not None:
+        names = set(names)
+        files = [file for file in files if os.path.basename(file) in names]
+    threads = ThreadPoolExecutor(max_workers=LOADER_THREADS, thread_name_prefix="loader")
+    ## a single pdf gains nothing from a worker process
+    processes = get_process_pool() if sum(file_kind(file) == "pdf" for file in files) > 1 else None
+    ## future -> (file, stage, start time)
+    pending = {}
+
+    def report(file, pages, started, error=None):
+        seconds = round(time.perf_counter() - started, 3)
+        if error is None:
+            print(f"INFO : loaded {os.path.basename(file)} : {pages} pages in {seconds}s")
+        else:
+            print(f"ERROR : Can't extract the text from file {file} because of some problem : {error}")
+        record("load_file", seconds, error, file=os.path.basename(file), files=1, pages=pages, bytes=os.path.getsize(file))
+        if on_file is not None:
+            on_file(file, pages, seconds, error)
+
+    try:
+        print("INFO : starting text Extraction ")
+        for file in files:
+            kind = file_kind(file)
+            started = time.perf_counter()
+            if kind == "pdf":
+                pending[(processes or threads).submit(load_pdf, file)] = (file, "pdf", started)
+            elif kind == "text":
+                pending[threads.submit(load_text_file, file)] = (file, "text", started)
+            elif kind == "table":
+                pending[threads.submit(load_table, file)] = (file, "table", started)
+            else:
+                print(f"INFO : skipping {os.path.basename(file)}, unsupported file type")
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file, stage, started = pending.pop(future)
+                try:
+                    page = future.result()
+                except BrokenProcessPool as exp:
+                    ## a crashed parser takes the whole pool down, give its pdf's one more try on a new pool
+                    reset_process_pool()
+                    if stage == "pdf":
+                        processes = get_process_pool()
+                        pending[processes.submit(load_pdf, file)] = (file, "pdf-retry", started)
+                        continue
+                    page = exp
+                except Exception as exp:
+                    page = exp
+                if stage in ("pdf", "pdf-retry"):
+                    if isinstance(page, Exception):
+                        ## a pdf PyMuPDF can't read : whole file ocr
+                        pending[threads.submit(contextvars.copy_context().run, ocr_pdf, file)] = (file, "ocr", started)
+                        continue
+                    page, needs_ocr = page
+                    if needs_ocr:
+                        ## only the scanned pages go to ocr, merged back in page order
+                        ## copy_context : the ocr spans belong to the trace of the upload
+                        pending[threads.submit(contextvars.copy_context().run, ocr_scanned_pages, file, page, needs_ocr)] = (file, "ocr", started)
+                        continue
+                if isinstance(page, Exception):
+                    report(file, 0, started, page)
+                    continue
+                report(file, len(page), started)
+                yield from page
+        print("INFO : .........Extraction completed...........")
+    finally:
+        for future in pending:
+            future.cancel()
+        threads.shutdown(wait=False, cancel_futures=True)
+
 
 ## method for loading and extracting text from documents
 def document_loaders(folder_path : str) -> list:
     """
-    Loads a document from a file path.
+    Loads the documents of a folder.
 
     This function inspects the file extension to determine the appropriate
-    document loader. It is designed to handle various document types,
-    starting with PDF files using PyMuPDFLoader.
+    document loader. Files are loaded in parallel by `iter_documents`.
 
     Args:
-        file_path (str): The full path to the document file to be loaded.
+        folder_path (str): The folder of the documents to be loaded.
 
     Returns:
         list: A list of `langchain_core.documents.Document` objects, where each
               object represents a page of the document.
     """
     try:
-        print("INFO : document_loader method started")
-        final_document = []
-        folder_path = folder_path + "/*"
-        print("INFO : starting text Extraction ")
-        for file in glob.glob(folder_path):
-            print(file)
-            if file.endswith(".pdf") or file.endswith(".PDF"):
-                try:
-                    print("INFO : pdf......")
-                    # time.sleep(10)
-                    loader = PyMuPDFLoader(file)
-                    page = loader.load()
-                    # print(page)
-                    ## handling scanned pdf using mistral ai(mistral ocr)
-                    if page[0].page_content == "" or len(page[0].page_content) < 10: 
-                        if is_pdf_too_large(file):
-                            print("INFO : file is large")
-                            # splitting pdf by size
-                            split_pdf_by_size(file)
-                            # Get the directory of document.py
-                            CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
-                            # Go one level up to reach project root
-                            PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
-                            ## path for the temp folder
-                            temp_folder_path = PROJECT_ROOT +"/data"+"/temp_folder/*"
-                            # temp_folder_path = "/Users/sameersingh/Documents/MASIN/construction_claims_and_arbitration_expert/data/temp_folder/*"
-                            page = []
-                            for temp_file in glob.glob(temp_folder_path):
-                                text = split_pdf_using_temp_files(temp_file)
-                                temp_pages = []
-                                temp_pages.append(
-                                Document(
-                                page_content=text,
-                                metadata={"source": file}
-                                )   
-                                )
-                                page += temp_pages
-                        else:
-                            text = split_pdf_using_temp_files(file)
-                            page = []
-                            page.append( 
-                                Document(
-                                    page_content=text,
-                                    metadata={"source": file}
-                                )
-                            )
-                    # print(len(page))
-                except Exception as exp:
-                    try:
-                        text = split_pdf_using_temp_files(file)
-                        page = []
-                        page.append(
-                            Document(
-                                page_content=text,
-                                metadata={"source": file}
-                            )
-                        )
-                    except Exception as exp:
-                        print(f"ERROR : Can't extract the text from file {file} because of some problem : {exp}")
-            if file.endswith(".docx"):
-                print("INFO : docx......")
-                # time.sleep(10)
-                loader = Docx2txtLoader(file)
-                page = loader.load()
-                # print(len(page))
-            if file.endswith(".txt"):
-                print("INFO : txt......")
-                # time.sleep(10)
-                loader = TextLoader(file)
-                page = loader.load()
-            final_document = final_document + page
-            # print(len(final_document))
-            # time.sleep(10)
-        print("INFO : .........Extraction completed...........")
-        return final_document
+        return list(iter_documents(folder_path))
     except Exception as exp:
         print(f"ERROR : there is problem while extracting text from the document : {exp}")
         return []
 
+def text_splitter(kind : str = None):
+    """text_splitter method returns the splitter of CHUNKER : the structure-aware chunker (default), or the
+    500 character recursive splitter with recursive. Use a new one per stream of documents."""
+    if (kind or CHUNKER) == "recursive":
+        ## start_index lets the context builder merge overlapping neighbours back together
+        return RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100, add_start_index=True)
+    return StructureChunker()
+
 ## method for creating embeddings   
 def Chunking(document : list) -> list:
     """Chunking method is use for splitting the text into multiple chunks 
@@ -270,11 +417,38 @@ def Chunking(document : list) -> list:
         list: lists of chunks
     """
     try:
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-        chunks = text_splitter.split_documents(document)
+        chunks = text_splitter().split_documents(document)
         return chunks
     except Exception as exp:
         print(f"ERROR : there is problem while creating the Chunks : {exp}")
         return []
 
+## method for chunking a stream of documents
+def iter_chunks(documents, on_chunks=None):
+    """iter_chunks method splits documents into chunks as they arrive, e.g. from `iter_documents`.
+
+    Args:
+        documents (iterable): `Document` pages
+        on_chunks (callable, optional): on_chunks(document, chunks) after each document is split
+
+    Yields:
+        Document: chunks, in the same order Chunking would return them
+    """
+    splitter = text_splitter()
+    ## chunking is recorded as one span of the time spent splitting (not waiting for pages)
+    seconds, pages, total, tokens = 0.0, 0, 0, 0
+    try:
+        for doc in documents:
+            started = time.perf_counter()
+            chunks = splitter.split_documents([doc])
+            seconds += time.perf_counter() - started
+            pages += 1
+            total += len(chunks)
+            tokens += sum(count_tokens(chunk.page_content) for chunk in chunks)
+            if on_chunks is not None:
+                on_chunks(doc, chunks)
+            yield from chunks
+    finally:
+        record("chunk", seconds, pages=pages, chunks=total, tokens=tokens)
+
 # print(document_loaders("/Users/sameersingh/Documents/MASIN/construction_claims_and_arbitration_expert/data/processed"))
\ No newline at end of file
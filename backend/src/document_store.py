@@ -0,0 +1,330 @@
+## content-addressed store shared by the sessions : each unique file, and its chunks and vectors, is kept once
+import os
+import json
+import time
+import pickle
+import shutil
+import hashlib
+import threading
+import weakref
+import numpy as np
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+## location of the shared files, chunks and vectors
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", os.path.join(PROJECT_ROOT, "data", "store"))
+## set SHARED_STORE=false to give every session its own FAISS index and docstore, as before the store
+SHARED_STORE = os.getenv("SHARED_STORE", "true").lower() == "true"
+## documents and files no session refers to are deleted this long after they were last written, so an
+## ingestion that has just added them can still save the session that uses them
+STORE_GRACE_S = float(os.getenv("STORE_GRACE_S", 3600))
+
+BLOBS_DIR = "blobs"
+DOCUMENTS_DIR = "documents"
+CHUNKS_FILE = "chunks.pkl"
+VECTORS_FILE = "vectors.npy"
+TABLE_FILE = "table.parquet"
+## metadata holding the path of the file in its session folder, set back for each session using the document
+PATH_KEYS = ("source", "file_path")
+
+
+def store_profile(model : str, dimensions : int, metric : str, settings : tuple) -> str:
+    """store_profile method returns the name of the part of the store whose documents were read, chunked and embedded
+    the same way (model, dimensions, metric, and the ocr and chunking `settings`); other settings never reuse them."""
+    payload = json.dumps([model, dimensions, metric, list(settings)])
+    return f"{dimensions}-{hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]}"
+
+
+def document_key(digest : str, name : str = None) -> str:
+    """document_key method returns the address of a document in the store : its content sha256, combined with
+    its file name when the chunks depend on it (tables name the file in their text, a date in the name dates the chunks)."""
+    if name is None:
+        return digest
+    return hashlib.sha256(f"{digest}\x00{name}".encode("utf-8")).hexdigest()
+
+
+def document_dir(profile : str, key : str) -> str:
+    return os.path.join(DOCUMENT_STORE_DIR, DOCUMENTS_DIR, profile, key[:2], key)
+
+
+def has_document(profile : str, key : str) -> bool:
+    return os.path.exists(os.path.join(document_dir(profile, key), VECTORS_FILE))
+
+
+def claim_document(profile : str, key : str) -> bool:
+    """claim_document method tells whether a document is stored and, if so, marks it as just used, so the garbage
+    collection keeps it while the session reusing it is saved."""
+    try:
+        os.utime(document_dir(profile, key))
+    except OSError:
+        return False
+    return has_document(profile, key)
+
+
+def blob_path(digest : str) -> str:
+    return os.path.join(DOCUMENT_STORE_DIR, BLOBS_DIR, digest[:2], digest)
+
+
+def link_or_copy(source : str, target : str):
+    """link_or_copy method puts `source` at `target` as a hard link, or as a copy across file systems."""
+    temp = target + f".tmp-{os.getpid()}-{threading.get_ident()}"
+    try:
+        os.link(source, temp)
+    except OSError:
+        shutil.copyfile(source, temp)
+    os.replace(temp, target)
+
+
+def share_file(path : str, digest : str) -> bool:
+    """share_file method makes an uploaded file a hard link to the store's copy of its content, so a file uploaded
+    to several sessions takes its disk space once. The first upload of a content becomes the store's copy.
+    Returns True when the file now shares its content with an earlier upload.
+
+    Uploads are replaced (renamed over), never written in place, so the sessions sharing a file can't change it for each other.
+    """
+    blob = blob_path(digest)
+    try:
+        if os.path.exists(blob):
+            if os.path.samefile(blob, path):
+                return False
+            link_or_copy(blob, path)
+            return True
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        temp = blob + f".tmp-{os.getpid()}-{threading.get_ident()}"
+        os.link(path, temp)
+        os.replace(temp, blob)
+    except OSError as exp:
+        ## e.g. the store on another file system : the session keeps its own copy
+        print(f"INFO : {os.path.basename(path)} not shared : {exp}")
+    return False
+
+
+def share_files(folder : str, hashes : dict) -> int:
+    """share_files method shares the files {name: sha256} of a session folder with the store. Returns the files already stored."""
+    if not SHARED_STORE:
+        return 0
+    shared = sum(share_file(os.path.join(folder, name), digest) for name, digest in hashes.items())
+    if shared:
+        print(f"INFO : {shared} of {len(hashes)} uploaded files were already stored, their content is shared")
+    return shared
+
+
+def strip_paths(metadata : dict, name : str) -> tuple:
+    """strip_paths method returns (metadata without the session path of the file, keys that held it)."""
+    keys = [key for key in PATH_KEYS if isinstance(metadata.get(key), str) and os.path.basename(metadata[key]) == name]
+    return {key: value for key, value in metadata.items() if key not in keys}, keys
+
+
+def write_document(profile : str, key : str, name : str, chunks : list, vectors, table : str = None) -> bool:
+    """write_document method adds the chunks of a file and their vectors to the store.
+
+    The files are written to a temporary folder renamed into place, so a document is either complete or
+    absent; when another ingestion stored the same document meanwhile, its copy is kept.
+
+    Args:
+        profile (str): see store_profile
+        key (str): see document_key
+        name (str): file name in the session, removed from the chunk metadata
+        chunks (list): `Document` chunks of the file, in order
+        vectors (np.ndarray): their vectors, as held by the index (normalized for the cosine metric)
+        table (str, optional): parquet copy of a csv / xlsx file, reused by the sessions uploading it again
+
+    Returns:
+        bool: True if this call stored the document
+    """
+    target = document_dir(profile, key)
+    if has_document(profile, key):
+        return False
+    temp = target + f".tmp-{os.getpid()}-{threading.get_ident()}"
+    os.makedirs(temp, exist_ok=True)
+    records = []
+    for chunk in chunks:
+        metadata, path_keys = strip_paths(chunk.metadata, name)
+        records.append((chunk.page_content, metadata, path_keys))
+    with open(os.path.join(temp, CHUNKS_FILE), "wb") as f:
+        pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+    if table is not None and os.path.exists(table):
+        link_or_copy(table, os.path.join(temp, TABLE_FILE))
+    ## the vectors are written last, their presence marks a complete document
+    np.save(os.path.join(temp, VECTORS_FILE), np.ascontiguousarray(vectors, dtype=np.float32))
+    try:
+        os.rename(temp, target)
+    except OSError:
+        shutil.rmtree(temp, ignore_errors=True)
+        return False
+    return True
+
+
+def restore_table(profile : str, key : str, target : str):
+    """restore_table method gives a session the parquet copy of a stored csv / xlsx file, when it has none."""
+    source = os.path.join(document_dir(profile, key), TABLE_FILE)
+    if os.path.exists(source) and not os.path.exists(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        link_or_copy(source, target)
+
+
+class SharedDocument:
+    def __init__(self, key : str, records : list, vectors : np.ndarray):
+        """SharedDocument is a stored document loaded in this process : the text and metadata of its chunks and
+        their vectors (memory-mapped), shared by every loaded session that holds the file."""
+        self.key = key
+        self.texts = [text for text, _, _ in records]
+        self.metadata = [metadata for _, metadata, _ in records]
+        self.path_keys = [path_keys for _, _, path_keys in records]
+        self.vectors = vectors
+        self._sq_norms = None
+        self.nbytes = int(vectors.nbytes) + sum(len(text) for text in self.texts)
+
+    def __len__(self):
+        return len(self.texts)
+
+    def sq_norms(self) -> np.ndarray:
+        if self._sq_norms is None:
+            self._sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors) if len(self) else np.zeros(0, dtype=np.float32)
+        return self._sq_norms
+
+    def chunk_metadata(self, i : int, path : str) -> dict:
+        """chunk_metadata method returns the metadata of chunk i as seen by the session holding the file at `path`."""
+        metadata = dict(self.metadata[i])
+        for key in self.path_keys[i]:
+            metadata[key] = path
+        return metadata
+
+
+## documents loaded in this process, kept while a loaded session holds them
+_loaded = weakref.WeakValueDictionary()
+_loaded_lock = threading.Lock()
+
+
+def open_document(profile : str, key : str, mmap : bool = True) -> SharedDocument:
+    """open_document method returns a stored document, loaded once per process however many sessions use it."""
+    with _loaded_lock:
+        document = _loaded.get((profile, key))
+        if document is None:
+            folder = document_dir(profile, key)
+            with open(os.path.join(folder, CHUNKS_FILE), "rb") as f:
+                records = pickle.load(f)
+            vectors = np.load(os.path.join(folder, VECTORS_FILE), mmap_mode="r" if mmap else None)
+            document = SharedDocument(key, records, vectors)
+            _loaded[(profile, key)] = document
+        return document
+
+
+class SharedIndex:
+    def __init__(self, documents : list, dimensions : int, inner_product : bool = False):
+        """SharedIndex is an exact (flat) search over the vectors of a session's shared documents, in the order of
+        the session. It answers the calls a langchain FAISS store and the context builder make on a faiss index
+        (search, reconstruct, ntotal, d), so a session is served by the same code as with an index of its own
+        while its vectors stay those of the store.
+
+        Args:
+            documents (list): SharedDocument of the session, in order
+            dimensions (int): size of the vectors
+            inner_product (bool, optional): scores are inner products instead of squared L2 distances
+        """
+        self.documents = list(documents)
+        self.d = dimensions
+        self.inner_product = inner_product
+        self.offsets = np.cumsum([0] + [len(document) for document in self.documents]).astype(np.int64)
+        self.ntotal = int(self.offsets[-1])
+
+    def scores(self, query : np.ndarray) -> np.ndarray:
+        """scores method returns the score of every vector of the session for one query."""
+        if self.ntotal == 0:
+            return np.zeros(0, dtype=np.float32)
+        blocks = []
+        for document in self.documents:
+            if not len(document):
+                continue
+            products = document.vectors @ query
+            blocks.append(products if self.inner_product else document.sq_norms() - 2 * products)
+        scores = np.concatenate(blocks)
+        return scores if self.inner_product else scores + float(query @ query)
+
+    def search(self, x, k : int, positions : np.ndarray = None) -> tuple:
+        """search method returns (scores, positions) of the k best vectors for each query row, like faiss :
+        best first, padded with -1 positions. `positions` restricts the search to those vectors."""
+        queries = np.asarray(x, dtype=np.float32).reshape(-1, self.d)
+        distances = np.full((len(queries), k), -np.inf if self.inner_product else np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for row, query in enumerate(queries):
+            scores = self.scores(query)
+            candidates = np.arange(self.ntotal, dtype=np.int64)
+            if positions is not None:
+                candidates = np.asarray(positions, dtype=np.int64)
+                scores = scores[candidates]
+            count = min(k, len(candidates))
+            if count == 0:
+                continue
+            keys = -scores if self.inner_product else scores
+            best = np.argpartition(keys, count - 1)[:count] if count < len(keys) else np.arange(len(keys))
+            best = best[np.argsort(keys[best], kind="stable")]
+            distances[row, :count] = scores[best]
+            ids[row, :count] = candidates[best]
+        return distances, ids
+
+    def locate(self, position : int) -> tuple:
+        number = int(np.searchsorted(self.offsets, position, side="right")) - 1
+        return self.documents[number], position - int(self.offsets[number])
+
+    def reconstruct(self, position : int) -> np.ndarray:
+        document, i = self.locate(int(position))
+        return np.array(document.vectors[i], dtype=np.float32)
+
+    def reconstruct_batch(self, positions) -> np.ndarray:
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return np.zeros((0, self.d), dtype=np.float32)
+        return np.stack([self.reconstruct(position) for position in positions])
+
+    def reconstruct_n(self, start : int, n : int) -> np.ndarray:
+        return self.reconstruct_batch(np.arange(start, start + n))
+
+    def shared_bytes(self) -> dict:
+        """shared_bytes method returns {document key: bytes} of the stored documents the session holds."""
+        return {document.key: document.nbytes for document in self.documents}
+
+
+def remove_empty(folder : str):
+    try:
+        os.rmdir(folder)
+    except OSError:
+        ## not empty, or being written to
+        pass
+
+
+def collect_garbage(referenced : set, grace : float = None) -> int:
+    """collect_garbage method deletes the documents no session refers to and the files no session folder links
+    to anymore, once they are older than `grace` seconds (default STORE_GRACE_S). Returns the bytes freed.
+
+    Args:
+        referenced (set): (profile, key) of the documents held by a session
+        grace (float, optional): Defaults to STORE_GRACE_S.
+    """
+    grace = STORE_GRACE_S if grace is None else grace
+    now = time.time()
+    freed = 0
+    documents = os.path.join(DOCUMENT_STORE_DIR, DOCUMENTS_DIR)
+    for profile in os.listdir(documents) if os.path.isdir(documents) else ():
+        for prefix in os.listdir(os.path.join(documents, profile)):
+            folder = os.path.join(documents, profile, prefix)
+            for key in os.listdir(folder):
+                path = os.path.join(folder, key)
+                if (profile, key) in referenced or now - os.path.getmtime(path) <= grace:
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size
+            remove_empty(folder)
+    blobs = os.path.join(DOCUMENT_STORE_DIR, BLOBS_DIR)
+    for prefix in os.listdir(blobs) if os.path.isdir(blobs) else ():
+        for entry in os.scandir(os.path.join(blobs, prefix)):
+            stat = entry.stat()
+            ## a blob no upload links to anymore
+            if stat.st_nlink == 1 and now - stat.st_mtime > grace:
+                os.remove(entry.path)
+                freed += stat.st_size
+        remove_empty(os.path.join(blobs, prefix))
+    if freed:
+        print(f"INFO : document store : {freed / 2**20:.1f} MB of documents no session uses were deleted")
+    return freed
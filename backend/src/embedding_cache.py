@@ -0,0 +1,155 @@
+## persistent, content-addressed cache of chunk embeddings
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+import numpy as np
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+## location of the cache database
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", os.path.join(PROJECT_ROOT, "data", "cache", "embeddings.sqlite"))
+## size budget of the cached vectors, least recently used entries are evicted above it
+EMBED_CACHE_MAX_MB = float(os.getenv("EMBED_CACHE_MAX_MB", 2048))
+## set EMBED_CACHE=false to always call the embedding model
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "true").lower() == "true"
+
+## sqlite limits the number of bound parameters per statement
+LOOKUP_BATCH = 500
+
+
+def normalize_text(text : str) -> str:
+    """normalize_text method makes whitespace and unicode variants of the same chunk hash alike."""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(model : str, dimensions : int, text : str) -> str:
+    """cache_key method returns the content address of a chunk for one embedding model and size."""
+    payload = f"{model}\x00{dimensions}\x00{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, model : str, dimensions : int, path : str = None, max_mb : float = None):
+        """EmbeddingCache stores float32 vectors in SQLite keyed by (model, dimensions, chunk text hash).
+
+        Args:
+            model (str): embedding model name
+            dimensions (int): size of the vectors
+            path (str, optional): database file. Defaults to EMBED_CACHE_PATH.
+            max_mb (float, optional): size budget of the vectors. Defaults to EMBED_CACHE_MAX_MB.
+        """
+        self.model = model
+        self.dimensions = dimensions
+        self.path = path or EMBED_CACHE_PATH
+        self.max_bytes = int((max_mb or EMBED_CACHE_MAX_MB) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, dimensions INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def get_many(self, texts : list) -> list:
+        """get_many method looks up the vectors of several chunks.
+
+        Args:
+            texts (list): chunk texts
+
+        Returns:
+            list: one entry per text, a list of floats on a hit and None on a miss
+        """
+        keys = [cache_key(self.model, self.dimensions, text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                part = keys[start:start + LOOKUP_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part).fetchall()
+                found.update(rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += len([key for key in keys if key in found])
+            self.misses += len([key for key in keys if key not in found])
+        return [np.frombuffer(found[key], dtype=np.float32).tolist() if key in found else None for key in keys]
+
+    def put_many(self, texts : list, vectors : list):
+        """put_many method writes freshly computed vectors back to the cache and evicts if over budget."""
+        now = time.time()
+        ## one row per key, a chunk text repeated in the batch is written once
+        rows = {}
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            key = cache_key(self.model, self.dimensions, text)
+            rows[key] = (key, self.model, self.dimensions, blob, len(blob), now)
+        keys = list(rows)
+        with self._lock:
+            ## rows replaced by INSERT OR REPLACE no longer count
+            replaced = 0
+            for start in range(0, len(keys), LOOKUP_BATCH):
+                part = keys[start:start + LOOKUP_BATCH]
+                marks = ",".join("?" * len(part))
+                replaced += self._conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM embeddings WHERE key IN ({marks})", part).fetchone()[0]
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?)", list(rows.values()))
+            self._conn.commit()
+            self._total_bytes += sum(row[4] for row in rows.values()) - replaced
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """_evict method drops least recently used vectors until the cache is at 90% of its budget."""
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        while self._total_bytes > target:
+            rows = self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access LIMIT 1000").fetchall()
+            if not rows:
+                break
+            drop, freed = [], 0
+            for key, size in rows:
+                if self._total_bytes - freed <= target:
+                    break
+                drop.append((key,))
+                freed += size
+            self._conn.executemany("DELETE FROM embeddings WHERE key = ?", drop)
+            self._conn.commit()
+            self._total_bytes -= freed
+            self.evictions += len(drop)
+        print(f"INFO : embedding cache evicted down to {self._total_bytes / (1024 * 1024):.1f} MB")
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "size_mb": round(self._total_bytes / (1024 * 1024), 2),
+        }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model : str, dimensions : int):
+    """get_embedding_cache method returns the process-wide cache of a model, or None when caching is disabled."""
+    if not EMBED_CACHE_ENABLED:
+        return None
+    with _caches_lock:
+        if (model, dimensions) not in _caches:
+            _caches[(model, dimensions)] = EmbeddingCache(model, dimensions)
+        return _caches[(model, dimensions)]
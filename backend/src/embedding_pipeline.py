@@ -0,0 +1,226 @@
+## batched, concurrent embedding of chunks with rate limit backoff
+import os
+import time
+import random
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from tokens import count_tokens
+from telemetry import span
+
+## token budget of one embedding request (OpenAI accepts up to 300k tokens / 2048 inputs)
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", 50000))
+## maximum number of chunks in one embedding request
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 512))
+## maximum number of embedding requests in flight
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 4))
+## retries of one batch before the whole run fails
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", 6))
+## chunks looked up in the embedding cache at a time
+CACHE_LOOKUP_SIZE = 256
+
+
+def is_rate_limit_error(exp : Exception) -> bool:
+    """is_rate_limit_error method tells whether an exception from the embedding client is a 429."""
+    if getattr(exp, "status_code", None) == 429:
+        return True
+    response = getattr(exp, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    return "RateLimit" in type(exp).__name__ or "429" in str(exp)
+
+
+def pack_batches(documents, max_tokens : int = None, max_items : int = None):
+    """pack_batches method groups chunks into batches that fit a token budget.
+
+    Chunks are consumed lazily, so batches are produced while upstream stages are
+    still producing chunks.
+
+    Args:
+        documents (iterable): `Document` chunks
+        max_tokens (int, optional): token budget per batch. Defaults to EMBED_BATCH_TOKENS.
+        max_items (int, optional): chunks per batch. Defaults to EMBED_BATCH_SIZE.
+
+    Yields:
+        tuple: (list of documents, total tokens of the batch)
+    """
+    max_tokens = max_tokens or EMBED_BATCH_TOKENS
+    max_items = max_items or EMBED_BATCH_SIZE
+    batch, batch_tokens = [], 0
+    for doc in documents:
+        tokens = count_tokens(doc.page_content)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_items):
+            yield batch, batch_tokens
+            batch, batch_tokens = [], 0
+        batch.append(doc)
+        batch_tokens += tokens
+    if batch:
+        yield batch, batch_tokens
+
+
+class AdaptiveLimiter:
+    def __init__(self, max_concurrency : int, base_delay : float = 1.0, max_delay : float = 60.0):
+        """AdaptiveLimiter keeps the number of requests in flight under what the API tolerates.
+
+        The limit is halved on every rate limit error and grows back by one after a run
+        of successful requests (additive increase, multiplicative decrease).
+
+        Args:
+            max_concurrency (int): upper bound of requests in flight
+            base_delay (float, optional): first backoff delay in seconds. Defaults to 1.0.
+            max_delay (float, optional): largest backoff delay in seconds. Defaults to 60.0.
+        """
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.successes = 0
+
+    def on_success(self):
+        self.successes += 1
+        if self.limit < self.max_concurrency and self.successes >= self.limit:
+            self.limit += 1
+            self.successes = 0
+
+    def on_rate_limit(self):
+        self.limit = max(1, self.limit // 2)
+        self.successes = 0
+
+    def backoff(self, attempt : int) -> float:
+        """backoff method returns the delay before retry number `attempt`, with full jitter."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+class EmbeddingPipeline:
+    def __init__(self, embed_fn, batch_tokens : int = None, batch_size : int = None,
+                 concurrency : int = None, max_retries : int = None, on_progress=None, cache=None):
+        """EmbeddingPipeline embeds chunks in token-budgeted batches with several requests in flight.
+
+        Args:
+            embed_fn (callable): embed_fn(list of str) -> list of vectors, e.g. `OpenAIEmbeddings.embed_documents`
+                or any local fake with the same signature
+            batch_tokens (int, optional): token budget per request. Defaults to EMBED_BATCH_TOKENS.
+            batch_size (int, optional): chunks per request. Defaults to EMBED_BATCH_SIZE.
+            concurrency (int, optional): requests in flight. Defaults to EMBED_CONCURRENCY.
+            max_retries (int, optional): retries per batch. Defaults to EMBED_MAX_RETRIES.
+            on_progress (callable, optional): on_progress(chunks_done, stats) after every finished batch
+            cache (EmbeddingCache, optional): vectors found here are not sent to `embed_fn`, new vectors are written back
+        """
+        self.embed_fn = embed_fn
+        self.batch_tokens = batch_tokens or EMBED_BATCH_TOKENS
+        self.batch_size = batch_size or EMBED_BATCH_SIZE
+        self.concurrency = concurrency or EMBED_CONCURRENCY
+        self.max_retries = EMBED_MAX_RETRIES if max_retries is None else max_retries
+        self.on_progress = on_progress
+        self.cache = cache
+        self.stats = {}
+
+    def _embed_batch(self, batch, tokens, delay, attempt):
+        if delay:
+            time.sleep(delay)
+        with span("embed_batch", chunks=len(batch), tokens=tokens, attempt=attempt):
+            return self.embed_fn([doc.page_content for doc in batch])
+
+    def _cache_misses(self, documents, sink, stats):
+        """_cache_misses method sends cached chunks straight to `sink` and yields only the ones to embed."""
+        group = []
+        for doc in documents:
+            group.append(doc)
+            if len(group) >= CACHE_LOOKUP_SIZE:
+                yield from self._lookup(group, sink, stats)
+                group = []
+        if group:
+            yield from self._lookup(group, sink, stats)
+
+    def _lookup(self, group, sink, stats):
+        vectors = self.cache.get_many([doc.page_content for doc in group])
+        hits = [(doc, vector) for doc, vector in zip(group, vectors) if vector is not None]
+        if hits:
+            sink([doc for doc, _ in hits], [vector for _, vector in hits])
+            stats["chunks"] += len(hits)
+            stats["cache_hits"] += len(hits)
+            if self.on_progress is not None:
+                self.on_progress(stats["chunks"], stats)
+        for doc, vector in zip(group, vectors):
+            if vector is None:
+                stats["cache_misses"] += 1
+                yield doc
+
+    def run(self, documents, sink) -> dict:
+        """run method embeds all chunks and hands every finished batch to `sink`.
+
+        Batches finish out of order; `sink` is always called from the calling thread, one
+        batch at a time, so it can write to a vector store without locking.
+
+        Args:
+            documents (iterable): `Document` chunks, consumed lazily
+            sink (callable): sink(list of documents, list of vectors)
+
+        Raises:
+            Exception: the last error of a batch that failed more than `max_retries` times
+
+        Returns:
+            dict: throughput stats (chunks, tokens, batches, retries, cache hits/misses, seconds, chunks_per_second, tokens_per_second)
+        """
+        limiter = AdaptiveLimiter(self.concurrency)
+        stats = {"chunks": 0, "tokens": 0, "batches": 0, "retries": 0, "rate_limited": 0,
+                 "cache_hits": 0, "cache_misses": 0}
+        if self.cache is not None:
+            documents = self._cache_misses(documents, sink, stats)
+        batches = pack_batches(documents, self.batch_tokens, self.batch_size)
+        start = time.perf_counter()
+        in_flight = {}
+        executor = ThreadPoolExecutor(max_workers=limiter.max_concurrency, thread_name_prefix="embed")
+        exhausted = False
+        try:
+            while True:
+                ## keep as many requests in flight as the limiter currently allows
+                while not exhausted and len(in_flight) < limiter.limit:
+                    item = next(batches, None)
+                    if item is None:
+                        exhausted = True
+                        break
+                    batch, tokens = item
+                    ## copy_context : the batch spans belong to the trace of the upload
+                    future = executor.submit(contextvars.copy_context().run, self._embed_batch, batch, tokens, 0, 0)
+                    in_flight[future] = (batch, tokens, 0)
+                if not in_flight:
+                    break
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, tokens, attempt = in_flight.pop(future)
+                    try:
+                        vectors = future.result()
+                    except Exception as exp:
+                        if attempt >= self.max_retries:
+                            raise
+                        if is_rate_limit_error(exp):
+                            stats["rate_limited"] += 1
+                            limiter.on_rate_limit()
+                        stats["retries"] += 1
+                        delay = limiter.backoff(attempt)
+                        print(f"INFO : embedding batch of {len(batch)} failed ({type(exp).__name__}), retry {attempt + 1} in {delay:.1f}s")
+                        retry = executor.submit(contextvars.copy_context().run, self._embed_batch, batch, tokens, delay, attempt + 1)
+                        in_flight[retry] = (batch, tokens, attempt + 1)
+                        continue
+                    limiter.on_success()
+                    if self.cache is not None:
+                        self.cache.put_many([doc.page_content for doc in batch], vectors)
+                    sink(batch, vectors)
+                    stats["chunks"] += len(batch)
+                    stats["tokens"] += tokens
+                    stats["batches"] += 1
+                    if self.on_progress is not None:
+                        self.on_progress(stats["chunks"], stats)
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        seconds = time.perf_counter() - start
+        stats["seconds"] = round(seconds, 3)
+        stats["chunks_per_second"] = round(stats["chunks"] / seconds, 2) if seconds else 0.0
+        stats["tokens_per_second"] = round(stats["tokens"] / seconds, 2) if seconds else 0.0
+        self.stats = stats
+        print(f"INFO : embedded {stats['chunks']} chunks in {stats['batches']} batches, "
+              f"{stats['chunks_per_second']} chunks/s, {stats['tokens_per_second']} tokens/s, "
+              f"{stats['retries']} retries ({stats['rate_limited']} rate limited), "
+              f"cache {stats['cache_hits']} hits / {stats['cache_misses']} misses")
+        return stats
+
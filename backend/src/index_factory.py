@@ -0,0 +1,258 @@
+## choice and construction of the FAISS index of a session
+import os
+import math
+import numpy as np
+import faiss
+
+## flat | hnsw | ivfpq | opq | auto (pick by number of chunks)
+INDEX_TYPE = os.getenv("INDEX_TYPE", "auto").lower()
+## l2 | cosine (vectors normalized, then L2) | ip (raw inner product)
+INDEX_METRIC = os.getenv("INDEX_METRIC", "l2").lower()
+## size of text-embedding-3-large vectors; smaller values use its Matryoshka-style shortened embeddings
+EMBED_DIMENSIONS = int(os.getenv("EMBED_DIMENSIONS", 3072))
+## chunk counts above which auto switches from flat to hnsw, and from hnsw to ivf-pq
+HNSW_MIN_CHUNKS = int(os.getenv("HNSW_MIN_CHUNKS", 20000))
+IVFPQ_MIN_CHUNKS = int(os.getenv("IVFPQ_MIN_CHUNKS", 200000))
+## hnsw graph degree and search breadth
+HNSW_M = int(os.getenv("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 128))
+## bytes per vector of product quantization, and inverted lists probed per query
+PQ_BYTES = int(os.getenv("PQ_BYTES", 64))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", 32))
+## product quantizers need about 39 training points per each of their 256 centroids
+MIN_TRAIN_VECTORS = 39 * 256
+
+
+def resolve_type(n_vectors : int, index_type : str = None) -> str:
+    """resolve_type method turns INDEX_TYPE=auto into a concrete index type for a corpus size."""
+    index_type = (index_type or INDEX_TYPE).lower()
+    if index_type != "auto":
+        return index_type
+    if n_vectors >= IVFPQ_MIN_CHUNKS:
+        return "ivfpq"
+    if n_vectors >= HNSW_MIN_CHUNKS:
+        return "hnsw"
+    return "flat"
+
+
+def faiss_metric(metric : str = None):
+    return faiss.METRIC_INNER_PRODUCT if (metric or INDEX_METRIC) == "ip" else faiss.METRIC_L2
+
+
+def pq_bytes(dimensions : int) -> int:
+    """pq_bytes method returns the largest number of PQ sub-quantizers <= PQ_BYTES that divides the dimension."""
+    m = min(PQ_BYTES, dimensions)
+    while dimensions % m:
+        m -= 1
+    return m
+
+
+def create_index(dimensions : int, n_vectors : int, index_type : str = None, metric : str = None):
+    """create_index method builds an empty FAISS index suited to the expected number of vectors.
+
+    Args:
+        dimensions (int): size of the vectors
+        n_vectors (int): expected number of vectors, used by auto selection and to size IVF lists
+        index_type (str, optional): flat, hnsw, ivfpq, opq or auto. Defaults to INDEX_TYPE.
+        metric (str, optional): l2, cosine or ip. Defaults to INDEX_METRIC.
+
+    Returns:
+        faiss.Index: the index, untrained for ivfpq/opq
+    """
+    index_type = resolve_type(n_vectors, index_type)
+    faiss_metric_type = faiss_metric(metric)
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dimensions) if faiss_metric_type == faiss.METRIC_INNER_PRODUCT else faiss.IndexFlatL2(dimensions)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensions, HNSW_M, faiss_metric_type)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+        return index
+    if index_type in ("ivfpq", "opq"):
+        ## about 4 * sqrt(n) lists, each trained with at least 39 points per centroid
+        nlist = max(1, min(int(4 * math.sqrt(max(n_vectors, 1))), n_vectors // 39 or 1))
+        m = pq_bytes(dimensions)
+        prefix = f"OPQ{m}," if index_type == "opq" else ""
+        index = faiss.index_factory(dimensions, f"{prefix}IVF{nlist},PQ{m}", faiss_metric_type)
+        configure_search(index)
+        return index
+    raise ValueError(f"unknown INDEX_TYPE {index_type}")
+
+
+def build_index(blocks : list, dimensions : int, index_type : str = None, metric : str = None):
+    """build_index method builds an index over vectors given as blocks (e.g. the shared documents of a session).
+
+    Quantized types are trained on an even sample of the vectors; with too few vectors to train
+    them an hnsw index is built instead.
+
+    Args:
+        blocks (list): arrays of vectors, in order
+        dimensions (int): size of the vectors
+        index_type (str, optional): flat, hnsw, ivfpq, opq or auto. Defaults to INDEX_TYPE.
+        metric (str, optional): l2, cosine or ip. Defaults to INDEX_METRIC.
+
+    Returns:
+        faiss.Index: the filled index
+    """
+    n = sum(len(block) for block in blocks)
+    index_type = resolve_type(n, index_type)
+    if index_type in ("ivfpq", "opq") and n < MIN_TRAIN_VECTORS:
+        print(f"INFO : {n} vectors are too few to train {index_type}, building hnsw")
+        index_type = "hnsw"
+    index = create_index(dimensions, n, index_type, metric)
+    if not index.is_trained:
+        step = max(1, n // (MIN_TRAIN_VECTORS * 4))
+        index.train(np.concatenate([np.asarray(block[::step], dtype=np.float32) for block in blocks if len(block)]))
+    for block in blocks:
+        for start in range(0, len(block), 10000):
+            index.add(np.ascontiguousarray(block[start:start + 10000], dtype=np.float32))
+    configure_search(index)
+    print(f"INFO : index ready : {index_type} with {n} vectors of {dimensions} dimensions")
+    return index
+
+
+def configure_search(index):
+    """configure_search method applies the query-time knobs (efSearch, nprobe) to a loaded index."""
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = min(IVF_NPROBE, ivf.nlist)
+        ## MMR reconstructs candidate vectors, which IVF indexes only support with a direct map
+        if ivf.direct_map.type == faiss.DirectMap.NoMap:
+            ivf.make_direct_map()
+    return index
+
+
+def search_parameters(index, positions):
+    """search_parameters method returns the search parameters of `index` that restrict a search to `positions`,
+    with the index's own efSearch / nprobe."""
+    selector = faiss.IDSelectorBatch(np.ascontiguousarray(positions, dtype=np.int64))
+    ivf = faiss.try_extract_index_ivf(index)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    return faiss.SearchParameters(sel=selector)
+
+
+def describe(index) -> str:
+    if isinstance(index, faiss.IndexPreTransform):
+        return "opq"
+    if hasattr(index, "hnsw"):
+        return "hnsw"
+    if faiss.try_extract_index_ivf(index) is not None:
+        return "ivfpq"
+    return "flat"
+
+
+class AdaptiveIndex:
+    def __init__(self, vector_store, dimensions : int, index_type : str = None, metric : str = None):
+        """AdaptiveIndex streams vectors into a langchain FAISS store and upgrades its index as the corpus grows.
+
+        Vectors go into a flat index first. With INDEX_TYPE=auto, once the number of
+        vectors crosses HNSW_MIN_CHUNKS the vectors added so far are moved into an HNSW
+        index and streaming continues there. Quantized types (ivfpq, opq) need training
+        data, so they are built from the streamed vectors in `finalize`, and only when
+        there are enough vectors to train them. A store that already has an index (an
+        incremental update of a saved session) keeps it and is extended in place.
+
+        Args:
+            vector_store (FAISS): store whose `index` is managed
+            dimensions (int): size of the vectors
+            index_type (str, optional): flat, hnsw, ivfpq, opq or auto. Defaults to INDEX_TYPE.
+            metric (str, optional): l2, cosine or ip. Defaults to INDEX_METRIC.
+        """
+        self.vector_store = vector_store
+        self.dimensions = dimensions
+        self.index_type = (index_type or INDEX_TYPE).lower()
+        self.metric = metric or INDEX_METRIC
+        if vector_store.index is not None:
+            self.current = describe(vector_store.index)
+        else:
+            self.current = "hnsw" if self.index_type == "hnsw" else "flat"
+            vector_store.index = create_index(dimensions, 0, self.current, self.metric)
+
+    def add(self, batch : list, vectors : list):
+        """add method is the embedding pipeline sink: it appends a batch of chunks and their vectors."""
+        self.vector_store.add_embeddings(
+            text_embeddings=[(doc.page_content, vector) for doc, vector in zip(batch, vectors)],
+            metadatas=[doc.metadata for doc in batch],
+        )
+        if self.index_type == "auto":
+            target = resolve_type(self.vector_store.index.ntotal, "auto")
+            if target == "hnsw" and self.current == "flat":
+                self._rebuild(target)
+
+    def remove(self, doc_ids : list):
+        """remove method deletes chunks and their vectors from the store, by docstore id."""
+        store = self.vector_store
+        drop = set(doc_ids)
+        if not drop:
+            return
+        if self.current == "flat":
+            store.delete(list(drop))
+            return
+        old = store.index
+        keep = np.array([p for p in range(old.ntotal) if store.index_to_docstore_id[p] not in drop], dtype=np.int64)
+        ivf = faiss.try_extract_index_ivf(old)
+        if ivf is not None:
+            self._remove_ivf(ivf, keep)
+        else:
+            ## hnsw graphs can't drop nodes, the vectors that stay are added to an emptied copy (hnsw stores them unquantized)
+            index = faiss.clone_index(old)
+            index.reset()
+            for start in range(0, old.ntotal, 10000):
+                block = keep[(keep >= start) & (keep < start + 10000)]
+                if len(block):
+                    index.add(old.reconstruct_n(start, min(10000, old.ntotal - start))[block - start])
+            store.index = index
+        configure_search(store.index)
+        store.index_to_docstore_id = {position: store.index_to_docstore_id[p] for position, p in enumerate(keep.tolist())}
+        store.docstore.delete(list(drop))
+
+    def _remove_ivf(self, ivf, keep):
+        """_remove_ivf method drops the vectors not in `keep` from the inverted lists, keeping the codes of the others
+        as they are (re-adding reconstructed vectors would quantize them twice), then renumbers the ids left in the
+        lists to their new positions, which the store's index_to_docstore_id uses."""
+        index = self.vector_store.index
+        n = index.ntotal
+        removed = np.setdiff1d(np.arange(n, dtype=np.int64), keep)
+        ## an array direct map can't remove ids, configure_search makes it again
+        ivf.set_direct_map_type(faiss.DirectMap.NoMap)
+        index.remove_ids(faiss.IDSelectorBatch(removed))
+        positions = np.full(n, -1, dtype=np.int64)
+        positions[keep] = np.arange(len(keep), dtype=np.int64)
+        invlists = ivf.invlists
+        for list_no in range(ivf.nlist):
+            size = invlists.list_size(list_no)
+            if size:
+                ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+                ids[:] = positions[ids]
+
+    def finalize(self):
+        """finalize method trains and fills the quantized index once all vectors are known."""
+        n = self.vector_store.index.ntotal
+        target = resolve_type(n, self.index_type)
+        if target in ("ivfpq", "opq") and n < MIN_TRAIN_VECTORS:
+            print(f"INFO : {n} vectors are too few to train {target}, keeping {self.current}")
+            target = self.current
+        if target != self.current:
+            self._rebuild(target)
+        print(f"INFO : index ready : {self.current} with {n} vectors of {self.dimensions} dimensions")
+        return self.vector_store.index
+
+    def _rebuild(self, target : str):
+        old = self.vector_store.index
+        n = old.ntotal
+        vectors = old.reconstruct_n(0, n) if n else np.zeros((0, self.dimensions), dtype=np.float32)
+        index = create_index(self.dimensions, n, target, self.metric)
+        if not index.is_trained:
+            index.train(vectors)
+        if n:
+            index.add(vectors)
+        configure_search(index)
+        self.vector_store.index = index
+        print(f"INFO : index moved from {self.current} to {target} at {n} vectors")
+        self.current = target
@@ -0,0 +1,237 @@
+## background ingestion of uploaded documents
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+## job statuses, in the order a healthy job moves through them
+QUEUED = "queued"
+LOADING = "loading"
+CHUNKING = "chunking"
+EMBEDDING = "embedding"
+INDEXING = "indexing"
+READY = "ready"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (READY, FAILED, CANCELLED)
+
+
+class IngestionCancelled(Exception):
+    """Raised inside a worker when the job it is running has been cancelled."""
+
+
+class IngestionJob:
+    def __init__(self, session_id : str, folder : str, on_status=None):
+        """IngestionJob keeps the status and progress counts of one session's ingestion.
+
+        Args:
+            session_id (str): session the documents belong to
+            folder (str): upload folder of the session
+            on_status (callable, optional): on_status(job) after every status change, e.g. to persist it
+        """
+        self.session_id = session_id
+        self.folder = folder
+        self.status = QUEUED
+        self.progress = {
+            "files_total": 0,
+            "files_loaded": 0,
+            "failed_files": [],
+            "documents": 0,
+            "chunks_total": 0,
+            "chunks_embedded": 0,
+        }
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.started_at = None
+        self.finished_at = None
+        self.future = None
+        self.on_status = on_status
+        ## set once the worker starts replacing the saved index, cancels are refused from then on
+        self.committed = False
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def update(self, status : str = None, **progress):
+        """update method moves the job to a new status and/or updates its progress counts.
+
+        It is called by the worker between stages, so it is also the point where a
+        cancelled job stops.
+
+        Args:
+            status (str, optional): new status of the job. Defaults to None (keep current).
+            **progress: progress counters to overwrite (files_total, chunks_embedded, ...)
+
+        Raises:
+            IngestionCancelled: if the job was cancelled
+        """
+        if self.cancelled:
+            raise IngestionCancelled(f"ingestion for session {self.session_id} was cancelled")
+        with self._lock:
+            changed = status is not None and status != self.status
+            if status is not None:
+                self.status = status
+                if self.started_at is None and status != QUEUED:
+                    self.started_at = time.time()
+            self.progress.update(progress)
+            self.updated_at = time.time()
+        if changed:
+            self.notify()
+
+    def commit(self):
+        """commit method is called by the worker right before it replaces the saved index of the session.
+
+        A job cancelled until then stops here; later cancels are refused, since the new index is
+        served as soon as it is saved and the job has to finish READY.
+
+        Raises:
+            IngestionCancelled: if the job was cancelled
+        """
+        with self._lock:
+            if self.cancelled:
+                raise IngestionCancelled(f"ingestion for session {self.session_id} was cancelled")
+            self.committed = True
+
+    def finish(self, status : str, error : str = None):
+        with self._lock:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self.updated_at = self.finished_at
+        self.notify()
+
+    def notify(self):
+        if self.on_status is None:
+            return
+        try:
+            self.on_status(self)
+        except Exception as exp:
+            print(f"ERROR : could not record status of session {self.session_id} : {exp}")
+
+    def cancel(self) -> bool:
+        """cancel method asks the job to stop. Returns False if the job had already finished or is saving its index."""
+        with self._lock:
+            if self.finished or self.committed:
+                return False
+            self._cancel_event.set()
+        ## a job that never left the queue can be marked cancelled right away
+        if self.future is not None and self.future.cancel():
+            self.finish(CANCELLED)
+        return True
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            elapsed_end = self.finished_at or time.time()
+            return {
+                "session_id": self.session_id,
+                "status": self.status,
+                "progress": dict(self.progress),
+                "error": self.error,
+                "created_at": self.created_at,
+                "updated_at": self.updated_at,
+                "elapsed_seconds": round(elapsed_end - (self.started_at or self.created_at), 3),
+            }
+
+
+class IngestionManager:
+    def __init__(self, max_workers : int = None, max_pending : int = None, on_status=None):
+        """IngestionManager runs ingestion jobs on a bounded pool of worker threads so that
+        loading, chunking, embedding and indexing never run on the event loop.
+
+        Args:
+            max_workers (int, optional): number of jobs processed at the same time. Defaults to INGEST_WORKERS or 2.
+            max_pending (int, optional): number of unfinished jobs accepted before new uploads are refused. Defaults to INGEST_MAX_PENDING or 16.
+            on_status (callable, optional): on_status(job) after every status change of any job
+        """
+        self.max_workers = max_workers or int(os.getenv("INGEST_WORKERS", 2))
+        self.max_pending = max_pending or int(os.getenv("INGEST_MAX_PENDING", 16))
+        self.on_status = on_status
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def submit(self, session_id : str, folder : str, build, on_ready) -> IngestionJob:
+        """submit method queues the ingestion of a session folder.
+
+        Args:
+            session_id (str): session the documents belong to
+            folder (str): upload folder of the session
+            build (callable): build(job) does the actual work and returns its result
+            on_ready (callable): on_ready(job, result) is called once the job succeeded
+
+        Raises:
+            RuntimeError: if too many jobs are already waiting, or the session already has one in progress
+
+        Returns:
+            IngestionJob: the job record, to be polled for status
+        """
+        if self.pending() >= self.max_pending:
+            raise RuntimeError(f"too many ingestion jobs in progress ({self.max_pending}), try again later")
+        job = IngestionJob(session_id, folder, on_status=self.on_status)
+        with self._lock:
+            ## jobs of one session rewrite the same index, they never run side by side
+            current = self.jobs.get(session_id)
+            if current is not None and not current.finished:
+                raise RuntimeError(f"session {session_id} is already being ingested ({current.status}), try again later")
+            self.jobs[session_id] = job
+        job.notify()
+        job.future = self.executor.submit(self._run, job, build, on_ready)
+        return job
+
+    def get(self, session_id : str):
+        with self._lock:
+            return self.jobs.get(session_id)
+
+    def active(self) -> set:
+        """active method returns the sessions with an unfinished job."""
+        with self._lock:
+            return {session_id for session_id, job in self.jobs.items() if not job.finished}
+
+    def prune(self, max_age : float) -> int:
+        """prune method forgets jobs finished more than max_age seconds ago; their status stays on disk."""
+        limit = time.time() - max_age
+        with self._lock:
+            old = [session_id for session_id, job in self.jobs.items() if job.finished and job.updated_at < limit]
+            for session_id in old:
+                del self.jobs[session_id]
+        return len(old)
+
+    def cancel(self, session_id : str) -> bool:
+        job = self.get(session_id)
+        if job is None:
+            return False
+        return job.cancel()
+
+    def _run(self, job : IngestionJob, build, on_ready):
+        try:
+            print(f"INFO : ingestion started for session {job.session_id}")
+            job.update(LOADING)
+            ## build stops at job.commit() when cancelled, once it has passed it the new index is live
+            result = build(job)
+            on_ready(job, result)
+            job.finish(READY)
+            print(f"INFO : ingestion ready for session {job.session_id}")
+        except IngestionCancelled:
+            job.finish(CANCELLED)
+            print(f"INFO : ingestion cancelled for session {job.session_id}")
+        except Exception as exp:
+            job.finish(FAILED, str(exp))
+            print(f"ERROR : ingestion failed for session {job.session_id} : {exp}")
+
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,149 @@
+## BM25 inverted index of a session's chunks, persisted next to its FAISS index
+import os
+import re
+import math
+import pickle
+import threading
+from collections import Counter, defaultdict
+import numpy as np
+
+LEXICAL_FILE = "lexical.pkl"
+POSTINGS_FILE = "lexical_postings.npy"
+LENGTHS_FILE = "lexical_lengths.npy"
+## bm25 term frequency saturation and length normalization
+BM25_K1 = float(os.getenv("BM25_K1", 1.2))
+BM25_B = float(os.getenv("BM25_B", 0.75))
+
+## words, numbers and identifiers such as 14.2.1, ref/ab-12 or 1,100,000 (read as 1100000)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./\-][a-z0-9]+)*")
+THOUSANDS_PATTERN = re.compile(r"(?<=\d),(?=\d{3}\b)")
+PART_PATTERN = re.compile(r"[./\-]")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+POSTING_DTYPE = np.dtype([("doc", "<i4"), ("tf", "<f4")])
+
+
+def tokenize(text : str) -> list:
+    """tokenize method returns the index terms of a text : lower-cased words and identifiers, and the parts
+    of compound identifiers so that "14.2" also matches "clause 14.2.1"."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(THOUSANDS_PATTERN.sub("", text.lower())):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if PART_PATTERN.search(token):
+            parts = PART_PATTERN.split(token)
+            terms.extend(part for part in parts if part and part not in STOPWORDS)
+            ## prefixes of dotted numbers (14.2.1 -> 14.2) : a question often cites the parent clause
+            terms.extend(".".join(parts[:end]) for end in range(2, len(parts)) if "." in token)
+    return terms
+
+
+class LexicalIndex:
+    def __init__(self, terms : dict, postings : np.ndarray, lengths : np.ndarray, k1 : float = None, b : float = None):
+        """LexicalIndex scores chunks against a query with BM25 over an inverted index.
+
+        Postings of all terms are one (doc, tf) array, sorted by term; `terms` maps a term to
+        its (start, document frequency) in it. Documents are positions in the FAISS index, so
+        a hit is resolved through the vector store's index_to_docstore_id.
+
+        Args:
+            terms (dict): {term: (start, df)}
+            postings (np.ndarray): POSTING_DTYPE array
+            lengths (np.ndarray): number of terms of each document
+            k1 (float, optional): Defaults to BM25_K1.
+            b (float, optional): Defaults to BM25_B.
+        """
+        self.terms = terms
+        self.postings = postings
+        self.lengths = lengths
+        self.k1 = BM25_K1 if k1 is None else k1
+        self.b = BM25_B if b is None else b
+        self.n = len(lengths)
+        self.avgdl = float(lengths.mean()) if self.n else 0.0
+
+    @classmethod
+    def build(cls, texts : list) -> "LexicalIndex":
+        """build method indexes texts, the i-th text being document i."""
+        postings = defaultdict(list)
+        lengths = np.zeros(len(texts), dtype=np.float32)
+        for position, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[position] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((position, tf))
+        terms = {}
+        array = np.empty(sum(len(items) for items in postings.values()), dtype=POSTING_DTYPE)
+        start = 0
+        for term in sorted(postings):
+            items = postings[term]
+            array[start:start + len(items)] = items
+            terms[term] = (start, len(items))
+            start += len(items)
+        return cls(terms, array, lengths)
+
+    def search(self, query : str, k : int, positions : np.ndarray = None) -> list:
+        """search method returns the [(position, score)] of the k best matching documents, best first,
+        among `positions` when given."""
+        if not self.n or k <= 0:
+            return []
+        scores = np.zeros(self.n, dtype=np.float32)
+        for term in set(tokenize(query)):
+            entry = self.terms.get(term)
+            if entry is None:
+                continue
+            start, df = entry
+            block = self.postings[start:start + df]
+            idf = math.log(1 + (self.n - df + 0.5) / (df + 0.5))
+            tf = block["tf"]
+            norm = self.k1 * (1 - self.b + self.b * self.lengths[block["doc"]] / self.avgdl)
+            ## a term occurs once per document in its postings, so fancy-index += is safe
+            scores[block["doc"]] += idf * tf * (self.k1 + 1) / (tf + norm)
+        if positions is not None:
+            allowed = np.zeros(self.n, dtype=bool)
+            allowed[positions] = True
+            scores[~allowed] = 0
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(position), float(scores[position])) for position in matched]
+
+    def write(self, directory : str):
+        """write method saves the index under `directory`, through temporary files renamed into place."""
+        suffix = f".tmp-{os.getpid()}-{threading.get_ident()}"
+        files = []
+        for name, array in ((POSTINGS_FILE, self.postings), (LENGTHS_FILE, self.lengths)):
+            path = os.path.join(directory, name)
+            with open(path + suffix, "wb") as f:
+                np.save(f, array)
+            files.append(path)
+        path = os.path.join(directory, LEXICAL_FILE)
+        with open(path + suffix, "wb") as f:
+            pickle.dump({"terms": self.terms, "k1": self.k1, "b": self.b}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        files.append(path)
+        for path in files:
+            os.replace(path + suffix, path)
+
+
+def load_lexical_index(directory : str, mmap : bool = True):
+    """load_lexical_index method opens the index written by `LexicalIndex.write`, postings memory-mapped.
+
+    Returns:
+        LexicalIndex: the index, or None when the directory has none (indexes saved before it existed)
+    """
+    path = os.path.join(directory, LEXICAL_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        payload = pickle.load(f)
+    arrays = []
+    for name in (POSTINGS_FILE, LENGTHS_FILE):
+        try:
+            arrays.append(np.load(os.path.join(directory, name), mmap_mode="r" if mmap else None))
+        except ValueError:
+            ## an empty array can't be memory-mapped
+            arrays.append(np.load(os.path.join(directory, name)))
+    postings, lengths = arrays
+    return LexicalIndex(payload["terms"], postings, lengths, payload["k1"], payload["b"])
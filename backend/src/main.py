@@ -1,12 +1,27 @@
 from typing import List
 import os
 import uuid
+import hmac
+import time
 import json
+import shutil
+import asyncio
+from dotenv import load_dotenv
+# .env is read before the modules below take their settings from the environment
+load_dotenv()
 from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
-from Retriever import Retriever
-from workflow import workflow
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+# Retriever and workflow (langchain, openai, faiss, pymupdf, langgraph) are imported on first use or by the warm-up
+from ingestion import IngestionManager, READY, FAILED, CANCELLED
+from session_store import SessionStore, write_status, read_fingerprint, read_manifest, read_settings, write_settings, record_upload_hashes
+from session_store import SESSION_IDLE_TTL_S, SESSION_RETENTION_HOURS, SESSION_DISK_QUOTA_MB
+from document_store import SHARED_STORE, STORE_GRACE_S, share_files, collect_garbage as collect_store
+from reranker import get_reranker, is_registered, rerank_stats
+from answer_cache import get_answer_cache
+from metadata_filter import parse_filters
+from uploads import stage_uploads, UploadError, UploadLimitMiddleware
+from telemetry import MetricsMiddleware, span, trace, expose
 
 app = FastAPI()
 
@@ -17,6 +32,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Upload requests over UPLOAD_MAX_REQUEST_MB are refused before their body is read
+app.add_middleware(UploadLimitMiddleware)
+# Latency of every request per handler, exposed on /metrics with the pipeline stage timings
+app.add_middleware(MetricsMiddleware)
 
 # Find and create upload folder
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -24,9 +43,189 @@ PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
 UPLOAD_DIR = os.path.join(PROJECT_ROOT, "data", "upload")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-# Store data for each user session
-session_folder_map = {}
-latest_session_id = None  # ✅ Track latest uploaded session_id
+def load_session(folder):
+    """Opens the saved index of a session folder."""
+    from Retriever import Retriever
+    return Retriever(folder).load()
+
+
+# Sessions are persisted under their upload folder and loaded (memory-mapped) on first use
+session_store = SessionStore(UPLOAD_DIR, load_session)
+# Sessions idle for SESSION_IDLE_TTL_S are unloaded and old ones deleted every SESSION_SWEEP_INTERVAL_S (0 disables)
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", 60))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+NO_SESSION_ANSWER = "❌ No session_id provided. Upload documents first and send the session_id returned by /upload."
+# Once the server is up, a background task imports the heavy modules and loads up to WARMUP_SESSIONS recently used sessions
+WARMUP = os.getenv("WARMUP", "true").lower() == "true"
+WARMUP_SESSIONS = int(os.getenv("WARMUP_SESSIONS", 4))
+# Background workers that build the retriever for each upload, their status is recorded on disk
+ingestion_manager = IngestionManager(on_status=lambda job: write_status(job.folder, job.to_dict()))
+
+
+def build_session(job):
+    """Runs on an ingestion worker: loads, chunks, embeds, indexes and saves the session folder."""
+    from Retriever import Retriever
+    obj = Retriever(job.folder, job=job)
+    obj.retriever()
+
+
+def update_session(job):
+    """Runs on an ingestion worker: re-indexes only the files of the session folder that were added, replaced or deleted."""
+    from Retriever import Retriever
+    obj = Retriever(job.folder, job=job)
+    obj.update()
+
+
+def store_session(job, result):
+    """Called by the ingestion worker once the index is saved; the next /ask loads it from disk.
+    Answers cached for the session's previous document set are dropped."""
+    previous = session_store.unload(job.session_id)
+    answer_cache = get_answer_cache()
+    if previous and answer_cache and previous["fingerprint"] != read_fingerprint(job.folder):
+        answer_cache.invalidate(previous["fingerprint"])
+
+
+def session_status(session_id):
+    """Ingestion status of a session, from this worker's jobs or from the status recorded on disk."""
+    job = ingestion_manager.get(session_id)
+    if job is not None:
+        return job.to_dict()
+    return session_store.status(session_id)
+
+
+def answerable(session_id, status):
+    """A session answers from its saved index; while its documents are being updated the previous index keeps serving."""
+    return status is None or status["status"] == READY or session_store.indexed(session_id)
+
+
+def sweep_sessions():
+    """Unloads idle sessions, forgets old finished jobs and deletes the folders of sessions past their retention
+    or over the disk quota. Answers cached for deleted sessions and their conversations are dropped."""
+    session_store.evict_idle()
+    ingestion_manager.prune(SESSION_IDLE_TTL_S)
+    deleted = session_store.collect_garbage(busy=ingestion_manager.active())
+    answer_cache = get_answer_cache()
+    for _, fingerprint, _ in deleted:
+        if answer_cache and fingerprint:
+            answer_cache.invalidate(fingerprint)
+    if deleted:
+        from conversation import forget_sessions
+        forget_sessions([session_id for session_id, _, _ in deleted])
+    return deleted
+
+
+# Time the shared document store was last swept
+store_swept = 0.0
+
+
+def sweep_store(force=False):
+    """Deletes the documents and files of the shared store that no session holds anymore, at most every STORE_GRACE_S
+    unless forced (e.g. once sessions were deleted). Returns the bytes freed."""
+    global store_swept
+    if not SHARED_STORE or (not force and time.time() - store_swept < STORE_GRACE_S):
+        return 0
+    store_swept = time.time()
+    return collect_store(session_store.shared_documents())
+
+
+async def session_sweeper():
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_S)
+        try:
+            deleted = await asyncio.to_thread(sweep_sessions)
+            await asyncio.to_thread(sweep_store, bool(deleted))
+        except Exception as exp:
+            print(f"ERROR : session sweep failed : {exp}")
+
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    if SESSION_SWEEP_INTERVAL_S > 0:
+        app.state.session_sweeper = asyncio.create_task(session_sweeper())
+
+
+def preload():
+    """Imports the modules of ingestion and answering, then loads the indexes and builds the workflows of the sessions used
+    within SESSION_IDLE_TTL_S (most recent first, up to WARMUP_SESSIONS), so the first requests after a start don't pay for them."""
+    start = time.perf_counter()
+    import Retriever
+    import workflow
+    import document_loader
+    imported = time.perf_counter()
+    recent = [session_id for session_id in session_store.session_ids()
+              if time.time() - session_store.last_access(session_id) <= SESSION_IDLE_TTL_S and session_store.indexed(session_id)]
+    recent.sort(key=session_store.last_access, reverse=True)
+    loaded = 0
+    for session_id in recent[:WARMUP_SESSIONS]:
+        try:
+            session_data = session_store.get(session_id, touch=False)
+            if session_data:
+                session_workflow(session_id, session_data)
+                loaded += 1
+        except Exception as exp:
+            print(f"ERROR : warm-up of session {session_id} failed : {exp}")
+    print(f"INFO : warm-up : modules imported in {imported - start:.2f}s, {loaded} sessions loaded in {time.perf_counter() - imported:.2f}s")
+
+
+async def warm_up():
+    try:
+        await asyncio.to_thread(preload)
+    except Exception as exp:
+        print(f"ERROR : warm-up failed : {exp}")
+    app.state.warm = True
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    # Runs in the background : the port opens right away, the first requests may wait for imports still in progress
+    app.state.warm = not WARMUP
+    if WARMUP:
+        app.state.warm_up = asyncio.create_task(warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown_ingestion():
+    sweeper = getattr(app.state, "session_sweeper", None)
+    if sweeper:
+        sweeper.cancel()
+    ingestion_manager.shutdown()
+
+
+def admin_allowed(request):
+    """Admin endpoints need ADMIN_TOKEN in the X-Admin-Token header, and are disabled when ADMIN_TOKEN is not set."""
+    token = request.headers.get("x-admin-token", "")
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def session_workflow(session_id, session_data):
+    """Compiled graph + RAG chain of a session, built on first use and reused for every question.
+    It keys the answer cache with the session's fingerprint; SessionStore.get drops it once the index or settings change on disk."""
+    if "workflow" not in session_data:
+        from workflow import workflow
+        session_data["workflow"] = workflow(
+            session_data["llm"],
+            session_data["retriever"],
+            session_data["folder"],
+            fingerprint=session_data.get("fingerprint"),
+            settings=read_settings(session_data["folder"])
+        )
+        print(f"INFO : built workflow for session {session_id}")
+    return session_data["workflow"]
+
+
+def not_ready_answer(status):
+    """Answer given while a session's documents are not (or could not be) indexed."""
+    if status["status"] == FAILED:
+        return f"❌ Document processing failed: {status['error']}"
+    if status["status"] == CANCELLED:
+        return "❌ Document processing was cancelled for this session."
+    return f"⏳ Documents are still being processed (status: {status['status']}). Please try again shortly."
+
+
+def sse(payload, event=None):
+    """Formats one Server-Sent Events frame."""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {payload if isinstance(payload, str) else json.dumps(payload)}\n\n"
+
 
 #-------- API 1: Upload Documents --------
 @app.post("/upload")
@@ -34,82 +233,321 @@ async def upload_docs(files: List[UploadFile] = File(...)):
     """
     Step 1: User uploads files
     Step 2: We create a unique folder for this user (using session_id)
-    Step 3: We store retriever + llm for this session
-    Step 4: Return session_id to user for future requests
+    Step 3: Files are streamed into it block by block (sanitized names, size limits, sha256 on the way);
+            files with the same content as an earlier file of the request are dropped
+    Step 4: We queue a background job that builds retriever + llm for this session
+    Step 5: Return session_id to user right away, status is polled via /upload/{session_id}/status
     """
-    global latest_session_id
-    
     # Create unique session_id
     session_id = str(uuid.uuid4())
     # Create unique folder for this session
     folder = os.path.join(UPLOAD_DIR, session_id)
     os.makedirs(folder, exist_ok=True)
-    # Save uploaded files in this session's folder
-    for file in files:
-        if file.filename:
-            file_path = os.path.join(folder, file.filename)
-            with open(file_path, "wb") as f:
-                f.write(await file.read())
-    # Create Retriever object for this session
-    obj = Retriever(folder)
-    retriever, llm = obj.retriever()
-    # Store session data in memory
-    session_folder_map[session_id] = {
-        "folder": folder,
-        "retriever": retriever,
-        "llm": llm
+    # Stream uploaded files into this session's folder
+    try:
+        with trace(session_id), span("upload") as current:
+            staged = await stage_uploads(files, folder)
+            current.set(files=len(staged), bytes=sum(item.size for item in staged))
+    except UploadError as exp:
+        shutil.rmtree(folder, ignore_errors=True)
+        return {"error": str(exp)}
+    if not staged:
+        shutil.rmtree(folder, ignore_errors=True)
+        return {"error": "No files uploaded"}
+    saved, duplicates, hashes = [], [], {}
+    for item in staged:
+        if item.sha256 in hashes.values():
+            item.discard()
+            duplicates.append(item.name)
+            continue
+        item.commit()
+        saved.append(item.name)
+        hashes[item.name] = item.sha256
+    # Files already uploaded to any session share their disk space with it
+    share_files(folder, hashes)
+    record_upload_hashes(folder, hashes)
+    # Build the retriever for this session in the background
+    try:
+        job = ingestion_manager.submit(session_id, folder, build_session, store_session)
+    except RuntimeError as exp:
+        return {"error": str(exp)}
+
+    return {
+        "message": "Files uploaded successfully, processing started",
+        "session_id": session_id,
+        "files": saved,
+        "duplicates": duplicates,
+        "status": job.status
     }
 
-    # Update latest session
-    latest_session_id = session_id
 
+@app.get("/upload/{session_id}/status")
+async def upload_status(session_id: str):
+    """Returns the ingestion status and progress counts of a session."""
+    status = session_status(session_id)
+    if status is None:
+        return {"error": "Unknown session_id", "session_id": session_id}
+    return status
+
+
+@app.post("/upload/{session_id}/cancel")
+async def cancel_upload(session_id: str):
+    """Stops the ingestion of a session that is still queued or running."""
+    job = ingestion_manager.get(session_id)
+    if job is None:
+        return {"error": "Unknown session_id", "session_id": session_id}
+    cancelled = job.cancel()
+    return {"session_id": session_id, "cancelled": cancelled, "status": job.status}
+
+
+def session_folder(session_id):
+    """Upload folder of an existing session, or None."""
+    folder = session_store.folder(session_id)
+    return folder if folder is not None and os.path.isdir(folder) else None
+
+
+def update_busy(session_id):
+    """Error returned while a session's documents are still being ingested, None otherwise."""
+    job = ingestion_manager.get(session_id)
+    if job is not None and not job.finished:
+        return {"error": f"Documents of this session are still being processed (status: {job.status}), try again later",
+                "session_id": session_id, "status": job.status}
+    return None
+
+
+@app.post("/upload/{session_id}/documents")
+async def add_documents(session_id: str, files: List[UploadFile] = File(...)):
+    """
+    Adds files to an existing session, or replaces the files of the same name.
+    Files are streamed in like /upload. Files whose content is already indexed under their name are
+    unchanged, under another name (or earlier in the request) duplicates; both are skipped. Only the
+    new and changed ones are loaded and embedded, by a background job polled via /upload/{session_id}/status.
+    """
+    folder = session_folder(session_id)
+    if folder is None:
+        return {"error": "Unknown session_id", "session_id": session_id}
+    busy = update_busy(session_id)
+    if busy:
+        return busy
+    try:
+        with trace(session_id), span("upload") as current:
+            staged = await stage_uploads(files, folder)
+            current.set(files=len(staged), bytes=sum(item.size for item in staged))
+    except UploadError as exp:
+        return {"error": str(exp), "session_id": session_id}
+    indexed = read_manifest(folder) or {}
+    ## content -> name of the files the session will hold
+    contents = {digest: name for name, digest in indexed.items()}
+    added, replaced, unchanged, duplicates, hashes = [], [], [], [], {}
+    for item in staged:
+        if indexed.get(item.name) == item.sha256:
+            item.discard()
+            unchanged.append(item.name)
+            continue
+        if contents.get(item.sha256, item.name) != item.name:
+            item.discard()
+            duplicates.append(item.name)
+            continue
+        (replaced if os.path.exists(item.path) else added).append(item.name)
+        item.commit()
+        contents[item.sha256] = item.name
+        hashes[item.name] = item.sha256
+    # Files already uploaded to any session share their disk space with it
+    share_files(folder, hashes)
+    record_upload_hashes(folder, hashes)
+    if not added and not replaced:
+        return {"message": "No new or changed files", "session_id": session_id, "unchanged": unchanged,
+                "duplicates": duplicates}
+    try:
+        job = ingestion_manager.submit(session_id, folder, update_session, store_session)
+    except RuntimeError as exp:
+        return {"error": str(exp), "session_id": session_id}
     return {
-        "message": "Files uploaded successfully",   
-        "session_id": session_id
+        "message": "Files uploaded successfully, updating the index",
+        "session_id": session_id,
+        "added": added,
+        "replaced": replaced,
+        "unchanged": unchanged,
+        "duplicates": duplicates,
+        "status": job.status
     }
 
 
+@app.delete("/upload/{session_id}/documents/{filename}")
+async def delete_document(session_id: str, filename: str):
+    """Deletes a file of a session; its chunks are removed from the index by a background job."""
+    folder = session_folder(session_id)
+    if folder is None:
+        return {"error": "Unknown session_id", "session_id": session_id}
+    path = os.path.join(folder, filename)
+    if filename != os.path.basename(filename) or filename.startswith(".") or not os.path.isfile(path):
+        return {"error": "Unknown file", "session_id": session_id, "filename": filename}
+    busy = update_busy(session_id)
+    if busy:
+        return busy
+    os.remove(path)
+    try:
+        job = ingestion_manager.submit(session_id, folder, update_session, store_session)
+    except RuntimeError as exp:
+        return {"error": str(exp), "session_id": session_id}
+    return {"message": "File deleted, updating the index", "session_id": session_id, "deleted": filename, "status": job.status}
+
+
+SESSION_SETTINGS = {"rerank": str, "rerank_candidates": int, "rerank_top_n": int}
+
+
+@app.get("/upload/{session_id}/settings")
+async def get_settings(session_id: str):
+    """Returns the options of a session."""
+    folder = session_folder(session_id)
+    if folder is None:
+        return {"error": "Unknown session_id", "session_id": session_id}
+    return {"session_id": session_id, "settings": read_settings(folder)}
+
+
+@app.put("/upload/{session_id}/settings")
+async def update_settings(session_id: str, request: Request):
+    """
+    Sets options of a session, e.g. {"rerank": "lexical", "rerank_top_n": 8}; null removes an option.
+    rerank is none or a registered reranker (lexical, cross-encoder), anything else is refused with a 400.
+    The session's workflow is rebuilt on its next question.
+    """
+    folder = session_folder(session_id)
+    if folder is None:
+        return {"error": "Unknown session_id", "session_id": session_id}
+    data = await request.json()
+    settings = read_settings(folder)
+    for key, value in data.items():
+        if key not in SESSION_SETTINGS:
+            return {"error": f"Unknown setting {key}", "session_id": session_id}
+        if value is None:
+            settings.pop(key, None)
+            continue
+        try:
+            settings[key] = SESSION_SETTINGS[key](value)
+        except (TypeError, ValueError):
+            return {"error": f"Invalid value for {key}", "session_id": session_id}
+    if settings.get("rerank"):
+        if not is_registered(settings["rerank"]):
+            return JSONResponse({"error": f"Unknown reranker {settings['rerank']}", "session_id": session_id}, status_code=400)
+        try:
+            await asyncio.to_thread(get_reranker, settings["rerank"])
+        except Exception as exp:
+            return {"error": f"Invalid reranker : {exp}", "session_id": session_id}
+    ## every worker rebuilds the session's workflow once it sees the new settings file (SessionStore.get)
+    write_settings(folder, settings)
+    return {"session_id": session_id, "settings": settings}
+
+
 # -------- API 2: Ask Question --------
 @app.post("/ask")
 async def ask_question(request: Request):
     """
-    Step 1: User sends question + session_id (optional)
-    Step 2: We fetch retriever + llm for that session
-    Step 3: Process query and return answer
+    Step 1: User sends question + session_id + conversation_id (optional) + cache (optional, false bypasses the answer cache)
+            + filters (optional, e.g. {"source": "letters.pdf", "date_from": "2024-01-01", "letter_ref": "NTPC"}) to search only matching chunks
+    Step 2: We fetch the compiled workflow (retriever + llm) of that session
+    Step 3: Process query asynchronously and return answer
     """
-    global latest_session_id
-
     data = await request.json()
     print("data --->>>", data)
 
     question = data.get("question")
     session_id = data.get("session_id")
+    try:
+        filters = parse_filters(data.get("filters"))
+    except ValueError as exp:
+        return {"error": f"Invalid filters : {exp}", "session_id": session_id}
 
-    # Fallback to latest session if not provided
+    # Every question names its session, there is no fallback to another client's documents
     if not session_id:
-        session_id = latest_session_id
+        return {"answer": NO_SESSION_ANSWER}
+
+    # Documents may still be processing in the background
+    status = session_status(session_id)
+    if not answerable(session_id, status):
+        return {"answer": not_ready_answer(status), "session_id": session_id, "status": status["status"]}
 
-    # Validate session
-    session_data = session_folder_map.get(session_id)
+    # Validate session, loading its index from disk on first use
+    session_data = await asyncio.to_thread(session_store.get, session_id)
     print("Session Data : >>",session_data)
     if not session_data:
         return {"answer": "❌ Invalid session or no documents uploaded."}
 
-    # Process question using stored retriever + llm
-    obj = workflow(
-        session_data["llm"],
-        question,
-        session_data["retriever"],
-        session_data["folder"]
-    )
-    answer = obj.Builder()
+    # Process question using the session's compiled workflow, one checkpoint thread per conversation
+    conversation_id = data.get("conversation_id") or data.get("chat_id") or "default"
+    obj = session_workflow(session_id, session_data)
+    with trace(f"{session_id}:{uuid.uuid4().hex[:8]}"):
+        answer = await obj.arun(question, thread_id=f"{session_id}:{conversation_id}", use_cache=data.get("cache", True) is not False,
+                                filters=filters)
+
+    return {"answer": answer, "session_id": session_id}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit rate and size of the answer cache and of the rerank score cache of this worker."""
+    answer_cache = get_answer_cache()
+    return {"answer_cache": answer_cache.stats() if answer_cache else None, "rerank_scores": rerank_stats()}
+
+
+@app.get("/health")
+async def health():
+    """Liveness and readiness : `warm` turns true once the warm-up has imported the models' modules and loaded recent sessions."""
+    return {"status": "ok", "warm": app.state.warm, "sessions_loaded": len(session_store.sessions)}
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics of this worker : request latency per handler, duration and sizes of every pipeline stage."""
+    return PlainTextResponse(expose(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/sessions")
+async def list_sessions(request: Request):
+    """Sessions on disk, least recently used first, with their memory, disk and files; plus the totals and limits."""
+    if not admin_allowed(request):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    # Files shared between sessions are counted with the first session listed
+    seen = set()
+    sessions = await asyncio.to_thread(lambda: [session_store.describe(session_id, seen) for session_id in session_store.session_ids()])
+    sessions.sort(key=lambda item: item["last_access"])
+    return {
+        "sessions": sessions,
+        "total": {
+            "sessions": len(sessions),
+            "loaded": sum(item["loaded"] for item in sessions),
+            # documents shared by loaded sessions are counted once
+            "memory_bytes": session_store.loaded_bytes(),
+            "disk_bytes": sum(item["disk_bytes"] for item in sessions),
+        },
+        "limits": {
+            "memory_budget_bytes": session_store.memory_budget,
+            "idle_ttl_s": SESSION_IDLE_TTL_S,
+            "retention_hours": SESSION_RETENTION_HOURS,
+            "disk_quota_mb": SESSION_DISK_QUOTA_MB,
+        },
+    }
+
 
-    return {"answer": answer, "session_id": session_id}# -------- API 3: Chat with Streaming --------
+@app.post("/admin/sessions/gc")
+async def collect_sessions(request: Request):
+    """Runs the session sweep now and returns the deleted sessions, then the shared store sweep and the bytes it freed."""
+    if not admin_allowed(request):
+        return JSONResponse({"error": "Forbidden"}, status_code=403)
+    deleted = await asyncio.to_thread(sweep_sessions)
+    freed = await asyncio.to_thread(sweep_store, True)
+    return {"deleted": [{"session_id": session_id, "disk_bytes": size} for session_id, _, size in deleted],
+            "store_bytes_freed": freed}
+
+
+# -------- API 3: Chat with Streaming --------
 @app.post("/chat")
 async def chat(request: Request):
     """
     Chat endpoint that supports streaming responses
     Handles both text messages and file attachments
+    Answers come from the RAG chain of the session (session_id), streamed as Server-Sent Events
+    token by token, followed by an `event: metrics` frame (retrieval, time to first token, generation)
     """
     try:
         data = await request.json()
@@ -128,6 +566,10 @@ async def chat(request: Request):
             return {"error": "Last message must be from user"}
         
         user_content = last_message.get("content", "")
+        try:
+            filters = parse_filters(data.get("filters"))
+        except ValueError as exp:
+            return {"error": f"Invalid filters : {exp}"}
         
         # Process files if any
         if files:
@@ -138,45 +580,66 @@ async def chat(request: Request):
                 file_info += f"- {file.get('name', 'Unknown')} ({file.get('type', 'Unknown type')})\n"
             user_content += file_info
         
-        # For streaming, we'll simulate streaming by sending chunks
+        # Answer from the documents of the session, like /ask
+        session_id = data.get("session_id") or data.get("sessionId")
+        status = session_status(session_id)
+        if not session_id:
+            response_text = NO_SESSION_ANSWER
+            session_data = None
+        elif not answerable(session_id, status):
+            response_text = not_ready_answer(status)
+            session_data = None
+        else:
+            session_data = await asyncio.to_thread(session_store.get, session_id)
+            response_text = "❌ Invalid session or no documents uploaded."
+        flow = session_workflow(session_id, session_data) if session_data else None
+        # One conversation thread per chat, follow-up questions are rewritten from its history
+        thread_id = f"{session_id}:{chat_id or 'default'}"
+        use_cache = data.get("cache", True) is not False
+        metrics = {}
+        # The spans of this answer are logged under one trace id
+        trace_id = f"{session_id}:{uuid.uuid4().hex[:8]}"
+
         if stream:
             async def generate_stream():
-                # Simulate processing delay
-                import asyncio
-                await asyncio.sleep(0.1)
-                
-                # Generate response using the workflow
-                # For now, we'll use a simple response, but you can integrate with your RAG system
-                response_text = f"I understand you're asking: {user_content}\n\nThis is a response from your FastAPI backend. You can integrate this with your RAG system to provide more intelligent responses."
-                
-                # Split response into chunks for streaming effect
-                words = response_text.split()
-                chunk_size = 3  # Words per chunk
-                
-                for i in range(0, len(words), chunk_size):
-                    chunk = " ".join(words[i:i + chunk_size])
-                    if i + chunk_size < len(words):
-                        chunk += " "  # Add space between chunks
-                    
-                    # Format as Server-Sent Events
-                    yield f"data: {json.dumps({'choices': [{'delta': {'content': chunk}}]})}\n\n"
-                    await asyncio.sleep(0.05)  # Small delay between chunks
-                
-                # Send completion signal
-                yield "data: [DONE]\n\n"
-            
+                if flow is None:
+                    yield sse({'choices': [{'delta': {'content': response_text}}]})
+                    yield sse("[DONE]")
+                    return
+                tokens = flow.astream(user_content, thread_id, metrics, use_cache=use_cache, filters=filters)
+                try:
+                    with trace(trace_id):
+                        async for token in tokens:
+                            # Stop generating (and cancel the upstream llm call) once the client is gone
+                            if await request.is_disconnected():
+                                print(f"INFO : chat {chat_id} : client disconnected, generation cancelled")
+                                return
+                            yield sse({'choices': [{'delta': {'content': token}}]})
+                    print(f"INFO : chat {chat_id} : {metrics}")
+                    yield sse(metrics, event="metrics")
+                    yield sse("[DONE]")
+                except Exception as exp:
+                    print(f"ERROR : chat {chat_id} : streaming failed : {exp}")
+                    yield sse({"error": str(exp)}, event="error")
+                finally:
+                    await tokens.aclose()
+
             return StreamingResponse(
                 generate_stream(),
-                media_type="text/plain",
+                media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
                     "Connection": "keep-alive",
+                    "X-Accel-Buffering": "no",
                 }
             )
         else:
             # Non-streaming response
-            response_text = f"I understand you're asking: {user_content}\n\nThis is a response from your FastAPI backend. You can integrate this with your RAG system to provide more intelligent responses."
-            
+            if flow is not None:
+                with trace(trace_id):
+                    response_text = "".join([token async for token in flow.astream(user_content, thread_id, metrics, use_cache=use_cache,
+                                                                                   filters=filters)])
+
             return {
                 "choices": [{
                     "message": {
@@ -185,6 +648,8 @@ async def chat(request: Request):
                     }
                 }],
                 "model": model,
+                "session_id": session_id,
+                "metrics": metrics,
                 "usage": {
                     "prompt_tokens": len(user_content.split()),
                     "completion_tokens": len(response_text.split()),
@@ -0,0 +1,91 @@
+## metadata filters of a question, applied to the chunks before the vector search
+import os
+import re
+import numpy as np
+
+## filter keys : equality on source / page, prefix on clause, substring on the text fields, range on doc_date
+TEXT_FIELDS = ("section", "letter_ref", "letter_subject")
+FILTER_KEYS = ("source", "page", "clause", "date_from", "date_to") + TEXT_FIELDS
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def parse_filters(data) -> dict:
+    """parse_filters method validates the `filters` of a request.
+
+    Args:
+        data (dict): e.g. {"source": "letters.pdf", "date_from": "2024-01-01", "letter_ref": "NTPC/CHP"}.
+            source and page take a value or a list of values.
+
+    Returns:
+        dict: normalized filters, None when there are none
+
+    Raises:
+        ValueError: unknown key or invalid value
+    """
+    if not data:
+        return None
+    if not isinstance(data, dict):
+        raise ValueError("filters must be an object")
+    filters = {}
+    for key, value in data.items():
+        if key not in FILTER_KEYS:
+            raise ValueError(f"unknown filter {key}, expected one of {', '.join(FILTER_KEYS)}")
+        if value is None or value == "" or value == []:
+            continue
+        if key == "source":
+            values = value if isinstance(value, list) else [value]
+            filters[key] = [os.path.basename(str(item)) for item in values]
+        elif key == "page":
+            values = value if isinstance(value, list) else [value]
+            try:
+                filters[key] = [int(item) for item in values]
+            except (TypeError, ValueError):
+                raise ValueError("page must be an integer or a list of integers")
+        elif key in ("date_from", "date_to"):
+            if not DATE_PATTERN.match(str(value)):
+                raise ValueError(f"{key} must be a YYYY-MM-DD date")
+            filters[key] = str(value)
+        else:
+            filters[key] = str(value).strip().lower()
+    return filters or None
+
+
+class MetadataTable:
+    def __init__(self, vector_store):
+        """MetadataTable holds the filterable metadata of a session's chunks as columns, one row per
+        FAISS position, so a filter is a few vectorized comparisons instead of a pass over the docstore.
+
+        Args:
+            vector_store (FAISS): langchain FAISS store of the session
+        """
+        n = vector_store.index.ntotal
+        ids = vector_store.index_to_docstore_id
+        metadata = [vector_store.docstore.search(ids[position]).metadata for position in range(n)]
+        self.n = n
+        self.source = np.array([os.path.basename(str(item.get("source", ""))) for item in metadata], dtype=str)
+        self.page = np.array([item.get("page", -1) if isinstance(item.get("page"), int) else -1 for item in metadata],
+                             dtype=np.int64)
+        self.clause = np.array([str(item.get("clause") or "") for item in metadata], dtype=str)
+        ## chunks without a date sort before any date, so a date range leaves them out
+        self.doc_date = np.array([item.get("doc_date") or "" for item in metadata], dtype="U10")
+        self.text = {field: np.array([str(item.get(field) or "").lower() for item in metadata], dtype=str)
+                     for field in TEXT_FIELDS}
+
+    def positions(self, filters : dict) -> np.ndarray:
+        """positions method returns the FAISS positions (int64) of the chunks matching every filter."""
+        mask = np.ones(self.n, dtype=bool)
+        for key, value in filters.items():
+            if key == "source":
+                mask &= np.isin(self.source, value)
+            elif key == "page":
+                mask &= np.isin(self.page, value)
+            elif key == "clause":
+                mask &= (self.clause == value) | np.char.startswith(self.clause, value + ".")
+            elif key == "date_from":
+                mask &= self.doc_date >= value
+            elif key == "date_to":
+                mask &= (self.doc_date <= value) & (self.doc_date != "")
+            else:
+                mask &= np.char.find(self.text[key], value) >= 0
+        return np.flatnonzero(mask).astype(np.int64)
+
@@ -0,0 +1,350 @@
+## pluggable ocr engines and page level ocr of scanned pdf pages
+import os
+import json
+import time
+import random
+import shutil
+import hashlib
+import tempfile
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import pymupdf
+from pypdf import PdfReader, PdfWriter
+from telemetry import record as telemetry_record
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, '..'))
+
+## mistral (default) | a registered name | module:Class of an OCRBackend
+OCR_BACKEND = os.getenv("OCR_BACKEND", "mistral")
+MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
+MISTRAL_OCR_MODEL = os.getenv("MISTRAL_OCR_MODEL", "mistral-ocr-latest")
+## a page is sent to ocr when it has less text than this ...
+OCR_MIN_CHARS = int(os.getenv("OCR_MIN_CHARS", 50))
+## ... and images cover at least this fraction of it
+OCR_MIN_IMAGE_COVERAGE = float(os.getenv("OCR_MIN_IMAGE_COVERAGE", 0.3))
+## limits of one ocr request
+OCR_MAX_PAGES = int(os.getenv("OCR_MAX_PAGES", 500))
+OCR_MAX_MB = float(os.getenv("OCR_MAX_MB", 48))
+## ocr requests of one document in flight, and retries of a failed request
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", 4))
+OCR_MAX_RETRIES = int(os.getenv("OCR_MAX_RETRIES", 3))
+## finished page ranges are saved here until the whole document is done, so a restart resumes
+OCR_CHECKPOINT_DIR = os.getenv("OCR_CHECKPOINT_DIR", os.path.join(PROJECT_ROOT, "data", "cache", "ocr"))
+## parent folder of per-job scratch folders (None = system temp folder)
+SCRATCH_DIR = os.getenv("SCRATCH_DIR") or None
+
+
+class OCRBackend:
+    """OCRBackend is the interface of an ocr engine. `ocr(pdf_path)` returns the text of every page of a pdf, in page order."""
+
+    name = "base"
+
+    def ocr(self, pdf_path : str) -> list:
+        raise NotImplementedError
+
+
+class MistralOCR(OCRBackend):
+    name = "mistral"
+
+    def __init__(self, api_key : str = None, model : str = None):
+        """MistralOCR sends a pdf to mistral ocr and returns the markdown of its pages.
+
+        Args:
+            api_key (str, optional): Defaults to MISTRAL_API_KEY.
+            model (str, optional): Defaults to MISTRAL_OCR_MODEL.
+        """
+        from mistralai import Mistral
+        self.client = Mistral(api_key=api_key or MISTRAL_API_KEY)
+        self.model = model or MISTRAL_OCR_MODEL
+
+    def ocr(self, pdf_path : str) -> list:
+        with open(pdf_path, "rb") as f:
+            uploaded_pdf = self.client.files.upload(
+                file={"file_name": os.path.basename(pdf_path), "content": f},
+                purpose="ocr",
+            )
+        signed_url = self.client.files.get_signed_url(file_id=uploaded_pdf.id)
+        ocr_response = self.client.ocr.process(
+            model=self.model,
+            document={"type": "document_url", "document_url": signed_url.url},
+            include_image_base64=False,
+        )
+        return [page.markdown for page in ocr_response.pages]
+
+
+_backends = {"mistral": MistralOCR}
+_instances = {}
+_lock = threading.Lock()
+
+
+def register_ocr_backend(name : str, factory):
+    """register_ocr_backend method makes an engine available as OCR_BACKEND=name; factory() returns an OCRBackend."""
+    with _lock:
+        _backends[name] = factory
+        _instances.pop(name, None)
+
+
+def get_ocr_backend(name : str = None) -> OCRBackend:
+    """get_ocr_backend method returns the process-wide instance of an ocr engine.
+
+    Args:
+        name (str, optional): registered name or module:Class. Defaults to OCR_BACKEND.
+    """
+    name = name or OCR_BACKEND
+    with _lock:
+        if name not in _instances:
+            if name in _backends:
+                factory = _backends[name]
+            elif ":" in name:
+                module, attribute = name.split(":", 1)
+                factory = getattr(importlib.import_module(module), attribute)
+            else:
+                raise ValueError(f"unknown OCR_BACKEND {name}")
+            _instances[name] = factory()
+        return _instances[name]
+
+
+def classify_page(page) -> tuple:
+    """classify_page method extracts the text layer of a page and decides whether it needs ocr.
+
+    A page needs ocr when it carries (almost) no text while images cover a good part of it,
+    i.e. it is a scan. Blank pages and text pages are left alone.
+
+    Args:
+        page (pymupdf.Page): page of an open pdf
+
+    Returns:
+        tuple: (text, needs_ocr, image_coverage)
+    """
+    text = page.get_text().strip()
+    area = abs(page.rect) or 1.0
+    covered = 0.0
+    for image in page.get_image_info():
+        covered += abs(pymupdf.Rect(image["bbox"]) & page.rect)
+    coverage = min(1.0, covered / area)
+    return text, len(text) < OCR_MIN_CHARS and coverage >= OCR_MIN_IMAGE_COVERAGE, round(coverage, 3)
+
+
+def page_ranges(pages : list, page_bytes : float, max_pages : int = None) -> list:
+    """page_ranges method groups page numbers into ocr requests within OCR_MAX_PAGES pages and about OCR_MAX_MB.
+
+    Args:
+        pages (list): page numbers (0 based) to ocr
+        page_bytes (float): estimated bytes of one page
+        max_pages (int, optional): pages per request. Defaults to OCR_MAX_PAGES.
+
+    Returns:
+        list: lists of page numbers, in page order
+    """
+    max_pages = max(1, min(max_pages or OCR_MAX_PAGES, int(OCR_MAX_MB * 1024 * 1024 // max(page_bytes, 1))))
+    pages = sorted(pages)
+    return [pages[start:start + max_pages] for start in range(0, len(pages), max_pages)]
+
+
+def runs(pages : list) -> list:
+    """runs method turns sorted page numbers into (first, last) runs of consecutive pages."""
+    result = []
+    for number in pages:
+        if result and number == result[-1][1] + 1:
+            result[-1][1] = number
+        else:
+            result.append([number, number])
+    return result
+
+
+def file_digest(path : str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OCRCheckpoint:
+    def __init__(self, pdf_path : str, backend_name : str, root : str = None):
+        """OCRCheckpoint keeps the output of finished page ranges of one document on disk.
+
+        The folder is named after the content hash of the pdf and the ocr backend, so the same
+        upload processed again (after a crash, a restart or a cancel) finds its finished ranges.
+
+        Args:
+            pdf_path (str): path of the pdf
+            backend_name (str): name of the ocr backend
+            root (str, optional): Defaults to OCR_CHECKPOINT_DIR.
+        """
+        self.folder = os.path.join(root or OCR_CHECKPOINT_DIR, f"{file_digest(pdf_path)}-{backend_name}")
+
+    def path(self, group : list) -> str:
+        return os.path.join(self.folder, f"{group[0]}-{group[-1]}-{len(group)}.json")
+
+    def load(self, group : list):
+        """load method returns the texts of a finished range, or None."""
+        try:
+            with open(self.path(group)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record["texts"] if record.get("pages") == group else None
+
+    def save(self, group : list, texts : list, seconds : float):
+        os.makedirs(self.folder, exist_ok=True)
+        path = self.path(group)
+        temp_path = path + f".tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(temp_path, "w") as f:
+            json.dump({"pages": group, "texts": texts, "seconds": seconds}, f)
+        os.replace(temp_path, path)
+
+    def clear(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+def page_count(pdf_path : str) -> int:
+    """page_count method returns the number of pages of a pdf, read with pypdf when PyMuPDF can't open it."""
+    try:
+        with pymupdf.open(pdf_path) as source:
+            return len(source)
+    except Exception as exp:
+        print(f"INFO : PyMuPDF can't read {os.path.basename(pdf_path)} ({exp}), using pypdf")
+        return len(PdfReader(pdf_path).pages)
+
+
+def write_pages(pdf_path : str, pages : list, part_path : str):
+    """write_pages method copies some pages of a pdf into a new pdf, with pypdf when PyMuPDF can't open it
+    (those are the pdfs sent whole to ocr)."""
+    try:
+        with pymupdf.open(pdf_path) as source, pymupdf.open() as part:
+            for first, last in runs(pages):
+                part.insert_pdf(source, from_page=first, to_page=last)
+            part.save(part_path, garbage=3, deflate=True)
+        return
+    except Exception as exp:
+        print(f"INFO : PyMuPDF can't copy pages of {os.path.basename(pdf_path)} ({exp}), using pypdf")
+    reader = PdfReader(pdf_path)
+    writer = PdfWriter()
+    for number in pages:
+        writer.add_page(reader.pages[number])
+    with open(part_path, "wb") as f:
+        writer.write(f)
+
+
+class OCRRangeError(Exception):
+    def __init__(self, message : str, seconds : float, attempts : int):
+        """OCRRangeError is raised by ocr_range when a range still fails after its retries, with the time spent on it."""
+        super().__init__(message)
+        self.seconds = seconds
+        self.attempts = attempts
+
+
+def ocr_range(pdf_path : str, group : list, backend : OCRBackend, scratch : str, max_retries : int) -> tuple:
+    """ocr_range method copies a range of pages into its own pdf and runs ocr on it, with retries.
+
+    The range is timed from its first attempt, so the time it waited for a worker is not counted.
+
+    Returns:
+        tuple: (texts in page order, attempts, seconds)
+
+    Raises:
+        OCRRangeError: the last attempt failed
+    """
+    part_path = os.path.join(scratch, f"pages_{group[0] + 1}-{group[-1] + 1}.pdf")
+    write_pages(pdf_path, group, part_path)
+    started = time.perf_counter()
+    try:
+        for attempt in range(max_retries + 1):
+            try:
+                texts = backend.ocr(part_path)
+                if len(texts) != len(group):
+                    raise ValueError(f"ocr returned {len(texts)} pages for {len(group)}")
+                return texts, attempt + 1, round(time.perf_counter() - started, 3)
+            except Exception as exp:
+                if attempt >= max_retries:
+                    raise OCRRangeError(str(exp), round(time.perf_counter() - started, 3), attempt + 1) from exp
+                delay = min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+                print(f"INFO : OCR of pages {group[0] + 1}-{group[-1] + 1} failed ({exp}), retry {attempt + 1} in {delay:.1f}s")
+                time.sleep(delay)
+    finally:
+        os.remove(part_path)
+
+
+def ocr_pages(pdf_path : str, pages : list, backend : OCRBackend = None, concurrency : int = None,
+              max_retries : int = None, max_pages : int = None, on_range=None) -> dict:
+    """ocr_pages method runs ocr on some pages of a pdf only, as concurrent and resumable page range jobs.
+
+    The selected pages are grouped into requests (see `page_ranges`); each range is copied
+    into its own small pdf and sent to the ocr backend, up to `concurrency` at a time, with
+    retries. The text of every finished range is checkpointed on disk, so running the same
+    document again only processes the ranges that did not finish. A range that still fails
+    after its retries is reported and left out, the other ranges are kept. Checkpoints are
+    removed once every range is done.
+
+    Args:
+        pdf_path (str): path of the pdf
+        pages (list): page numbers (0 based) to ocr
+        backend (OCRBackend, optional): Defaults to get_ocr_backend().
+        concurrency (int, optional): ranges in flight. Defaults to OCR_CONCURRENCY.
+        max_retries (int, optional): retries per range. Defaults to OCR_MAX_RETRIES.
+        max_pages (int, optional): pages per range. Defaults to OCR_MAX_PAGES.
+        on_range (callable, optional): on_range(dict) after each range with pages, seconds, attempts, resumed and error
+
+    Returns:
+        dict: page number -> ocr text, for the ranges that succeeded
+    """
+    backend = backend or get_ocr_backend()
+    concurrency = concurrency or OCR_CONCURRENCY
+    max_retries = OCR_MAX_RETRIES if max_retries is None else max_retries
+    name = os.path.basename(pdf_path)
+    page_bytes = os.path.getsize(pdf_path) / max(page_count(pdf_path), 1)
+    groups = page_ranges(pages, page_bytes, max_pages)
+    checkpoint = OCRCheckpoint(pdf_path, backend.name)
+    texts = {}
+    failed = []
+    start = time.perf_counter()
+
+    def report(record):
+        label = f"{record['pages'][0] + 1}-{record['pages'][-1] + 1}"
+        if record["error"]:
+            print(f"ERROR : OCR of pages {label} of {name} failed after {record['attempts']} attempts : {record['error']}")
+        else:
+            print(f"INFO : OCR of pages {label} of {name} done in {record['seconds']}s"
+                  + (" (from checkpoint)" if record["resumed"] else ""))
+        if not record["resumed"]:
+            telemetry_record("ocr_range", record["seconds"], record["error"], file=name, pages=len(record["pages"]),
+                             attempts=record["attempts"], backend=backend.name)
+        if on_range is not None:
+            on_range(record)
+
+    todo = []
+    for group in groups:
+        done = checkpoint.load(group)
+        if done is None:
+            todo.append(group)
+            continue
+        texts.update(zip(group, done))
+        report({"pages": group, "seconds": 0.0, "attempts": 0, "resumed": True, "error": None})
+    print(f"INFO : OCR of {len(pages)} pages of {name} with {backend.name} : {len(groups)} ranges, "
+          f"{len(groups) - len(todo)} resumed, {min(concurrency, max(len(todo), 1))} in flight")
+    if todo:
+        with tempfile.TemporaryDirectory(prefix="ocr-", dir=SCRATCH_DIR) as scratch, \
+                ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="ocr") as executor:
+            futures = {executor.submit(ocr_range, pdf_path, group, backend, scratch, max_retries): group for group in todo}
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    result, attempts, seconds = future.result()
+                except Exception as exp:
+                    failed.append(group)
+                    report({"pages": group, "seconds": getattr(exp, "seconds", 0.0), "attempts": getattr(exp, "attempts", 1),
+                            "resumed": False, "error": str(exp)})
+                    continue
+                checkpoint.save(group, result, seconds)
+                texts.update(zip(group, result))
+                report({"pages": group, "seconds": seconds, "attempts": attempts, "resumed": False, "error": None})
+    if failed:
+        print(f"ERROR : OCR of {name} : {sum(len(group) for group in failed)} pages in {len(failed)} ranges failed, "
+              f"finished ranges are kept for the next run")
+    else:
+        checkpoint.clear()
+    print(f"INFO : OCR of {name} finished in {time.perf_counter() - start:.1f}s")
+    return texts
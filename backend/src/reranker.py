@@ -0,0 +1,208 @@
+## optional rerank stage between retrieval and the prompt, with local scorers
+import os
+import math
+import hashlib
+import importlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from lexical_index import tokenize
+
+## none | lexical | cross-encoder | module:Class of a Reranker (module:Class is only accepted here, never from a request)
+RERANKER = os.getenv("RERANKER", "none").lower()
+## names that turn reranking off
+RERANK_OFF = ("none", "false", "off")
+## candidates scored by the reranker, and passages kept for the prompt
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 30))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", 8))
+## (question, passage) pairs per cross-encoder call
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", 16))
+## scores kept in memory, per worker
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", 20000))
+## folder of an onnx cross-encoder (model.onnx or model_quantized.onnx, and tokenizer.json),
+## e.g. an export of cross-encoder/ms-marco-MiniLM-L-6-v2
+RERANK_MODEL_DIR = os.getenv("RERANK_MODEL_DIR", "")
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", 512))
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", 1))
+
+
+class ScoreCache:
+    def __init__(self, max_entries : int = None):
+        """ScoreCache is an LRU of (reranker, question, passage) -> score."""
+        self.max_entries = max_entries or RERANK_CACHE_SIZE
+        self.scores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get_many(self, keys : list) -> list:
+        with self._lock:
+            found = []
+            for key in keys:
+                score = self.scores.get(key)
+                if score is not None:
+                    self.scores.move_to_end(key)
+                found.append(score)
+            hits = sum(score is not None for score in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+            return found
+
+    def put_many(self, items : dict):
+        with self._lock:
+            self.scores.update(items)
+            while len(self.scores) > self.max_entries:
+                self.scores.popitem(last=False)
+
+
+_score_cache = ScoreCache()
+
+
+def text_digest(text : str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """Reranker scores (question, passage) pairs, higher is more relevant.
+
+    Subclasses implement `score_batch`. A pairwise reranker scores each pair on its own, so
+    `score` caches its scores and only sends the pairs it has not seen, RERANK_BATCH_SIZE at a time.
+    """
+    name = "reranker"
+    pairwise = True
+
+    def score_batch(self, query : str, texts : list) -> list:
+        raise NotImplementedError
+
+    def score(self, query : str, texts : list) -> list:
+        if not self.pairwise:
+            return list(self.score_batch(query, texts))
+        question = text_digest(query)
+        keys = [(self.name, question, text_digest(text)) for text in texts]
+        scores = _score_cache.get_many(keys)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        for start in range(0, len(missing), RERANK_BATCH_SIZE):
+            batch = missing[start:start + RERANK_BATCH_SIZE]
+            for i, score in zip(batch, self.score_batch(query, [texts[i] for i in batch])):
+                scores[i] = float(score)
+        _score_cache.put_many({keys[i]: scores[i] for i in missing})
+        return scores
+
+
+class LexicalReranker(Reranker):
+    """LexicalReranker scores passages by the idf-weighted share of the question's terms they contain,
+    plus the share of its consecutive term pairs they contain. Idf comes from the candidates, so scores
+    depend on the whole set and are not cached; the scorer takes microseconds per passage."""
+    name = "lexical"
+    pairwise = False
+
+    def score_batch(self, query : str, texts : list) -> list:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not texts:
+            return [0.0] * len(texts)
+        tokens = [tokenize(text) for text in texts]
+        present = [set(items) for items in tokens]
+        idf = {term: math.log(1 + len(texts) / (1 + sum(term in items for items in present))) for term in terms}
+        total = sum(idf.values()) or 1.0
+        bigrams = set(zip(terms, terms[1:]))
+        scores = []
+        for items, terms_present in zip(tokens, present):
+            coverage = sum(idf[term] for term in terms if term in terms_present) / total
+            phrase = len(bigrams & set(zip(items, items[1:]))) / len(bigrams) if bigrams else 0.0
+            scores.append(coverage + 0.5 * phrase)
+        return scores
+
+
+class CrossEncoderReranker(Reranker):
+    name = "cross-encoder"
+
+    def __init__(self, model_dir : str = None, max_length : int = None, threads : int = None):
+        """CrossEncoderReranker runs a small onnx cross-encoder on the CPU (needs onnxruntime and tokenizers).
+
+        Args:
+            model_dir (str, optional): Defaults to RERANK_MODEL_DIR.
+            max_length (int, optional): tokens of question + passage. Defaults to RERANK_MAX_LENGTH.
+            threads (int, optional): onnxruntime intra-op threads. Defaults to RERANK_THREADS.
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+        model_dir = model_dir or RERANK_MODEL_DIR
+        if not model_dir:
+            raise ValueError("RERANK_MODEL_DIR is not set")
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length or RERANK_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads or RERANK_THREADS
+        model = os.path.join(model_dir, "model_quantized.onnx")
+        if not os.path.exists(model):
+            model = os.path.join(model_dir, "model.onnx")
+        self.session = onnxruntime.InferenceSession(model, options, providers=["CPUExecutionProvider"])
+        self.inputs = {item.name for item in self.session.get_inputs()}
+        self.name = f"cross-encoder:{os.path.basename(os.path.normpath(model_dir))}"
+
+    def score_batch(self, query : str, texts : list) -> list:
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        feed = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64),
+        }
+        logits = self.session.run(None, {name: value for name, value in feed.items() if name in self.inputs})[0]
+        ## one relevance logit, or (irrelevant, relevant) logits
+        return (logits[:, -1] if logits.ndim == 2 else logits).tolist()
+
+
+_rerankers = {"lexical": LexicalReranker, "cross-encoder": CrossEncoderReranker}
+_instances = {}
+_lock = threading.Lock()
+
+
+def register_reranker(name : str, factory):
+    """register_reranker method makes a scorer available as RERANKER=name; factory() returns a Reranker."""
+    with _lock:
+        _rerankers[name] = factory
+        _instances.pop(name, None)
+
+
+def is_registered(name : str) -> bool:
+    """is_registered method tells whether a reranker name may be chosen per session : "none" or a name registered
+    with register_reranker. Sessions can't name a module:Class, it would import and call any attribute."""
+    return isinstance(name, str) and (name in RERANK_OFF or name in _rerankers)
+
+
+def get_reranker(name : str = None):
+    """get_reranker method returns the process-wide instance of a reranker, or None for "none".
+
+    A cross-encoder that can't be loaded (no model, onnxruntime missing) falls back to the lexical scorer.
+
+    Args:
+        name (str, optional): registered name, or the module:Class set as RERANKER by the operator. Defaults to RERANKER.
+
+    Raises:
+        ValueError: unknown name
+    """
+    name = name or RERANKER
+    if name in RERANK_OFF:
+        return None
+    with _lock:
+        if name not in _instances:
+            if name in _rerankers:
+                factory = _rerankers[name]
+            elif ":" in name and name == RERANKER:
+                module, attribute = name.split(":", 1)
+                factory = getattr(importlib.import_module(module), attribute)
+            else:
+                raise ValueError(f"unknown RERANKER {name}")
+            try:
+                _instances[name] = factory()
+            except Exception as exp:
+                if factory is LexicalReranker:
+                    raise
+                print(f"ERROR : reranker {name} could not be loaded, using the lexical one : {exp}")
+                _instances[name] = LexicalReranker()
+        return _instances[name]
+
+
+def rerank_stats() -> dict:
+    return {"cache_hits": _score_cache.hits, "cache_misses": _score_cache.misses, "cached": len(_score_cache.scores)}
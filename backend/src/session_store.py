@@ -0,0 +1,698 @@
+## on-disk persistence of session indexes and an LRU of the ones loaded in memory
+import os
+import json
+import pickle
+import hashlib
+import uuid
+import shutil
+import time
+import threading
+from collections import OrderedDict
+## faiss and langchain are imported by the functions that read or write an index, so the api starts without them
+from lexical_index import LexicalIndex,load_lexical_index
+
+## per-session index files live in a hidden folder next to the uploads, so document loading skips them
+INDEX_DIR = ".index"
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.pkl"
+STATUS_FILE = "status.json"
+FINGERPRINT_FILE = "fingerprint"
+MANIFEST_FILE = "manifest.json"
+## sessions over the shared document store keep the list of their documents instead of a docstore
+VIEW_FILE = "view.json"
+## per-session options, kept in the session folder itself (the index folder is rebuilt on re-ingestion)
+SETTINGS_FILE = ".settings.json"
+## content hashes computed while the files were uploaded, so they are not read again to index them
+UPLOADS_FILE = ".uploads.json"
+## memory budget of the sessions kept loaded in one worker
+SESSION_MEMORY_BUDGET_MB = float(os.getenv("SESSION_MEMORY_BUDGET_MB", 1024))
+## loaded sessions unused for this long are unloaded from memory (and are never deleted before)
+SESSION_IDLE_TTL_S = float(os.getenv("SESSION_IDLE_TTL_S", 1800))
+## folders of sessions unused for this long are deleted (0 keeps them)
+SESSION_RETENTION_HOURS = float(os.getenv("SESSION_RETENTION_HOURS", 24 * 30))
+## disk the session folders may take before the least recently used idle ones are deleted (0 = no quota)
+SESSION_DISK_QUOTA_MB = float(os.getenv("SESSION_DISK_QUOTA_MB", 20480))
+## the last access of a session is kept as the mtime of this file, rewritten at most this often
+ACCESS_FILE = ".access"
+ACCESS_WRITE_INTERVAL_S = 60
+## set INDEX_MMAP=false to read indexes fully into memory instead of memory-mapping them
+INDEX_MMAP = os.getenv("INDEX_MMAP", "true").lower() == "true"
+
+
+_uploads_lock = threading.Lock()
+
+
+def index_dir(folder : str) -> str:
+    return os.path.join(folder, INDEX_DIR)
+
+
+def has_index(folder : str) -> bool:
+    target = index_dir(folder)
+    return os.path.exists(os.path.join(target, VIEW_FILE)) or os.path.exists(os.path.join(target, DOCSTORE_FILE))
+
+
+def read_view(folder : str) -> dict:
+    """read_view method returns the view a session holds over the shared document store, None for sessions with their own docstore."""
+    try:
+        with open(os.path.join(index_dir(folder), VIEW_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def file_hash(path : str) -> str:
+    """file_hash method returns the sha256 of a file's content."""
+    content = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            content.update(block)
+    return content.hexdigest()
+
+
+def read_upload_hashes(folder : str) -> dict:
+    try:
+        with open(os.path.join(folder, UPLOADS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_upload_hashes(folder : str, hashes : dict):
+    """record_upload_hashes method remembers {file name: sha256} computed while uploading, with the size and
+    modification time of each file, so document_hashes trusts them only while the file is unchanged."""
+    with _uploads_lock:
+        recorded = read_upload_hashes(folder)
+        for name, digest in hashes.items():
+            stat = os.stat(os.path.join(folder, name))
+            recorded[name] = {"sha256": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        recorded = {name: entry for name, entry in recorded.items() if os.path.isfile(os.path.join(folder, name))}
+        path = os.path.join(folder, UPLOADS_FILE)
+        temp_path = path + f".tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(temp_path, "w") as f:
+            json.dump(recorded, f, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+
+
+def document_hashes(folder : str) -> dict:
+    """document_hashes method returns {file name: content sha256} of the documents in a session folder,
+    reusing the hashes recorded at upload for files whose size and modification time did not change."""
+    recorded = read_upload_hashes(folder)
+    hashes = {}
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.startswith(".") or not os.path.isfile(path):
+            continue
+        entry = recorded.get(name)
+        stat = os.stat(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            hashes[name] = entry["sha256"]
+        else:
+            hashes[name] = file_hash(path)
+    return hashes
+
+
+def document_fingerprint(folder : str, hashes : dict = None) -> str:
+    """document_fingerprint method returns a hash of the names and contents of the documents in a session folder.
+
+    It identifies the document set an index (and the answers computed over it) was built from.
+    """
+    hashes = document_hashes(folder) if hashes is None else hashes
+    digest = hashlib.sha256()
+    for name in sorted(hashes):
+        digest.update(f"{name}\x00{hashes[name]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def read_manifest(folder : str) -> dict:
+    """read_manifest method returns {file name: content sha256} of the documents indexed in a session, None for older indexes."""
+    try:
+        with open(os.path.join(index_dir(folder), MANIFEST_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_fingerprint(folder : str) -> str:
+    """read_fingerprint method returns the fingerprint recorded with a session index, computing it for older indexes."""
+    try:
+        with open(os.path.join(index_dir(folder), FINGERPRINT_FILE)) as f:
+            return f.read().strip()
+    except OSError:
+        return document_fingerprint(folder)
+
+
+def save_vector_store(vector_store, folder : str, hashes : dict = None):
+    """save_vector_store method writes the FAISS index and its docstore under the session folder.
+
+    The docstore is stored as plain (id, text, metadata) tuples rather than pickled
+    `Document` objects, and a bm25 index of the same chunks is written with them. Files are
+    written to a temporary name first and renamed into place, so another worker never reads
+    a half written index.
+
+    Args:
+        vector_store (FAISS): langchain FAISS vector store of the session
+        folder (str): upload folder of the session
+        hashes (dict, optional): {file name: sha256} of the indexed documents. Defaults to the folder's current files.
+    """
+    import faiss
+    from index_factory import describe
+    target = index_dir(folder)
+    os.makedirs(target, exist_ok=True)
+    suffix = f".tmp-{os.getpid()}-{threading.get_ident()}"
+    index_path = os.path.join(target, INDEX_FILE)
+    docstore_path = os.path.join(target, DOCSTORE_FILE)
+    faiss.write_index(vector_store.index, index_path + suffix)
+    records = []
+    for position in range(len(vector_store.index_to_docstore_id)):
+        doc_id = vector_store.index_to_docstore_id[position]
+        doc = vector_store.docstore.search(doc_id)
+        records.append((doc_id, doc.page_content, doc.metadata))
+    payload = {
+        "records": records,
+        "distance_strategy": str(vector_store.distance_strategy.value),
+        "normalize_L2": vector_store._normalize_L2,
+        "dimensions": vector_store.index.d,
+    }
+    with open(docstore_path + suffix, "wb") as f:
+        pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+    ## bm25 index of the same chunks, rebuilt from the docstore so positions always match the faiss index
+    LexicalIndex.build([text for _, text, _ in records]).write(target)
+    hashes = document_hashes(folder) if hashes is None else hashes
+    manifest_path = os.path.join(target, MANIFEST_FILE)
+    with open(manifest_path + suffix, "w") as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    fingerprint_path = os.path.join(target, FINGERPRINT_FILE)
+    with open(fingerprint_path + suffix, "w") as f:
+        f.write(document_fingerprint(folder, hashes))
+    os.replace(manifest_path + suffix, manifest_path)
+    ## a view saved over the shared store would be read first
+    remove_file(os.path.join(target, VIEW_FILE))
+    ## the docstore is renamed after the index, its presence marks a complete index
+    os.replace(index_path + suffix, index_path)
+    os.replace(docstore_path + suffix, docstore_path)
+    ## the fingerprint is renamed last : workers that see it changed reload a complete index (see SessionStore.get)
+    os.replace(fingerprint_path + suffix, fingerprint_path)
+    print(f"INFO : saved {describe(vector_store.index)} index of {len(records)} chunks to {target}")
+
+
+def save_view(folder : str, view : dict, texts : list, hashes : dict, index=None):
+    """save_view method writes a session that is a view over the shared document store : the list of its
+    documents, their bm25 index and, for sessions large enough to need one, an approximate index of their vectors.
+
+    Like `save_vector_store` files are renamed into place, the view then the fingerprint last.
+
+    Args:
+        folder (str): upload folder of the session
+        view (dict): {"profile", "dimensions", "metric", "documents": [[file name, document key, chunks]]}
+        texts (list): text of the chunks of the view, in order
+        hashes (dict): {file name: sha256} of the documents of the view
+        index (faiss.Index, optional): approximate index of the view's vectors. Defaults to an exact search of the shared vectors.
+    """
+    import faiss
+    target = index_dir(folder)
+    os.makedirs(target, exist_ok=True)
+    suffix = f".tmp-{os.getpid()}-{threading.get_ident()}"
+    LexicalIndex.build(texts).write(target)
+    view = {**view, "index": index is not None}
+    if index is not None:
+        faiss.write_index(index, os.path.join(target, INDEX_FILE) + suffix)
+    manifest_path = os.path.join(target, MANIFEST_FILE)
+    with open(manifest_path + suffix, "w") as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    fingerprint_path = os.path.join(target, FINGERPRINT_FILE)
+    with open(fingerprint_path + suffix, "w") as f:
+        f.write(document_fingerprint(folder, hashes))
+    view_path = os.path.join(target, VIEW_FILE)
+    with open(view_path + suffix, "w") as f:
+        json.dump(view, f, indent=1)
+    os.replace(manifest_path + suffix, manifest_path)
+    if index is not None:
+        os.replace(os.path.join(target, INDEX_FILE) + suffix, os.path.join(target, INDEX_FILE))
+    os.replace(view_path + suffix, view_path)
+    os.replace(fingerprint_path + suffix, fingerprint_path)
+    ## files of the session's own index, before it moved to the store
+    remove_file(os.path.join(target, DOCSTORE_FILE))
+    if index is None:
+        remove_file(os.path.join(target, INDEX_FILE))
+    print(f"INFO : saved view of {len(view['documents'])} shared documents ({len(texts)} chunks) to {target}")
+
+
+def remove_file(path : str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def load_view(folder : str, view : dict, make_embeddings, mmap : bool):
+    """load_view method opens a session saved by `save_view`. The chunks and vectors of its documents are those of
+    the store, loaded once per process; only the metadata naming the files is the session's own."""
+    import faiss
+    from langchain_core.documents import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.utils import DistanceStrategy
+    from index_factory import configure_search
+    from document_store import SharedIndex,open_document
+    documents = [open_document(view["profile"], key, mmap) for _, key, _ in view["documents"]]
+    docs = {}
+    index_to_docstore_id = {}
+    for (name, _, _), document in zip(view["documents"], documents):
+        path = os.path.join(folder, name)
+        for i, text in enumerate(document.texts):
+            position = len(index_to_docstore_id)
+            doc_id = str(position)
+            docs[doc_id] = Document(id=doc_id, page_content=text, metadata=document.chunk_metadata(i, path))
+            index_to_docstore_id[position] = doc_id
+    if view.get("index"):
+        index_path = os.path.join(index_dir(folder), INDEX_FILE)
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY) if mmap else faiss.read_index(index_path)
+        configure_search(index)
+    else:
+        index = SharedIndex(documents, view["dimensions"], inner_product=view["metric"] == "ip")
+    return FAISS(
+        embedding_function=make_embeddings(view["dimensions"]),
+        index=index,
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id=index_to_docstore_id,
+        normalize_L2=view["metric"] == "cosine",
+        distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT if view["metric"] == "ip" else DistanceStrategy.EUCLIDEAN_DISTANCE,
+    )
+
+
+def load_vector_store(folder : str, make_embeddings, mmap : bool = None):
+    """load_vector_store method loads a session index written by `save_vector_store` or `save_view`.
+
+    Args:
+        folder (str): upload folder of the session
+        make_embeddings (callable): make_embeddings(dimensions) -> embedding model used for queries
+        mmap (bool, optional): memory-map the index read-only. Defaults to INDEX_MMAP.
+
+    Returns:
+        FAISS: the langchain FAISS vector store
+    """
+    import faiss
+    from langchain_core.documents import Document
+    from langchain_community.docstore.in_memory import InMemoryDocstore
+    from langchain_community.vectorstores import FAISS
+    from langchain_community.vectorstores.utils import DistanceStrategy
+    from index_factory import configure_search
+    mmap = INDEX_MMAP if mmap is None else mmap
+    view = read_view(folder)
+    if view is not None:
+        return load_view(folder, view, make_embeddings, mmap)
+    target = index_dir(folder)
+    index_path = os.path.join(target, INDEX_FILE)
+    if mmap:
+        index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    else:
+        index = faiss.read_index(index_path)
+    configure_search(index)
+    with open(os.path.join(target, DOCSTORE_FILE), "rb") as f:
+        payload = pickle.load(f)
+    docs = {}
+    index_to_docstore_id = {}
+    for position, (doc_id, text, metadata) in enumerate(payload["records"]):
+        docs[doc_id] = Document(id=doc_id, page_content=text, metadata=metadata)
+        index_to_docstore_id[position] = doc_id
+    return FAISS(
+        embedding_function=make_embeddings(payload.get("dimensions", index.d)),
+        index=index,
+        docstore=InMemoryDocstore(docs),
+        index_to_docstore_id=index_to_docstore_id,
+        normalize_L2=payload.get("normalize_L2", False),
+        distance_strategy=DistanceStrategy(payload.get("distance_strategy", "EUCLIDEAN_DISTANCE")),
+    )
+
+
+def load_lexical(folder : str, mmap : bool = None):
+    """load_lexical method opens the bm25 index saved with a session index, or returns None for older indexes."""
+    return load_lexical_index(index_dir(folder), INDEX_MMAP if mmap is None else mmap)
+
+
+def file_version(path : str):
+    """file_version method returns (inode, mtime) of a file, None when it does not exist. Files of a session are
+    replaced by rename, so the version changes whenever a worker saves a new copy."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def read_settings(folder : str) -> dict:
+    """read_settings method returns the options set for a session (e.g. its reranker), {} when none."""
+    try:
+        with open(os.path.join(folder, SETTINGS_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_settings(folder : str, settings : dict):
+    path = os.path.join(folder, SETTINGS_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(settings, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def write_status(folder : str, status : dict):
+    """write_status method records the ingestion status of a session so every worker can read it."""
+    target = index_dir(folder)
+    os.makedirs(target, exist_ok=True)
+    path = os.path.join(target, STATUS_FILE)
+    temp_path = path + f".tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(temp_path, "w") as f:
+        json.dump(status, f)
+    os.replace(temp_path, path)
+
+
+def read_status(folder : str):
+    """read_status method returns the last recorded ingestion status of a session, or None."""
+    path = os.path.join(index_dir(folder), STATUS_FILE)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_index(folder : str):
+    shutil.rmtree(index_dir(folder), ignore_errors=True)
+
+
+def estimate_size(vector_store) -> int:
+    """estimate_size method returns the approximate bytes a loaded session takes (vectors + chunk text), without
+    the shared documents it holds (see shared_size)."""
+    index = vector_store.index
+    if hasattr(index, "shared_bytes"):
+        return len(vector_store.docstore._dict) * 200
+    size = index.ntotal * index.d * 4
+    for doc in vector_store.docstore._dict.values():
+        size += len(doc.page_content) + 200
+    return size
+
+
+def shared_size(vector_store) -> dict:
+    """shared_size method returns {document key: bytes} of the shared documents a loaded session holds, counted
+    once however many loaded sessions hold them."""
+    index = vector_store.index
+    return index.shared_bytes() if hasattr(index, "shared_bytes") else {}
+
+
+class SessionStore:
+    def __init__(self, upload_dir : str, load, memory_budget_mb : float = None):
+        """SessionStore keeps recently used sessions loaded and manages their lifecycle.
+
+        Sessions are loaded lazily (memory-mapped) from their persisted index on first use,
+        so they survive restarts and can be served by any worker without rebuilding. The last
+        access of every session is kept in memory and, at most once a minute, as the mtime of
+        its ACCESS_FILE, so idle time survives restarts too. Loaded sessions are unloaded when
+        idle for SESSION_IDLE_TTL_S or over the memory budget; `collect_garbage` deletes the
+        folders of sessions idle past SESSION_RETENTION_HOURS or, least recently used first,
+        while the upload folder is over SESSION_DISK_QUOTA_MB.
+
+        Loads of different sessions run side by side; concurrent requests for a session that
+        is being loaded wait for that load instead of loading it twice.
+
+        Args:
+            upload_dir (str): folder that holds one sub folder per session
+            load (callable): load(folder) -> (retriever, llm) for a persisted session
+            memory_budget_mb (float, optional): budget of loaded sessions. Defaults to SESSION_MEMORY_BUDGET_MB.
+        """
+        self.upload_dir = upload_dir
+        self.load = load
+        self.memory_budget = int((memory_budget_mb or SESSION_MEMORY_BUDGET_MB) * 1024 * 1024)
+        self.sessions = OrderedDict()
+        ## session_id -> last access time, and time its ACCESS_FILE was last touched
+        self.accessed = {}
+        self._touched = {}
+        ## session_id -> lock held while the session loads
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def folder(self, session_id : str):
+        """folder method returns the upload folder of a session, or None if session_id is not a session uuid."""
+        try:
+            uuid.UUID(str(session_id))
+        except ValueError:
+            return None
+        return os.path.join(self.upload_dir, str(session_id))
+
+    def get(self, session_id : str, touch : bool = True):
+        """get method returns {"folder", "retriever", "llm", "fingerprint", "size"} of a session, loading it from disk if needed.
+        touch=False (e.g. a warm-up) does not count as an access.
+
+        A loaded session is checked against its files on every call (two stats) : when another worker saved a new
+        index it is reloaded, when the settings changed the objects built from them (its workflow) are rebuilt.
+
+        Returns:
+            dict: session data, or None if the session has no persisted index
+        """
+        folder = self.folder(session_id) if session_id else None
+        if folder is None:
+            return None
+        with self._lock:
+            entry = self.sessions.get(session_id)
+            if entry is not None:
+                self.sessions.move_to_end(session_id)
+        if entry is not None:
+            entry = self._revalidate(session_id, folder, entry)
+        if entry is None:
+            with self._lock:
+                loading = self._loading.setdefault(session_id, threading.Lock())
+            with loading:
+                with self._lock:
+                    ## loaded by a concurrent request while this one waited
+                    entry = self.sessions.get(session_id)
+                if entry is None:
+                    try:
+                        entry = self._load(session_id, folder)
+                    finally:
+                        with self._lock:
+                            self._loading.pop(session_id, None)
+            if entry is None:
+                return None
+        if touch:
+            self.touch(session_id)
+        return entry
+
+    def _revalidate(self, session_id : str, folder : str, entry : dict):
+        """_revalidate method returns a loaded entry still in line with the session's files, or None once it was dropped."""
+        if file_version(os.path.join(index_dir(folder), FINGERPRINT_FILE)) != entry["index_version"]:
+            print(f"INFO : index of session {session_id} changed on disk, reloading it")
+            with self._lock:
+                if self.sessions.get(session_id) is entry:
+                    self.sessions.pop(session_id)
+            return None
+        settings_version = file_version(os.path.join(folder, SETTINGS_FILE))
+        if settings_version != entry["settings_version"]:
+            print(f"INFO : settings of session {session_id} changed on disk, rebuilding its workflow")
+            entry.pop("workflow", None)
+            entry["settings_version"] = settings_version
+        return entry
+
+    def _load(self, session_id : str, folder : str):
+        if not has_index(folder):
+            return None
+        print(f"INFO : loading index of session {session_id}")
+        ## versions read before loading : a save landing meanwhile is picked up by the next get
+        index_version = file_version(os.path.join(index_dir(folder), FINGERPRINT_FILE))
+        settings_version = file_version(os.path.join(folder, SETTINGS_FILE))
+        retriever, llm = self.load(folder)
+        entry = {
+            "index_version": index_version,
+            "settings_version": settings_version,
+            "folder": folder,
+            "retriever": retriever,
+            "llm": llm,
+            "fingerprint": read_fingerprint(folder),
+            "size": estimate_size(retriever.vectorstore),
+            "shared": shared_size(retriever.vectorstore),
+        }
+        with self._lock:
+            self.sessions[session_id] = entry
+            self._enforce_budget(keep=session_id)
+        return entry
+
+    def touch(self, session_id : str):
+        """touch method records an access to a session."""
+        now = time.time()
+        self.accessed[session_id] = now
+        if now - self._touched.get(session_id, 0) < ACCESS_WRITE_INTERVAL_S:
+            return
+        self._touched[session_id] = now
+        folder = self.folder(session_id)
+        try:
+            with open(os.path.join(folder, ACCESS_FILE), "a"):
+                pass
+            os.utime(os.path.join(folder, ACCESS_FILE))
+        except OSError:
+            pass
+
+    def last_access(self, session_id : str) -> float:
+        """last_access method returns the time a session was last used (or its folder last changed)."""
+        folder = self.folder(session_id)
+        times = [self.accessed.get(session_id, 0)]
+        for path in (os.path.join(folder, ACCESS_FILE), folder):
+            try:
+                times.append(os.path.getmtime(path))
+            except OSError:
+                pass
+        return max(times)
+
+    def indexed(self, session_id : str) -> bool:
+        """indexed method tells whether a session has a saved index that questions can be answered from."""
+        folder = self.folder(session_id)
+        return folder is not None and has_index(folder)
+
+    def status(self, session_id : str):
+        """status method returns the ingestion status recorded on disk for a session, or None."""
+        folder = self.folder(session_id)
+        if folder is None:
+            return None
+        return read_status(folder)
+
+    def unload(self, session_id : str):
+        """unload method forgets a loaded session and returns its entry, or None if it was not loaded."""
+        with self._lock:
+            return self.sessions.pop(session_id, None)
+
+    def loaded_bytes(self) -> int:
+        """loaded_bytes method returns the memory of the loaded sessions, the shared documents they hold counted once."""
+        entries = list(self.sessions.values())
+        shared = {}
+        for entry in entries:
+            shared.update(entry.get("shared", {}))
+        return sum(entry["size"] for entry in entries) + sum(shared.values())
+
+    def _enforce_budget(self, keep : str):
+        while self.loaded_bytes() > self.memory_budget and len(self.sessions) > 1:
+            session_id = next(iter(self.sessions))
+            if session_id == keep:
+                break
+            self.sessions.pop(session_id)
+            print(f"INFO : unloaded idle session {session_id} (memory budget)")
+
+    def evict_idle(self, ttl : float = None) -> list:
+        """evict_idle method unloads the sessions not used for `ttl` seconds (default SESSION_IDLE_TTL_S) and returns their ids."""
+        ttl = SESSION_IDLE_TTL_S if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            idle = [session_id for session_id in self.sessions if now - self.last_access(session_id) > ttl]
+            for session_id in idle:
+                self.sessions.pop(session_id)
+        for session_id in idle:
+            print(f"INFO : unloaded idle session {session_id} (idle for more than {ttl:g}s)")
+        return idle
+
+    def session_ids(self) -> list:
+        """session_ids method returns the ids of the session folders on disk."""
+        try:
+            names = os.listdir(self.upload_dir)
+        except OSError:
+            return []
+        return [name for name in names if self.folder(name) is not None and os.path.isdir(os.path.join(self.upload_dir, name))]
+
+    def shared_documents(self) -> set:
+        """shared_documents method returns (profile, document key) of the shared documents the sessions on disk hold."""
+        documents = set()
+        for session_id in self.session_ids():
+            view = read_view(self.folder(session_id))
+            if view is not None:
+                documents.update((view["profile"], key) for _, key, _ in view["documents"])
+        return documents
+
+    def describe(self, session_id : str, seen : set = None) -> dict:
+        """describe method returns the footprint of a session : memory when loaded, disk, files, status and last access.
+        With `seen` (see disk_usage), files shared with sessions described before are not counted again."""
+        folder = self.folder(session_id)
+        entry = self.sessions.get(session_id)
+        status = read_status(folder)
+        files = [name for name in os.listdir(folder) if not name.startswith(".") and os.path.isfile(os.path.join(folder, name))]
+        return {
+            "session_id": session_id,
+            "status": status["status"] if status else None,
+            "loaded": entry is not None,
+            "memory_bytes": entry["size"] + sum(entry.get("shared", {}).values()) if entry else 0,
+            "disk_bytes": disk_usage(folder, seen),
+            "files": len(files),
+            "last_access": round(self.last_access(session_id), 3),
+            "idle_seconds": round(time.time() - self.last_access(session_id), 1),
+        }
+
+    def delete(self, session_id : str):
+        """delete method unloads a session and removes its folder. Returns its document fingerprint (None without index)."""
+        folder = self.folder(session_id)
+        self.unload(session_id)
+        fingerprint = read_fingerprint(folder) if has_index(folder) else None
+        shutil.rmtree(folder, ignore_errors=True)
+        self.accessed.pop(session_id, None)
+        self._touched.pop(session_id, None)
+        return fingerprint
+
+    def collect_garbage(self, busy : set = (), quota_mb : float = None, retention_hours : float = None,
+                        min_idle : float = None) -> list:
+        """collect_garbage method deletes the folders of idle sessions : those idle past the retention, then the least
+        recently used ones while the sessions take more than the disk quota.
+
+        Sessions used within `min_idle` seconds (default SESSION_IDLE_TTL_S) and `busy` ones (being ingested) are never deleted.
+
+        Args:
+            busy (set, optional): session ids with an unfinished ingestion job
+            quota_mb (float, optional): Defaults to SESSION_DISK_QUOTA_MB, 0 disables the quota.
+            retention_hours (float, optional): Defaults to SESSION_RETENTION_HOURS, 0 keeps sessions forever.
+            min_idle (float, optional): Defaults to SESSION_IDLE_TTL_S.
+
+        Returns:
+            list: [(session_id, fingerprint, disk bytes)] of the deleted sessions
+        """
+        quota = (SESSION_DISK_QUOTA_MB if quota_mb is None else quota_mb) * 1024 * 1024
+        retention = (SESSION_RETENTION_HOURS if retention_hours is None else retention_hours) * 3600
+        min_idle = SESSION_IDLE_TTL_S if min_idle is None else min_idle
+        now = time.time()
+        sessions = []
+        ## a file uploaded to several sessions is one file on disk, counted with the first of them
+        seen = set()
+        for session_id in self.session_ids():
+            sessions.append((self.last_access(session_id), session_id, disk_usage(self.folder(session_id), seen)))
+        total = sum(size for _, _, size in sessions)
+        deleted = []
+        ## least recently used first
+        for accessed, session_id, size in sorted(sessions):
+            idle = now - accessed
+            if session_id in busy or idle <= min_idle:
+                continue
+            expired = retention and idle > retention
+            if not expired and not (quota and total > quota):
+                continue
+            fingerprint = self.delete(session_id)
+            total -= size
+            deleted.append((session_id, fingerprint, size))
+            reason = "retention" if expired else "disk quota"
+            print(f"INFO : deleted session {session_id} ({size / 2**20:.1f} MB, idle {idle / 3600:.1f}h, {reason})")
+        return deleted
+
+
+def disk_usage(folder : str, seen : set = None) -> int:
+    """disk_usage method returns the bytes of the files under a folder. Files linked more than once (shared with the
+    document store) are counted once across the calls given the same `seen` set."""
+    total = 0
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += disk_usage(entry.path, seen)
+            elif entry.is_file(follow_symlinks=False):
+                stat = entry.stat(follow_symlinks=False)
+                if seen is not None and stat.st_nlink > 1:
+                    if (stat.st_dev, stat.st_ino) in seen:
+                        continue
+                    seen.add((stat.st_dev, stat.st_ino))
+                total += stat.st_size
+        except OSError:
+            pass
+    return total
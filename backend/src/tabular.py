@@ -0,0 +1,443 @@
+## csv / xlsx files : columnar copies, schema summaries for retrieval and vectorized queries
+import os
+import json
+import re
+from collections import Counter
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import PromptTemplate
+
+TABULAR_EXTENSIONS = (".csv", ".xlsx")
+## columnar copies live in a hidden folder next to the uploads, so document loading skips them
+TABLE_DIR = ".tables"
+## bytes of csv parsed per batch, files larger than memory are streamed batch by batch
+TABULAR_BLOCK_MB = float(os.getenv("TABULAR_BLOCK_MB", 16))
+## rows of an xlsx sheet converted per batch
+TABULAR_XLSX_BATCH = int(os.getenv("TABULAR_XLSX_BATCH", 50000))
+## rows of a query result put into the prompt
+TABULAR_MAX_RESULT_ROWS = int(os.getenv("TABULAR_MAX_RESULT_ROWS", 50))
+## set TABULAR_QUERY=false to answer from the table summaries only
+TABULAR_QUERY_ENABLED = os.getenv("TABULAR_QUERY", "true").lower() == "true"
+
+## string columns whose values are mostly numbers with units ("963 hp", "$1,100,000") get a numeric twin
+NUMERIC_SUFFIX = " (number)"
+NUMBER_PATTERN = r"(?P<number>-?\d+(?:\.\d+)?)"
+NUMERIC_SHARE = 0.9
+## distinct values tracked per column when profiling
+MAX_TRACKED_VALUES = 10000
+
+FILTER_OPS = ("==", "!=", "<", "<=", ">", ">=", "in", "contains")
+AGGREGATIONS = ("count", "count_distinct", "sum", "mean", "min", "max")
+
+
+def is_table(file : str) -> bool:
+    return os.path.splitext(file)[1].lower() in TABULAR_EXTENSIONS
+
+
+def table_path(file : str) -> str:
+    """table_path method returns where the parquet copy of a csv / xlsx upload is kept."""
+    folder, name = os.path.split(file)
+    return os.path.join(folder, TABLE_DIR, name + ".parquet")
+
+
+def numeric_columns(batch : pa.RecordBatch) -> list:
+    """numeric_columns method returns the string columns of a batch whose values mostly read as numbers."""
+    columns = []
+    for field, column in zip(batch.schema, batch.columns):
+        if not pa.types.is_string(field.type) or column.null_count == len(column):
+            continue
+        numbers = to_number(column)
+        if (len(column) - numbers.null_count) >= NUMERIC_SHARE * (len(column) - column.null_count):
+            columns.append(field.name)
+    return columns
+
+
+def to_number(column):
+    """to_number method reads the first number of each value ("$12,000-$15,000" -> 12000.0), null when there is none."""
+    digits = pc.replace_substring(column, ",", "")
+    return pc.struct_field(pc.extract_regex(digits, NUMBER_PATTERN), [0]).cast(pa.float64())
+
+
+def with_numbers(batch : pa.RecordBatch, columns : list) -> pa.RecordBatch:
+    if not columns:
+        return batch
+    arrays = list(batch.columns) + [to_number(batch.column(name)) for name in columns]
+    names = batch.schema.names + [name + NUMERIC_SUFFIX for name in columns]
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def unique_names(names : list) -> list:
+    """unique_names method names the empty headers of a table "column n" and numbers repeated ones
+    ("amount", "amount (2)"), so every column can be read and queried by its name."""
+    unique, taken = [], set()
+    for number, name in enumerate(names):
+        name = str(name).strip() if name is not None else ""
+        name = name or f"column {number + 1}"
+        candidate, count = name, 2
+        while candidate in taken:
+            candidate = f"{name} ({count})"
+            count += 1
+        taken.add(candidate)
+        unique.append(candidate)
+    return unique
+
+
+def widen_nulls(batch : pa.RecordBatch) -> pa.RecordBatch:
+    """widen_nulls method types the columns of a batch that hold no value at all as strings, so later
+    batches with values in them still fit the schema."""
+    if not any(pa.types.is_null(field.type) for field in batch.schema):
+        return batch
+    schema = pa.schema([pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field for field in batch.schema])
+    return batch.cast(schema)
+
+
+def decode_text(value : bytes) -> str:
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("cp1252", errors="replace")
+
+
+def decode_binary(batch : pa.RecordBatch) -> pa.RecordBatch:
+    """decode_binary method turns the binary columns arrow infers for text with invalid utf-8 (often
+    windows-1252 exports) back into strings."""
+    if not any(pa.types.is_binary(field.type) for field in batch.schema):
+        return batch
+    arrays = []
+    for field, column in zip(batch.schema, batch.columns):
+        if pa.types.is_binary(field.type):
+            column = pa.array([None if value is None else decode_text(value) for value in column.to_pylist()], pa.string())
+        arrays.append(column)
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def csv_batches(file : str, as_strings : bool = False):
+    """csv_batches method streams a csv as record batches of about TABULAR_BLOCK_MB."""
+    block_size = int(TABULAR_BLOCK_MB * 1024 * 1024)
+    header = pa_csv.open_csv(file, read_options=pa_csv.ReadOptions(block_size=block_size)).schema.names
+    names = unique_names(header)
+    read_options = pa_csv.ReadOptions(block_size=block_size, column_names=names, skip_rows=1)
+    convert_options = None
+    if as_strings:
+        convert_options = pa_csv.ConvertOptions(column_types={name: pa.binary() for name in names})
+    reader = pa_csv.open_csv(file, read_options=read_options, convert_options=convert_options)
+    for batch in reader:
+        yield decode_binary(batch)
+
+
+def xlsx_batches(file : str, as_strings : bool = False):
+    """xlsx_batches method streams the first sheet of a workbook as record batches of TABULAR_XLSX_BATCH rows."""
+    from openpyxl import load_workbook
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        names = unique_names(header)
+        batch = []
+        for row in rows:
+            if as_strings:
+                row = [None if value is None else str(value) for value in row]
+            batch.append(dict(zip(names, row)))
+            if len(batch) >= TABULAR_XLSX_BATCH:
+                yield pa.RecordBatch.from_pylist(batch)
+                batch = []
+        if batch:
+            yield pa.RecordBatch.from_pylist(batch)
+    finally:
+        workbook.close()
+
+
+def write_parquet(batches, target : str) -> int:
+    """write_parquet method writes record batches to a parquet file, adding numeric twins of unit-bearing
+    string columns. The columns are decided on the first batch, where columns without any value are
+    typed as strings. Returns the number of rows."""
+    writer = None
+    schema = None
+    columns = []
+    rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                batch = widen_nulls(batch)
+                columns = numeric_columns(batch)
+                batch = with_numbers(batch, columns)
+                schema = batch.schema
+                writer = pq.ParquetWriter(target, schema)
+            else:
+                batch = with_numbers(batch, columns)
+                if batch.schema != schema:
+                    batch = batch.cast(schema)
+            writer.write_batch(batch)
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("the table has no header row")
+    return rows
+
+
+def convert_table(file : str) -> str:
+    """convert_table method writes the columnar (parquet) copy of a csv / xlsx upload.
+
+    Types are inferred from the first batch; when a later batch does not fit them (a number
+    column with text further down) the file is converted again with every column as text.
+
+    Args:
+        file (str): path of the csv / xlsx file
+
+    Returns:
+        str: path of the parquet copy
+    """
+    target = table_path(file)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    partial = target + f".tmp-{os.getpid()}"
+    if file.lower().endswith(".xlsx"):
+        attempts = [lambda: xlsx_batches(file), lambda: xlsx_batches(file, as_strings=True)]
+    else:
+        attempts = [lambda: csv_batches(file), lambda: csv_batches(file, as_strings=True)]
+    for number, batches in enumerate(attempts):
+        try:
+            rows = write_parquet(batches(), partial)
+            break
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError) as exp:
+            if number == len(attempts) - 1:
+                raise
+            print(f"INFO : {os.path.basename(file)} : {exp}, converting again as text")
+    os.replace(partial, target)
+    print(f"INFO : converted {os.path.basename(file)} to parquet : {rows} rows")
+    return target
+
+
+def profile_table(parquet : str) -> dict:
+    """profile_table method computes per column statistics of a parquet table, one batch at a time.
+
+    Returns:
+        dict: {"rows", "columns": [{"name", "type", "nulls", "min", "max", "mean", "distinct", "top"}]}
+    """
+    parquet_file = pq.ParquetFile(parquet)
+    schema = parquet_file.schema_arrow
+    profiles = [{"name": field.name, "type": str(field.type), "nulls": 0, "values": Counter(), "many": False,
+                 "min": None, "max": None, "sum": 0.0, "count": 0} for field in schema]
+    for batch in parquet_file.iter_batches(batch_size=65536):
+        for profile, field, column in zip(profiles, schema, batch.columns):
+            profile["nulls"] += column.null_count
+            if pa.types.is_integer(field.type) or pa.types.is_floating(field.type):
+                bounds = pc.min_max(column)
+                low, high = bounds["min"].as_py(), bounds["max"].as_py()
+                if low is not None:
+                    profile["min"] = low if profile["min"] is None else min(profile["min"], low)
+                    profile["max"] = high if profile["max"] is None else max(profile["max"], high)
+                    profile["sum"] += pc.sum(column).as_py() or 0
+                    profile["count"] += len(column) - column.null_count
+            if not profile["many"]:
+                counts = pc.value_counts(column.drop_null())
+                for item in counts:
+                    profile["values"][item["values"].as_py()] += item["counts"].as_py()
+                if len(profile["values"]) > MAX_TRACKED_VALUES:
+                    profile["many"] = True
+                    profile["values"] = Counter(dict(profile["values"].most_common(10)))
+    columns = []
+    for profile in profiles:
+        columns.append({
+            "name": profile["name"],
+            "type": profile["type"],
+            "nulls": profile["nulls"],
+            "min": profile["min"],
+            "max": profile["max"],
+            "mean": round(profile["sum"] / profile["count"], 4) if profile["count"] else None,
+            "distinct": f"more than {MAX_TRACKED_VALUES}" if profile["many"] else len(profile["values"]),
+            "top": [value for value, _ in profile["values"].most_common(5)],
+        })
+    return {"rows": parquet_file.metadata.num_rows, "columns": columns}
+
+
+def describe_column(column : dict) -> str:
+    text = f"{column['name']} ({column['type']}), {column['nulls']} empty, {column['distinct']} distinct values"
+    if column["min"] is not None:
+        text += f", from {column['min']} to {column['max']}, mean {column['mean']}"
+    if column["top"]:
+        text += ", e.g. " + ", ".join(str(value)[:40] for value in column["top"])
+    return text
+
+
+def load_table(file : str) -> list:
+    """load_table method converts a csv / xlsx upload to parquet and returns Documents describing it.
+
+    Only the schema and column summaries are embedded, never the rows: one overview Document
+    and one per column. Questions about the rows are answered by `TableQA` on the parquet copy.
+
+    Args:
+        file (str): path of the csv / xlsx file
+
+    Returns:
+        list: Documents with metadata source, table and page (0 for the overview, then one per column)
+    """
+    name = os.path.basename(file)
+    profile = profile_table(convert_table(file))
+    names = ", ".join(column["name"] for column in profile["columns"])
+    overview = (f"Table {name} has {profile['rows']} rows and {len(profile['columns'])} columns : {names}. "
+                f"Counts, sums, averages, minimums, maximums, filters and rankings over its rows are computed from the table.")
+    documents = [Document(page_content=overview, metadata={"source": file, "table": name, "page": 0})]
+    for number, column in enumerate(profile["columns"], start=1):
+        documents.append(Document(page_content=f"Column of table {name} : {describe_column(column)}",
+                                  metadata={"source": file, "table": name, "page": number}))
+    return documents
+
+
+def session_tables(folder : str) -> dict:
+    """session_tables method returns {file name: parquet path} of the tables of a session folder."""
+    tables = {}
+    for name in sorted(os.listdir(folder)):
+        parquet = table_path(os.path.join(folder, name))
+        if is_table(name) and os.path.exists(parquet):
+            tables[name] = parquet
+    return tables
+
+
+def filter_expression(filters : list, schema : pa.Schema):
+    """filter_expression method turns [{"column", "op", "value"}] into a dataset expression (pushed down to the parquet scan)."""
+    expression = None
+    for item in filters or []:
+        column, op, value = item["column"], item["op"], item.get("value")
+        if column not in schema.names or op not in FILTER_OPS:
+            raise ValueError(f"unsupported filter {item}")
+        field = pc.field(column)
+        numeric = pa.types.is_integer(schema.field(column).type) or pa.types.is_floating(schema.field(column).type)
+        if numeric and isinstance(value, str):
+            value = float(value)
+        if op == "contains":
+            condition = pc.match_substring(field, str(value), ignore_case=True)
+        elif op == "in":
+            condition = field.isin(value if isinstance(value, list) else [value])
+        else:
+            condition = {"==": field == value, "!=": field != value, "<": field < value,
+                         "<=": field <= value, ">": field > value, ">=": field >= value}[op]
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def run_query(parquet : str, plan : dict, max_rows : int = None) -> tuple:
+    """run_query method executes a query plan on a parquet table with Arrow compute.
+
+    Only the columns the plan uses are read and the filters are pushed down to the scan, so
+    row groups that can't match are skipped.
+
+    Args:
+        parquet (str): path of the parquet table
+        plan (dict): {"filters": [{"column", "op", "value"}], "group_by": [columns],
+            "aggregations": [{"column", "function"}], "columns": [columns],
+            "order_by": [{"column", "descending"}], "limit": rows}
+        max_rows (int, optional): rows returned at most. Defaults to TABULAR_MAX_RESULT_ROWS.
+
+    Returns:
+        tuple: (result pyarrow.Table, number of rows before the limit)
+    """
+    max_rows = max_rows or TABULAR_MAX_RESULT_ROWS
+    dataset = ds.dataset(parquet, format="parquet")
+    group_by = plan.get("group_by") or []
+    aggregations = []
+    for item in plan.get("aggregations") or []:
+        if item.get("function") not in AGGREGATIONS:
+            raise ValueError(f"unsupported aggregation {item}")
+        if item["function"] == "count" and item.get("column") in (None, "*"):
+            aggregations.append(([], "count_all"))
+        else:
+            aggregations.append((item["column"], item["function"]))
+    used = set(group_by) | {column for column, _ in aggregations if column} | set(plan.get("columns") or [])
+    used |= {item["column"] for item in plan.get("filters") or []}
+    unknown = [column for column in used if column not in dataset.schema.names]
+    if unknown:
+        raise ValueError(f"unknown columns {unknown}")
+    read = [column for column in dataset.schema.names if column in used] if aggregations or plan.get("columns") else None
+    table = dataset.to_table(columns=read, filter=filter_expression(plan.get("filters"), dataset.schema))
+    if aggregations:
+        table = table.group_by(group_by).aggregate(aggregations)
+    elif plan.get("columns"):
+        table = table.select(plan["columns"])
+    order_by = [(item["column"], "descending" if item.get("descending") else "ascending")
+                for item in plan.get("order_by") or [] if item.get("column") in table.column_names]
+    if order_by:
+        table = table.sort_by(order_by)
+    total = table.num_rows
+    limit = min(int(plan.get("limit") or max_rows), max_rows)
+    return table.slice(0, limit), total
+
+
+def format_result(table : pa.Table, total : int) -> str:
+    """format_result method renders a query result as a markdown table."""
+    lines = ["| " + " | ".join(table.column_names) + " |", "|" + "---|" * len(table.column_names)]
+    for row in table.to_pylist():
+        lines.append("| " + " | ".join("" if value is None else str(value) for value in row.values()) + " |")
+    if total > table.num_rows:
+        lines.append(f"({total} rows in total, the first {table.num_rows} are shown)")
+    return "\n".join(lines)
+
+
+class TableQA:
+    def __init__(self, folder_path : str, llm):
+        """TableQA answers questions about the rows of a session's tables with a query instead of retrieved text.
+
+        The llm writes a small JSON query plan from the table schemas, the plan is run on the
+        parquet copy with Arrow (filters, group by, aggregations, ordering) and the result rows
+        become part of the context of the answer.
+
+        Args:
+            folder_path (str): upload folder of the session
+            llm: chat model writing the query plans
+        """
+        self.folder_path = folder_path
+        self.plan_chain = self.prompt() | llm | StrOutputParser()
+
+    def prompt(self) -> PromptTemplate:
+        return PromptTemplate(
+        template="""
+        You write query plans over tables. Given the tables below and a question, return ONLY a JSON object :
+        {{"table": "<table name>", "filters": [{{"column": "<column>", "op": "== | != | < | <= | > | >= | in | contains", "value": <value>}}],
+          "group_by": ["<column>"], "aggregations": [{{"column": "<column or *>", "function": "count | count_distinct | sum | mean | min | max"}}],
+          "columns": ["<column>"], "order_by": [{{"column": "<column or <column>_<function> of an aggregation>", "descending": true}}], "limit": <rows>}}
+        Leave out the keys a question does not need. Use the "(number)" columns for numeric comparisons and aggregations.
+        An aggregation is named <column>_<function>, a count of * is named count_all.
+        If the question can't be answered from the rows of a table, return {{"table": null}}.
+
+        Tables :
+        {tables}
+        Question : {question}
+        """,
+        input_variables=["tables", "question"]
+        )
+
+    def schemas(self, tables : dict) -> str:
+        lines = []
+        for name, parquet in tables.items():
+            schema = pq.read_schema(parquet)
+            columns = ", ".join(f"{field.name} ({field.type})" for field in schema)
+            lines.append(f"- {name} : {columns}")
+        return "\n".join(lines)
+
+    def context(self, question : str, names : list) -> str:
+        """context method returns the query result for a question about the given tables, or "" when none applies."""
+        tables = {name: parquet for name, parquet in session_tables(self.folder_path).items() if name in names}
+        if not tables:
+            return ""
+        try:
+            text = self.plan_chain.invoke({"tables": self.schemas(tables), "question": question})
+            match = re.search(r"\{.*\}", text, re.DOTALL)
+            plan = json.loads(match.group(0)) if match else {}
+            if not plan.get("table"):
+                return ""
+            if plan["table"] not in tables:
+                raise ValueError(f"unknown table {plan['table']}")
+            result, total = run_query(tables[plan["table"]], plan)
+        except Exception as exp:
+            print(f"ERROR : table query failed : {exp}")
+            return ""
+        print(f"INFO : table query on {plan['table']} : {json.dumps(plan)} -> {total} rows")
+        return f"Result of a query on table {plan['table']} ({json.dumps(plan)}) :\n{format_result(result, total)}"
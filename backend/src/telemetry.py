@@ -0,0 +1,226 @@
+## timings of the pipeline stages : spans logged as json lines and aggregated as Prometheus metrics
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+## TRACE_LOG=false stops the json line per span, metrics are still recorded
+TRACE_LOG = os.getenv("TRACE_LOG", "true").lower() != "false"
+## spans shorter than this are aggregated but not logged (e.g. the many small embedding batches of a cached upload)
+TRACE_LOG_MIN_MS = float(os.getenv("TRACE_LOG_MIN_MS", 0))
+## upper bounds (seconds) of the duration histograms, from a query lookup to a whole ingestion
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+## span attributes counted as sizes, e.g. the pages loaded or the tokens embedded per stage
+SIZE_ATTRIBUTES = ("files", "pages", "chunks", "tokens", "bytes", "passages")
+
+## trace (upload or question) the spans of the current task belong to
+_trace = contextvars.ContextVar("trace", default=None)
+## callables given every span, see add_listener
+_listeners = []
+
+
+class Histogram:
+    def __init__(self, name : str, help : str, labels : tuple, buckets : tuple = DURATION_BUCKETS):
+        """Histogram counts observations per label values into cumulative buckets, like a Prometheus histogram."""
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        ## label values -> [bucket counts..., count, sum]
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value : float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def quantile(self, q : float, *label_values) -> float:
+        """quantile method estimates a quantile from the buckets (linear within a bucket), None without observations."""
+        with self._lock:
+            series = list(self.series.get(label_values, ()))
+        if not series or not series[-2]:
+            return None
+        rank = q * series[-2]
+        seen, lower = 0, 0.0
+        for bound, count in zip(self.buckets, series):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+    def expose(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(value) for key, value in self.series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {values[-2]}')
+            lines.append(f"{self.name}_count{{{labels}}} {values[-2]}")
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-1]:.6f}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name : str, help : str, labels : tuple):
+        """Counter adds up values per label values, like a Prometheus counter."""
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value : float, *label_values):
+        with self._lock:
+            self.series[label_values] = self.series.get(label_values, 0) + value
+
+    def expose(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            series = dict(self.series)
+        for label_values, value in sorted(series.items()):
+            lines.append(f"{self.name}{{{format_labels(self.labels, label_values)}}} {value:g}")
+        return lines
+
+
+def format_labels(names : tuple, values : tuple) -> str:
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, escaped))
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of the pipeline stages", ("stage",))
+STAGE_ERRORS = Counter("rag_stage_errors_total", "Pipeline stages that raised or reported an error", ("stage",))
+STAGE_SIZE = Counter("rag_stage_size_total", "Pages, chunks, tokens and bytes handled by the pipeline stages", ("stage", "unit"))
+HTTP_SECONDS = Histogram("rag_http_request_seconds", "Latency of the API requests", ("handler", "method", "status"))
+METRICS = (STAGE_SECONDS, STAGE_ERRORS, STAGE_SIZE, HTTP_SECONDS)
+
+
+def record(stage : str, seconds : float, error=None, **attributes):
+    """record method records a stage that was already timed : its duration histogram, sizes and json log line.
+
+    Args:
+        stage (str): e.g. "load_file", "ocr_range", "embed_batch", "retrieve", "llm"
+        seconds (float): duration of the stage
+        error (optional): error of the stage, counted in rag_stage_errors_total
+        **attributes: sizes (files, pages, chunks, tokens, bytes, passages) and context (file, session...) of the stage
+    """
+    STAGE_SECONDS.observe(seconds, stage)
+    if error is not None:
+        STAGE_ERRORS.inc(1, stage)
+    for unit in SIZE_ATTRIBUTES:
+        value = attributes.get(unit)
+        if isinstance(value, (int, float)) and value:
+            STAGE_SIZE.inc(value, stage, unit)
+    if TRACE_LOG and seconds * 1000 >= TRACE_LOG_MIN_MS:
+        line = {"span": stage, "ms": round(seconds * 1000, 2), "trace": _trace.get()}
+        line.update(attributes)
+        if error is not None:
+            line["error"] = str(error)
+        print(f"TRACE : {json.dumps(line, default=str)}")
+    for listener in _listeners:
+        listener(stage, seconds, error, attributes)
+
+
+def add_listener(listener):
+    """add_listener method makes `record` call listener(stage, seconds, error, attributes) for every span,
+    e.g. to keep the exact durations of a benchmark run. Listeners run on the thread of the span, so they must be thread safe."""
+    _listeners.append(listener)
+
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+class Span:
+    def __init__(self, stage : str, attributes : dict):
+        """Span is a stage being timed; sizes known only at the end are added with `set`."""
+        self.stage = stage
+        self.attributes = attributes
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+@contextmanager
+def span(stage : str, **attributes):
+    """span method times the block it wraps and records it as `stage`, e.g.
+
+        with span("index_build", chunks=n) as current:
+            ...
+            current.set(bytes=size)
+
+    An exception raised in the block is recorded as the span's error and raised again.
+    """
+    current = Span(stage, attributes)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as exp:
+        current.error = f"{type(exp).__name__}: {exp}"
+        raise
+    finally:
+        record(stage, time.perf_counter() - start, current.error, **current.attributes)
+
+
+@contextmanager
+def trace(trace_id : str):
+    """trace method tags the spans of the block (and of the asyncio.to_thread calls it makes) with `trace_id`."""
+    token = _trace.set(trace_id)
+    try:
+        yield
+    finally:
+        _trace.reset(token)
+
+
+def current_trace() -> str:
+    return _trace.get()
+
+
+def expose() -> str:
+    """expose method returns every metric in the Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.expose())
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        """MetricsMiddleware records the latency of every API request per handler (the endpoint function, so
+        session ids in paths don't make a series each), method and status. Streamed responses are timed to their last byte."""
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            HTTP_SECONDS.observe(time.perf_counter() - start, handler, scope["method"], str(status[0]))
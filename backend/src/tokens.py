@@ -0,0 +1,50 @@
+## token counting shared by the embedding and prompt stages
+import os
+
+## tiktoken encoding used by the OpenAI embedding and chat models
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+
+_encoding = None
+_encoding_failed = False
+
+
+def get_encoding():
+    """get_encoding method loads the tiktoken encoding once. Returns None when tiktoken
+    (or its encoding file) is not available, in which case counts are estimated."""
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as exp:
+            _encoding_failed = True
+            print(f"INFO : tiktoken not available ({exp}), estimating token counts")
+    return _encoding
+
+
+def count_tokens(text : str) -> int:
+    """count_tokens method returns the number of tokens of a text.
+
+    Args:
+        text (str): text to count
+
+    Returns:
+        int: exact count with tiktoken, otherwise an estimate of 4 characters per token
+    """
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text : str, limit : int) -> str:
+    """truncate_tokens method returns the first `limit` tokens of a text (estimated with 4 characters per token without tiktoken)."""
+    if not text or limit <= 0:
+        return ""
+    encoding = get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= limit else encoding.decode(tokens[:limit])
+    return text[:limit * 4]
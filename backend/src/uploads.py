@@ -0,0 +1,189 @@
+## streaming of uploaded files to a session folder, with size limits and content hashes
+import os
+import re
+import uuid
+import asyncio
+import hashlib
+import threading
+import unicodedata
+from fastapi.responses import JSONResponse
+
+## bytes copied (and hashed) at a time
+UPLOAD_BLOCK_KB = int(os.getenv("UPLOAD_BLOCK_KB", 1024))
+## largest file, largest request and most files per request
+UPLOAD_MAX_FILE_MB = float(os.getenv("UPLOAD_MAX_FILE_MB", 512))
+UPLOAD_MAX_REQUEST_MB = float(os.getenv("UPLOAD_MAX_REQUEST_MB", 2048))
+UPLOAD_MAX_FILES = int(os.getenv("UPLOAD_MAX_FILES", 200))
+## files of one request copied at the same time
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+MAX_NAME_LENGTH = 180
+
+UNSAFE_CHARACTERS = re.compile(r"[^\w.\- ()&+,\[\]]")
+
+
+class UploadError(ValueError):
+    """UploadError is raised when an upload breaks a limit or has no usable file name."""
+
+
+def sanitize_filename(filename : str) -> str:
+    """sanitize_filename method turns a client file name into a safe name inside the session folder.
+
+    Directories (either separator) are dropped, the name is NFC normalized, control and shell
+    characters become "_", and leading dots are removed so an upload can never be hidden or
+    overwrite the session's own files (.index, .settings.json). Long names are cut, keeping the extension.
+
+    Returns:
+        str: the safe name, None when nothing usable is left
+    """
+    name = unicodedata.normalize("NFC", filename or "").replace("\\", "/").split("/")[-1]
+    name = UNSAFE_CHARACTERS.sub("_", "".join(c for c in name if unicodedata.category(c)[0] != "C"))
+    name = name.strip().lstrip(".").strip()
+    if not name or not name.strip("._ "):
+        return None
+    stem, extension = os.path.splitext(name)
+    if len(name) > MAX_NAME_LENGTH:
+        name = stem[:MAX_NAME_LENGTH - len(extension)] + extension
+    return name
+
+
+def unique_name(name : str, taken : set) -> str:
+    """unique_name method returns name, or "name (2).ext"... when another file of the same request has it."""
+    stem, extension = os.path.splitext(name)
+    candidate, number = name, 2
+    while candidate.lower() in taken:
+        candidate = f"{stem} ({number}){extension}"
+        number += 1
+    taken.add(candidate.lower())
+    return candidate
+
+
+class UploadBudget:
+    def __init__(self, max_bytes : int):
+        """UploadBudget counts the bytes of one request across the files copied in parallel."""
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, size : int):
+        with self._lock:
+            self.used += size
+            if self.used > self.max_bytes:
+                raise UploadError(f"request larger than {UPLOAD_MAX_REQUEST_MB:g} MB")
+
+
+class StagedFile:
+    def __init__(self, name : str, path : str, staging : str, size : int, sha256 : str):
+        """StagedFile is an uploaded file fully written under a hidden temporary name, not yet in place."""
+        self.name = name
+        self.path = path
+        self.staging = staging
+        self.size = size
+        self.sha256 = sha256
+
+    def commit(self):
+        os.replace(self.staging, self.path)
+
+    def discard(self):
+        try:
+            os.remove(self.staging)
+        except OSError:
+            pass
+
+
+def stage_file(source, folder : str, name : str, budget : UploadBudget) -> StagedFile:
+    """stage_file method copies an upload block by block into a hidden file of the folder, hashing it on the way.
+
+    Args:
+        source : binary file object of the upload (UploadFile.file)
+        folder (str): session folder
+        name (str): sanitized file name
+        budget (UploadBudget): byte budget of the request
+
+    Returns:
+        StagedFile: to commit (rename into place) or discard
+
+    Raises:
+        UploadError: the file or the request is over its limit
+    """
+    max_bytes = UPLOAD_MAX_FILE_MB * 1024 * 1024
+    block_size = UPLOAD_BLOCK_KB * 1024
+    staging = os.path.join(folder, f".{name}.part-{uuid.uuid4().hex[:8]}")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(staging, "wb") as f:
+            for block in iter(lambda: source.read(block_size), b""):
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadError(f"{name} is larger than {UPLOAD_MAX_FILE_MB:g} MB")
+                budget.take(len(block))
+                digest.update(block)
+                f.write(block)
+    except BaseException:
+        try:
+            os.remove(staging)
+        except OSError:
+            pass
+        raise
+    return StagedFile(name, os.path.join(folder, name), staging, size, digest.hexdigest())
+
+
+async def stage_uploads(files : list, folder : str) -> list:
+    """stage_uploads method streams the files of a request into the session folder, UPLOAD_CONCURRENCY at a time.
+
+    Memory stays at a block per file being copied whatever the file sizes. Nothing is put in
+    place here : the caller commits the staged files once all of them are accepted, or discards them.
+
+    Args:
+        files (list): UploadFile of the request, those without a file name are ignored
+        folder (str): session folder
+
+    Returns:
+        list: StagedFile, in the order of the request
+
+    Raises:
+        UploadError: a limit is broken or a file name is unusable; staged files are removed
+    """
+    files = [file for file in files if file.filename]
+    if len(files) > UPLOAD_MAX_FILES:
+        raise UploadError(f"more than {UPLOAD_MAX_FILES} files in one request")
+    taken = set()
+    names = []
+    for file in files:
+        name = sanitize_filename(file.filename)
+        if name is None:
+            raise UploadError(f"invalid file name {file.filename!r}")
+        names.append(unique_name(name, taken))
+    budget = UploadBudget(UPLOAD_MAX_REQUEST_MB * 1024 * 1024)
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def stage(file, name):
+        async with semaphore:
+            return await asyncio.to_thread(stage_file, file.file, folder, name, budget)
+
+    results = await asyncio.gather(*(stage(file, name) for file, name in zip(files, names)), return_exceptions=True)
+    staged = [result for result in results if isinstance(result, StagedFile)]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        for item in staged:
+            item.discard()
+        raise errors[0] if isinstance(errors[0], UploadError) else UploadError(f"upload failed : {errors[0]}")
+    return staged
+
+
+class UploadLimitMiddleware:
+    def __init__(self, app, prefix : str = "/upload"):
+        """UploadLimitMiddleware refuses (413) upload requests whose Content-Length is over UPLOAD_MAX_REQUEST_MB
+        before their body is read. Requests without a length are still held to the limit while their files are copied."""
+        self.app = app
+        self.prefix = prefix
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] in ("POST", "PUT") and scope["path"].startswith(self.prefix):
+            headers = dict(scope["headers"])
+            length = headers.get(b"content-length")
+            if length is not None and length.isdigit() and int(length) > UPLOAD_MAX_REQUEST_MB * 1024 * 1024:
+                response = JSONResponse({"error": f"request larger than {UPLOAD_MAX_REQUEST_MB:g} MB"}, status_code=413)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
@@ -1,43 +1,111 @@
-import operator
+import os
 from RAG import RAG
-from typing import List
-from pydantic import BaseModel , Field
 from langgraph.graph import StateGraph,END
-from langchain_core.messages import BaseMessage
-from typing import TypedDict, Annotated, Sequence
-from langgraph.checkpoint.memory import InMemorySaver
+from langchain_core.runnables import RunnableLambda
+from typing import TypedDict
+from conversation import ConversationMemory,get_checkpointer
 
 
 
 class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], operator.add]
+    ## every key is replaced, not appended to, so a thread's state stays the same size however long it runs
+    question: str   ## question of the turn, as asked
+    query: str      ## standalone question used for retrieval and the answer
+    answer: str
+    summary: str    ## rolling summary of the older turns
+    turns: list     ## [question, answer] of the recent turns, oldest first
 
 class workflow:
-    def __init__(self,llm,query,retriever,folder_path):
+    def __init__(self,llm,retriever,folder_path,fingerprint=None,settings=None,checkpointer=None):
+        """workflow holds the compiled graph of one session; it is built once and reused for every question.
+
+        Args:
+            llm : chat model of the session
+            retriever : retriever of the session
+            folder_path (str): upload folder of the session
+            fingerprint (str, optional): document set fingerprint of the session, keys the answer cache
+            settings (dict, optional): session options, see RAG
+            checkpointer (optional): store of the conversation threads. Defaults to the process-wide SQLite one.
+        """
         self.llm = llm
-        self.query = query
         self.retriever = retriever
         self.folder_path = folder_path
-        self.memory=InMemorySaver()  ## memory is a class that stores the data of the session
-    
-    def application_workflow(self,state:AgentState):
-        query = state["messages"][-1]
-        obj = RAG(self.folder_path,self.retriever,self.llm)
-        ans = obj.run(query)
-        return {"messages" : [ans]}
+        self.memory = checkpointer or get_checkpointer()  ## memory stores the conversation threads of the session
+        self.conversation = ConversationMemory(self.llm)
+        self.rag = RAG(self.folder_path,self.retriever,self.llm,fingerprint=fingerprint,settings=settings)
+        self.app = self.Builder()
+
+    def rewrite(self,state:AgentState,config):
+        query = self.conversation.standalone(state["question"],state.get("summary",""),state.get("turns",[]))
+        return {"query" : query}
+
+    async def arewrite(self,state:AgentState,config):
+        query = await self.conversation.astandalone(state["question"],state.get("summary",""),state.get("turns",[]))
+        return {"query" : query}
+
+    def application_workflow(self,state:AgentState,config):
+        query = state["query"]
+        ans = self.rag.run(query,use_cache=config["configurable"].get("use_cache",True),filters=config["configurable"].get("filters"))
+        return {"answer" : ans}
+
+    async def aapplication_workflow(self,state:AgentState,config):
+        query = state["query"]
+        ans = await self.rag.arun(query,use_cache=config["configurable"].get("use_cache",True),filters=config["configurable"].get("filters"))
+        return {"answer" : ans}
+
+    def remember(self,state:AgentState,config):
+        summary,turns = self.conversation.fold(state.get("summary",""),state.get("turns",[]),state["question"],state["answer"])
+        return {"summary" : summary, "turns" : turns}
+
+    async def aremember(self,state:AgentState,config):
+        summary,turns = await self.conversation.afold(state.get("summary",""),state.get("turns",[]),state["question"],state["answer"])
+        return {"summary" : summary, "turns" : turns}
 
     def Builder(self):
         builder=StateGraph(AgentState)
-        ## adding nodes
-        builder.add_node("RAG",self.application_workflow)
-        builder.set_entry_point("RAG")
+        ## adding nodes, with a sync and an async implementation
+        builder.add_node("rewrite",RunnableLambda(self.rewrite,afunc=self.arewrite))
+        builder.add_node("RAG",RunnableLambda(self.application_workflow,afunc=self.aapplication_workflow))
+        builder.add_node("remember",RunnableLambda(self.remember,afunc=self.aremember))
+        builder.set_entry_point("rewrite")
+        builder.add_edge("rewrite","RAG")
+        builder.add_edge("RAG","remember")
+        builder.add_edge("remember",END)
         #compiling
         app = builder.compile(checkpointer=self.memory)
-        state={"messages":[self.query]}
-        config={"configurable": {"thread_id": "1"}}
-        result = app.invoke(state,config=config)
-        return result["messages"][-1]
+        return app
 
+    def config(self,thread_id=None,use_cache=True,filters=None):
+        ## threads are shared by the sessions' workflows, their ids start with the session id
+        thread_id = thread_id or f"{os.path.basename(self.folder_path)}:default"
+        return {"configurable": {"thread_id": thread_id, "use_cache": use_cache, "filters": filters}}
 
+    def run(self,query,thread_id=None,use_cache=True,filters=None):
+        """run method answers one question on the conversation thread `thread_id`; use_cache=False bypasses the answer cache,
+        filters restrict retrieval to the chunks matching them."""
+        result = self.app.invoke({"question":query},config=self.config(thread_id,use_cache,filters))
+        return result["answer"]
 
+    async def arun(self,query,thread_id=None,use_cache=True,filters=None):
+        """arun method is the async version of run, it does not block the event loop."""
+        result = await self.app.ainvoke({"question":query},config=self.config(thread_id,use_cache,filters))
+        return result["answer"]
 
+    async def astream(self,query,thread_id=None,metrics=None,use_cache=True,filters=None):
+        """astream method streams the answer of one question on the conversation thread `thread_id` token by token
+        (see RAG.astream). The turn is added to the thread once the answer is complete; a stream closed early is not remembered."""
+        metrics = {} if metrics is None else metrics
+        config = self.config(thread_id,use_cache,filters)
+        state = (await self.app.aget_state(config)).values
+        summary,turns = state.get("summary",""),state.get("turns",[])
+        standalone = await self.conversation.astandalone(query,summary,turns)
+        if standalone != query:
+            metrics["standalone_query"] = standalone
+        answer = []
+        async for token in self.rag.astream(standalone,metrics,use_cache=use_cache,filters=filters):
+            answer.append(token)
+            yield token
+        answer = "".join(answer)
+        summary,turns = await self.conversation.afold(summary,turns,query,answer)
+        await self.app.aupdate_state(config,{"question": query, "query": standalone, "answer": answer, "summary": summary, "turns": turns},
+                                     as_node="remember")
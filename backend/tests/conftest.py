@@ -0,0 +1,19 @@
+## tests import the modules of src directly; everything they write goes to temporary folders
+import os
+import sys
+import tempfile
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+SCRATCH = tempfile.mkdtemp(prefix="backend-tests-")
+## set before the modules read their settings : no credentials, no sweeper or warm-up, no shared caches
+os.environ["OPENAI_API_KEY"] = ""
+os.environ["SESSION_SWEEP_INTERVAL_S"] = "0"
+os.environ["WARMUP"] = "false"
+os.environ["TRACE_LOG"] = "false"
+os.environ["EMBED_CACHE"] = "false"
+os.environ["CONVERSATION_DB_PATH"] = ":memory:"
+os.environ["DOCUMENT_STORE_DIR"] = os.path.join(SCRATCH, "store")
+os.environ["ANSWER_CACHE_PATH"] = os.path.join(SCRATCH, "answers.sqlite")
+os.environ["EMBED_CACHE_PATH"] = os.path.join(SCRATCH, "embeddings.sqlite")
+os.environ["OCR_CHECKPOINT_DIR"] = os.path.join(SCRATCH, "ocr")
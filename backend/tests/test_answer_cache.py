@@ -0,0 +1,47 @@
+import pytest
+
+from answer_cache import AnswerCache, answer_key
+from session_store import SessionStore
+from test_session_store import fake_load, new_session, save_index
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return AnswerCache(str(tmp_path / "answers.sqlite"), ttl=3600, max_entries=100, similarity=0.95)
+
+
+def test_answer_key_follows_document_set_model_and_question():
+    key = answer_key("a" * 64, "gpt-4o-mini", "What is RAG?")
+    assert answer_key("a" * 64, "gpt-4o-mini", "  what is   RAG ") == key
+    assert answer_key("b" * 64, "gpt-4o-mini", "What is RAG?") != key
+    assert answer_key("a" * 64, "gpt-4o", "What is RAG?") != key
+    assert answer_key("a" * 64, "gpt-4o-mini", "What is RAG used for?") != key
+
+
+def test_answers_are_served_for_their_document_set_only(cache):
+    cache.put("a" * 64, "gpt-4o-mini", "What is RAG?", "retrieval augmented generation", embedding=[1.0, 0.0])
+    assert cache.get("a" * 64, "gpt-4o-mini", "what is rag") == "retrieval augmented generation"
+    assert cache.get("b" * 64, "gpt-4o-mini", "What is RAG?") is None
+    assert cache.get_similar("a" * 64, "gpt-4o-mini", [0.99, 0.05])[0] == "retrieval augmented generation"
+    assert cache.get_similar("b" * 64, "gpt-4o-mini", [1.0, 0.0])[0] is None
+    assert cache.invalidate("a" * 64) == 1
+    assert cache.get("a" * 64, "gpt-4o-mini", "What is RAG?") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_other_workers_key_answers_by_the_new_fingerprint(tmp_path, cache):
+    """A worker that did not ingest the update has the session loaded with the old fingerprint; its next
+    question must not be answered from the answers of the old document set."""
+    fake_load.calls = 0
+    owner, other = SessionStore(str(tmp_path), fake_load), SessionStore(str(tmp_path), fake_load)
+    session_id, folder = new_session(owner, "a" * 64)
+    entry = other.get(session_id)
+    entry["workflow"] = object()
+    cache.put(entry["fingerprint"], "gpt-4o-mini", "What changed?", "nothing yet")
+    ## the owner saves the updated index
+    save_index(folder, "b" * 64)
+    entry = other.get(session_id)
+    assert entry["fingerprint"] == "b" * 64
+    ## the workflow, which keys the cache with the fingerprint it was built with, is rebuilt
+    assert "workflow" not in entry
+    assert cache.get(entry["fingerprint"], "gpt-4o-mini", "What changed?") is None
@@ -0,0 +1,100 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+import document_store
+from document_store import (share_file, write_document, open_document, has_document, claim_document, document_dir,
+                            blob_path, collect_garbage, SharedIndex)
+
+PROFILE = "4-test"
+
+
+@pytest.fixture(autouse=True)
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(document_store, "DOCUMENT_STORE_DIR", str(tmp_path / "store"))
+    return tmp_path / "store"
+
+
+def upload(folder, name, content):
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+
+def make_old(path, seconds=7200):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def test_share_file_links_the_uploads_of_a_content(tmp_path):
+    first, digest = upload(tmp_path / "session-1", "a.pdf", b"content")
+    second, _ = upload(tmp_path / "session-2", "b.pdf", b"content")
+    assert share_file(first, digest) is False
+    assert share_file(second, digest) is True
+    assert os.path.samefile(first, second) and os.path.samefile(first, blob_path(digest))
+    assert share_file(second, digest) is False
+    assert os.stat(first).st_nlink == 3
+
+
+def test_collect_garbage_keeps_linked_blobs_and_referenced_documents(tmp_path):
+    path, digest = upload(tmp_path / "session", "a.txt", b"content")
+    share_file(path, digest)
+    chunks = [Document(page_content="chunk", metadata={"source": path})]
+    write_document(PROFILE, "aa" + "0" * 62, "a.txt", chunks, np.ones((1, 4)))
+    write_document(PROFILE, "bb" + "0" * 62, "b.txt", chunks, np.ones((1, 4)))
+    for key in ("aa" + "0" * 62, "bb" + "0" * 62):
+        make_old(document_dir(PROFILE, key))
+    make_old(blob_path(digest))
+    referenced = {(PROFILE, "aa" + "0" * 62)}
+    assert collect_garbage(referenced, grace=3600) > 0
+    assert has_document(PROFILE, "aa" + "0" * 62) and not has_document(PROFILE, "bb" + "0" * 62)
+    assert os.path.exists(blob_path(digest))
+    ## once no session folder links to the blob it goes too, documents within the grace period stay
+    os.remove(path)
+    write_document(PROFILE, "cc" + "0" * 62, "c.txt", chunks, np.ones((1, 4)))
+    collect_garbage(referenced, grace=3600)
+    assert not os.path.exists(blob_path(digest))
+    assert has_document(PROFILE, "cc" + "0" * 62)
+    ## a claimed document counts as just used
+    make_old(document_dir(PROFILE, "cc" + "0" * 62))
+    assert claim_document(PROFILE, "cc" + "0" * 62)
+    collect_garbage(referenced, grace=3600)
+    assert has_document(PROFILE, "cc" + "0" * 62)
+
+
+def test_written_documents_are_opened_with_the_session_path(tmp_path):
+    chunks = [Document(page_content=f"chunk {i}", metadata={"source": "/sessions/1/a.txt", "page": i}) for i in range(3)]
+    key = "dd" + "0" * 62
+    assert write_document(PROFILE, key, "a.txt", chunks, np.arange(12).reshape(3, 4)) is True
+    assert write_document(PROFILE, key, "a.txt", chunks, np.zeros((3, 4))) is False
+    document = open_document(PROFILE, key)
+    assert open_document(PROFILE, key) is document
+    assert document.texts == ["chunk 0", "chunk 1", "chunk 2"]
+    assert document.metadata[1] == {"page": 1}
+    assert document.chunk_metadata(1, "/sessions/2/a.txt") == {"page": 1, "source": "/sessions/2/a.txt"}
+    assert np.array_equal(document.vectors[2], [8, 9, 10, 11])
+
+
+@pytest.mark.parametrize("inner_product", [False, True])
+def test_shared_index_search_matches_brute_force(inner_product):
+    rng = np.random.default_rng(0)
+    blocks = [rng.standard_normal((n, 8)).astype(np.float32) for n in (5, 0, 12)]
+    documents = [document_store.SharedDocument(str(i), [("", {}, [])] * len(block), block) for i, block in enumerate(blocks)]
+    index = SharedIndex(documents, 8, inner_product=inner_product)
+    vectors = np.concatenate(blocks)
+    assert index.ntotal == 17 and np.array_equal(index.reconstruct_n(0, 17), vectors)
+    queries = rng.standard_normal((3, 8)).astype(np.float32)
+    distances, ids = index.search(queries, 4)
+    for query, row_distances, row_ids in zip(queries, distances, ids):
+        scores = vectors @ query if inner_product else ((vectors - query) ** 2).sum(axis=1)
+        expected = np.argsort(-scores if inner_product else scores)[:4]
+        assert list(row_ids) == list(expected)
+        assert np.allclose(row_distances, scores[expected], atol=1e-4)
+    _, ids = index.search(queries[:1], 4, positions=np.array([1, 7, 16]))
+    assert sorted(ids[0][:3]) == [1, 7, 16] and ids[0][3] == -1
@@ -0,0 +1,28 @@
+from embedding_cache import EmbeddingCache
+
+
+def test_put_many_counts_replaced_vectors_once(tmp_path):
+    cache = EmbeddingCache("text-embedding-3-large", 4, path=str(tmp_path / "embeddings.sqlite"), max_mb=1)
+    cache.put_many(["alpha", "beta"], [[0.1] * 4, [0.2] * 4])
+    cache.put_many(["alpha", "gamma", "gamma"], [[0.3] * 4, [0.4] * 4, [0.4] * 4])
+    stored = cache._conn.execute("SELECT SUM(size) FROM embeddings").fetchone()[0]
+    assert stored == 3 * 16
+    assert cache._total_bytes == stored
+    assert EmbeddingCache("text-embedding-3-large", 4, path=str(tmp_path / "embeddings.sqlite"))._total_bytes == stored
+    vectors = cache.get_many(["alpha", " alpha ", "delta"])
+    assert vectors[0] == vectors[1] and abs(vectors[0][0] - 0.3) < 1e-6
+    assert vectors[2] is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+
+def test_put_many_evicts_least_recently_used_over_budget(tmp_path):
+    ## room for 4 vectors of 64 floats, eviction goes down to 90% of it
+    cache = EmbeddingCache("text-embedding-3-large", 64, path=str(tmp_path / "embeddings.sqlite"), max_mb=4 * 256 / 2**20)
+    for text in ("a", "b", "c", "d"):
+        cache.put_many([text], [[1.0] * 64])
+    ## rewriting a vector neither grows the cache nor leaves it the least recently used
+    cache.put_many(["a"], [[1.0] * 64])
+    assert cache.evictions == 0
+    cache.put_many(["e"], [[1.0] * 64])
+    assert cache.evictions == 2
+    assert [vector is not None for vector in cache.get_many(["a", "b", "c", "d", "e"])] == [True, False, False, True, True]
@@ -0,0 +1,62 @@
+import faiss
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+
+import index_factory
+from index_factory import AdaptiveIndex, create_index, configure_search
+
+DIMENSIONS = 16
+VECTORS = np.random.default_rng(0).standard_normal((1000, DIMENSIONS)).astype(np.float32)
+## quantizers are trained once per type, training is the slow part
+_trained = {}
+
+
+def make_store(index_type, monkeypatch):
+    if index_type not in _trained:
+        monkeypatch.setattr(index_factory, "PQ_BYTES", 2)
+        index = create_index(DIMENSIONS, len(VECTORS), index_type)
+        if not index.is_trained:
+            index.train(VECTORS)
+        _trained[index_type] = index
+    index = faiss.clone_index(_trained[index_type])
+    index.add(VECTORS)
+    configure_search(index)
+    ids = [f"chunk-{number}" for number in range(len(VECTORS))]
+    docstore = InMemoryDocstore({doc_id: Document(page_content=doc_id) for doc_id in ids})
+    return FAISS(embedding_function=None, index=index, docstore=docstore, index_to_docstore_id=dict(enumerate(ids)))
+
+
+def nearest(store, vector):
+    _, positions = store.index.search(vector[None, :], 1)
+    return store.index_to_docstore_id[int(positions[0][0])]
+
+
+@pytest.mark.parametrize("index_type", ["ivfpq", "opq", "hnsw"])
+def test_remove_keeps_the_other_vectors_as_they_were(index_type, monkeypatch):
+    store, vectors = make_store(index_type, monkeypatch), VECTORS
+    before = store.index.reconstruct_n(0, len(vectors))
+    found = [nearest(store, vector) for vector in vectors[:200]]
+    dropped = {f"chunk-{number}" for number in range(0, len(vectors), 3)}
+    AdaptiveIndex(store, DIMENSIONS).remove(list(dropped))
+    keep = [number for number in range(len(vectors)) if f"chunk-{number}" not in dropped]
+    assert store.index.ntotal == len(keep)
+    assert [store.index_to_docstore_id[position] for position in range(len(keep))] == [f"chunk-{number}" for number in keep]
+    ## codes are kept, not quantized a second time
+    assert np.array_equal(store.index.reconstruct_n(0, len(keep)), before[keep])
+    for number in keep[:100]:
+        if found[number] == f"chunk-{number}":
+            assert nearest(store, vectors[number]) == f"chunk-{number}"
+    assert all(doc_id not in dropped for doc_id in store.docstore._dict)
+
+
+def test_vectors_added_after_a_removal_get_their_own_positions(monkeypatch):
+    store, vectors = make_store("ivfpq", monkeypatch), VECTORS
+    AdaptiveIndex(store, DIMENSIONS).remove([f"chunk-{number}" for number in range(100)])
+    added = vectors[:5] * 10
+    store.add_embeddings([(f"new-{number}", vector) for number, vector in enumerate(added)], ids=[f"new-{number}" for number in range(5)])
+    assert store.index.ntotal == len(vectors) - 100 + 5
+    for number, vector in enumerate(added):
+        assert nearest(store, vector) == f"new-{number}"
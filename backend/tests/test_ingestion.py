@@ -0,0 +1,98 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from ingestion import IngestionManager, IngestionJob, IngestionCancelled, LOADING, EMBEDDING, READY, CANCELLED
+
+
+@pytest.fixture
+def manager():
+    manager = IngestionManager(max_workers=1)
+    yield manager
+    manager.shutdown()
+
+
+def run(manager, build):
+    """Submits `build` and returns (job, results passed to on_ready, saves done by build)."""
+    ready, saved = [], []
+    job = manager.submit("session", "/tmp/session", lambda job: build(job, saved), lambda job, result: ready.append(result))
+    return job, ready, saved
+
+
+def test_cancel_during_a_stage_stops_before_the_save(manager):
+    started, cancelled = threading.Event(), threading.Event()
+
+    def build(job, saved):
+        job.update(EMBEDDING)
+        started.set()
+        cancelled.wait(5)
+        job.update(chunks_embedded=10)
+        job.commit()
+        saved.append(True)
+
+    job, ready, saved = run(manager, build)
+    assert started.wait(5)
+    assert job.cancel() is True
+    cancelled.set()
+    job.future.result(5)
+    assert job.status == CANCELLED
+    assert ready == [] and saved == []
+
+
+def test_cancel_between_the_last_stage_and_the_save(manager):
+    reached, cancelled = threading.Event(), threading.Event()
+
+    def build(job, saved):
+        reached.set()
+        cancelled.wait(5)
+        job.commit()
+        saved.append(True)
+
+    job, ready, saved = run(manager, build)
+    assert reached.wait(5)
+    assert job.cancel() is True
+    cancelled.set()
+    job.future.result(5)
+    assert job.status == CANCELLED and saved == []
+
+
+def test_cancel_after_the_save_is_refused(manager):
+    committed, attempted = threading.Event(), threading.Event()
+
+    def build(job, saved):
+        job.commit()
+        saved.append(True)
+        committed.set()
+        attempted.wait(5)
+        job.update()
+        return "index"
+
+    job, ready, saved = run(manager, build)
+    assert committed.wait(5)
+    assert job.cancel() is False
+    attempted.set()
+    job.future.result(5)
+    assert job.status == READY
+    assert ready == ["index"] and saved == [True]
+
+
+def test_statuses_are_reported(manager):
+    statuses = []
+    manager.on_status = lambda job: statuses.append(job.status)
+    job, ready, _ = run(manager, lambda job, saved: job.update(EMBEDDING) or "index")
+    job.future.result(5)
+    assert ready == ["index"]
+    assert statuses == ["queued", LOADING, EMBEDDING, READY]
+
+
+def test_retriever_checks_for_a_cancel_right_before_replacing_the_index(tmp_path, monkeypatch):
+    import Retriever
+    saved = []
+    monkeypatch.setattr(Retriever, "save_vector_store", lambda *args: saved.append(args))
+    vector_store = SimpleNamespace(index=SimpleNamespace(ntotal=1))
+    job = IngestionJob("session", str(tmp_path))
+    job.cancel()
+    with pytest.raises(IngestionCancelled):
+        Retriever.Retriever(str(tmp_path), job=job).save(vector_store, SimpleNamespace(finalize=lambda: None), {})
+    assert saved == []
@@ -0,0 +1,131 @@
+import io
+import os
+import time
+import pymupdf
+import pytest
+from pypdf import PdfReader, PdfWriter
+import ocr
+import document_loader
+
+
+class PageNumberOCR(ocr.OCRBackend):
+    """Returns "page n of m" for every page of the pdf it is given."""
+
+    name = "page-number"
+
+    def ocr(self, pdf_path):
+        count = len(PdfReader(pdf_path).pages)
+        return [f"page {number + 1} of {count}" for number in range(count)]
+
+
+@pytest.fixture
+def unreadable_pdf(tmp_path):
+    """A 3 page pdf whose page tree announces a wrong page count : pypdf reads it, PyMuPDF refuses it."""
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(200, 200)
+    buffer = io.BytesIO()
+    writer.write(buffer)
+    path = tmp_path / "unreadable.pdf"
+    path.write_bytes(buffer.getvalue().replace(b"/Count 3", b"/Count 99999999999"))
+    with pytest.raises(Exception):
+        with pymupdf.open(str(path)) as doc:
+            len(doc)
+    return str(path)
+
+
+@pytest.fixture
+def page_number_ocr(monkeypatch, tmp_path):
+    ocr.register_ocr_backend("page-number", PageNumberOCR)
+    monkeypatch.setattr(ocr, "OCR_BACKEND", "page-number")
+    monkeypatch.setattr(ocr, "OCR_CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+
+
+def test_page_count_falls_back_to_pypdf(unreadable_pdf):
+    assert ocr.page_count(unreadable_pdf) == 3
+
+
+def test_whole_file_ocr_of_a_pdf_pymupdf_rejects(unreadable_pdf, page_number_ocr):
+    pages = document_loader.ocr_pdf(unreadable_pdf)
+    assert [doc.page_content for doc in pages] == ["page 1 of 3", "page 2 of 3", "page 3 of 3"]
+    assert pages[1].metadata == {"source": unreadable_pdf, "file_path": unreadable_pdf, "total_pages": 3, "page": 1, "ocr": True}
+
+
+def test_large_pdf_ocr_numbers_pages_across_parts(unreadable_pdf, page_number_ocr, monkeypatch):
+    split = document_loader.split_pdf_by_size
+    monkeypatch.setattr(document_loader, "is_pdf_too_large", lambda file: True)
+    monkeypatch.setattr(document_loader, "split_pdf_by_size", lambda file, folder: split(file, folder, target_size_mb=0.0001))
+    pages = document_loader.ocr_pdf(unreadable_pdf)
+    ## one page per part, each part OCR'd on its own
+    assert [doc.page_content for doc in pages] == ["page 1 of 1"] * 3
+    assert [(doc.metadata["page"], doc.metadata["total_pages"]) for doc in pages] == [(0, 3), (1, 3), (2, 3)]
+
+
+def test_ranges_are_split_with_pypdf(unreadable_pdf, page_number_ocr):
+    texts = ocr.ocr_pages(unreadable_pdf, [0, 1, 2], max_pages=2, concurrency=1)
+    assert texts == {0: "page 1 of 2", 1: "page 2 of 2", 2: "page 1 of 1"}
+
+
+def test_scratch_files_go_to_scratch_dir(unreadable_pdf, page_number_ocr, tmp_path, monkeypatch):
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+    monkeypatch.setattr(ocr, "SCRATCH_DIR", str(scratch))
+    folders = []
+
+    def ocr_range(pdf_path, group, backend, folder, max_retries):
+        folders.append(folder)
+        return [""] * len(group), 1, 0.0
+
+    monkeypatch.setattr(ocr, "ocr_range", ocr_range)
+    ocr.ocr_pages(unreadable_pdf, [0, 1, 2])
+    assert folders and all(folder.startswith(str(scratch)) for folder in folders)
+
+
+def test_split_pdf_by_size_writes_parts_to_the_given_folder(tmp_path):
+    writer = PdfWriter()
+    for _ in range(6):
+        writer.add_blank_page(200, 200)
+    path = tmp_path / "large.pdf"
+    with open(path, "wb") as f:
+        writer.write(f)
+    with pytest.raises(TypeError):
+        document_loader.split_pdf_by_size(str(path))
+    output_dir = tmp_path / "parts"
+    output_dir.mkdir()
+    parts = document_loader.split_pdf_by_size(str(path), str(output_dir), target_size_mb=0.0001)
+    assert len(parts) > 1
+    assert all(part.startswith(str(output_dir)) for part in parts)
+    assert sum(len(PdfReader(part).pages) for part in parts) == 6
+
+
+class SlowOCR(PageNumberOCR):
+    """Takes 0.2s per request, and fails every request on its last page."""
+
+    name = "slow"
+
+    def ocr(self, pdf_path):
+        time.sleep(0.2)
+        texts = super().ocr(pdf_path)
+        if texts[-1] == "page 1 of 1" and os.path.basename(pdf_path).startswith("pages_4-"):
+            raise RuntimeError("unreadable page")
+        return texts
+
+
+def test_ranges_are_timed_without_their_wait_for_a_worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocr, "OCR_CHECKPOINT_DIR", str(tmp_path / "checkpoints"))
+    writer = PdfWriter()
+    for _ in range(4):
+        writer.add_blank_page(200, 200)
+    path = str(tmp_path / "scan.pdf")
+    with open(path, "wb") as f:
+        writer.write(f)
+    records = []
+    texts = ocr.ocr_pages(path, [0, 1, 2, 3], backend=SlowOCR(), concurrency=1, max_retries=1, max_pages=1, on_range=records.append)
+    assert sorted(texts) == [0, 1, 2]
+    assert len(records) == 4
+    for record in records:
+        attempts = 2 if record["error"] else 1
+        assert record["attempts"] == attempts
+        assert 0.2 * attempts <= record["seconds"] < 0.2 * attempts + 1.5
+    ## queued behind three ranges, the last one would report about 0.8s with its wait
+    assert max(record["seconds"] for record in records if not record["error"]) < 0.5
@@ -0,0 +1,43 @@
+import os
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+import reranker
+import main
+from session_store import SessionStore, read_settings
+
+
+def test_registered_names_only():
+    assert reranker.is_registered("none")
+    assert reranker.is_registered("lexical")
+    assert reranker.is_registered("cross-encoder")
+    assert not reranker.is_registered("os:getpid")
+    assert not reranker.is_registered("os:abort")
+    assert not reranker.is_registered(None)
+
+
+def test_module_class_is_not_loaded_from_a_name():
+    with pytest.raises(ValueError):
+        reranker.get_reranker("os:getpid")
+
+
+def test_module_class_of_the_operator_setting(monkeypatch):
+    monkeypatch.setattr(reranker, "RERANKER", "reranker:LexicalReranker")
+    assert isinstance(reranker.get_reranker(), reranker.LexicalReranker)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "session_store", SessionStore(str(tmp_path), main.load_session))
+    return TestClient(main.app)
+
+
+def test_settings_refuse_unregistered_reranker(client, tmp_path):
+    session_id = str(uuid.uuid4())
+    os.makedirs(tmp_path / session_id)
+    response = client.put(f"/upload/{session_id}/settings", json={"rerank": "os:abort"})
+    assert response.status_code == 400
+    assert read_settings(str(tmp_path / session_id)) == {}
+    response = client.put(f"/upload/{session_id}/settings", json={"rerank": "lexical"})
+    assert response.status_code == 200
+    assert read_settings(str(tmp_path / session_id)) == {"rerank": "lexical"}
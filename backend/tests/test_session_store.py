@@ -0,0 +1,99 @@
+import os
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from session_store import SessionStore, FINGERPRINT_FILE, DOCSTORE_FILE, index_dir, write_settings
+
+
+def fake_load(folder):
+    """Stands for main.load_session : a retriever over an empty store and an llm."""
+    fake_load.calls += 1
+    vectorstore = SimpleNamespace(index=SimpleNamespace(ntotal=0, d=4), docstore=SimpleNamespace(_dict={}))
+    return SimpleNamespace(vectorstore=vectorstore), object()
+
+
+def save_index(folder, fingerprint):
+    """Writes the files of a saved index the way save_vector_store does : renamed into place, fingerprint last."""
+    target = index_dir(folder)
+    os.makedirs(target, exist_ok=True)
+    with open(os.path.join(target, DOCSTORE_FILE), "wb") as f:
+        f.write(b"docstore")
+    path = os.path.join(target, FINGERPRINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        f.write(fingerprint)
+    os.replace(path + ".tmp", path)
+
+
+@pytest.fixture
+def store(tmp_path):
+    fake_load.calls = 0
+    return SessionStore(str(tmp_path), fake_load)
+
+
+def new_session(store, fingerprint="a" * 64):
+    session_id = str(uuid.uuid4())
+    folder = store.folder(session_id)
+    os.makedirs(folder)
+    save_index(folder, fingerprint)
+    return session_id, folder
+
+
+def test_get_keeps_a_session_loaded(store):
+    session_id, _ = new_session(store)
+    entry = store.get(session_id)
+    assert store.get(session_id) is entry
+    assert fake_load.calls == 1
+    assert store.get("not-a-session") is None
+
+
+def test_get_reloads_an_index_saved_by_another_worker(store):
+    session_id, folder = new_session(store)
+    entry = store.get(session_id)
+    save_index(folder, "b" * 64)
+    reloaded = store.get(session_id)
+    assert reloaded is not entry
+    assert reloaded["fingerprint"] == "b" * 64
+    assert fake_load.calls == 2
+    assert store.get(session_id) is reloaded
+
+
+def test_get_rebuilds_the_workflow_after_a_settings_change(store):
+    session_id, folder = new_session(store)
+    entry = store.get(session_id)
+    entry["workflow"] = object()
+    write_settings(folder, {"rerank": "lexical"})
+    assert store.get(session_id) is entry
+    assert "workflow" not in entry
+    entry["workflow"] = workflow = object()
+    assert store.get(session_id)["workflow"] is workflow
+    assert fake_load.calls == 1
+
+
+def test_collect_garbage_deletes_expired_sessions_only(store):
+    old_id, old_folder = new_session(store)
+    recent_id, _ = new_session(store)
+    busy_id, busy_folder = new_session(store)
+    long_ago = time.time() - 48 * 3600
+    for folder in (old_folder, busy_folder):
+        os.utime(folder, (long_ago, long_ago))
+    deleted = store.collect_garbage(busy={busy_id}, quota_mb=0, retention_hours=24, min_idle=60)
+    assert [(session_id, fingerprint) for session_id, fingerprint, _ in deleted] == [(old_id, "a" * 64)]
+    assert not os.path.exists(old_folder)
+    assert sorted(store.session_ids()) == sorted([recent_id, busy_id])
+
+
+def test_collect_garbage_enforces_the_quota_least_recently_used_first(store):
+    sessions = [new_session(store) for _ in range(3)]
+    now = time.time()
+    for age, (_, folder) in zip((3000, 2000, 1000), sessions):
+        with open(os.path.join(folder, "document.txt"), "wb") as f:
+            f.write(b"x" * 400 * 1024)
+        os.utime(folder, (now - age, now - age))
+    deleted = store.collect_garbage(quota_mb=1, retention_hours=0, min_idle=60)
+    assert [session_id for session_id, _, _ in deleted] == [sessions[0][0]]
+    ## a session just used is kept, the next least recently used one goes
+    store.get(sessions[1][0])
+    assert [session_id for session_id, _, _ in store.collect_garbage(quota_mb=0.5, retention_hours=0, min_idle=60)] == [sessions[2][0]]
@@ -0,0 +1,77 @@
+import pyarrow.parquet as pq
+import pytest
+
+import tabular
+from tabular import convert_table, profile_table, load_table, run_query, format_result, unique_names
+
+
+def write_csv(tmp_path, text, name="table.csv"):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def write_xlsx(tmp_path, rows, name="table.xlsx"):
+    from openpyxl import Workbook
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    path = tmp_path / name
+    workbook.save(path)
+    return str(path)
+
+
+def test_unique_names():
+    assert unique_names(["amount", "amount", None, "", " name ", "amount (2)"]) == \
+        ["amount", "amount (2)", "column 3", "column 4", "name", "amount (2) (2)"]
+
+
+def test_csv_with_repeated_and_empty_headers_is_profiled(tmp_path):
+    file = write_csv(tmp_path, "amount,amount,,name\n1,2,3,a\n4,5,6,b\n")
+    parquet = convert_table(file)
+    assert pq.read_table(parquet).to_pydict() == {"amount": [1, 4], "amount (2)": [2, 5], "column 3": [3, 6], "name": ["a", "b"]}
+    profile = profile_table(parquet)
+    assert [column["name"] for column in profile["columns"]] == ["amount", "amount (2)", "column 3", "name"]
+    assert profile["columns"][1]["max"] == 5
+
+
+def test_csv_column_empty_in_the_first_block(tmp_path, monkeypatch):
+    monkeypatch.setattr(tabular, "TABULAR_BLOCK_MB", 64 / 2**20)
+    rows = [f"{number},\n" for number in range(50)] + ["50,late note\n"]
+    parquet = convert_table(write_csv(tmp_path, "id,note\n" + "".join(rows)))
+    table = pq.read_table(parquet)
+    assert table.num_rows == 51
+    assert table.column("note").to_pylist()[-1] == "late note"
+
+
+def test_xlsx_with_repeated_headers_and_a_column_empty_in_the_first_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(tabular, "TABULAR_XLSX_BATCH", 2)
+    file = write_xlsx(tmp_path, [["amount", "amount", None, "note"], [1, 2, 3, None], [4, 5, 6, None], [7, 8, 9, "third"]])
+    table = pq.read_table(convert_table(file))
+    assert table.to_pydict() == {"amount": [1, 4, 7], "amount (2)": [2, 5, 8], "column 3": [3, 6, 9], "note": [None, None, "third"]}
+    assert [column["name"] for column in profile_table(tabular.table_path(file))["columns"]] == table.column_names
+
+
+def test_load_table_describes_columns_with_numeric_twins(tmp_path):
+    file = write_csv(tmp_path, "car,power,price\na,963 hp,\"$1,100,000\"\nb,500 hp,\"$200,000\"\nc,700 hp,\"$300,000\"\n")
+    documents = load_table(file)
+    assert documents[0].metadata == {"source": file, "table": "table.csv", "page": 0}
+    assert "3 rows and 5 columns" in documents[0].page_content
+    assert "power (number) (double)" in documents[4].page_content and "from 500.0 to 963.0" in documents[4].page_content
+
+
+def test_run_query_filters_groups_and_orders(tmp_path):
+    parquet = convert_table(write_csv(tmp_path, "city,sales\nParis,10\nLyon,5\nParis,7\nNice,1\nLyon,4\n"))
+    result, total = run_query(parquet, {
+        "filters": [{"column": "sales", "op": ">", "value": "2"}],
+        "group_by": ["city"], "aggregations": [{"column": "sales", "function": "sum"}, {"column": "*", "function": "count"}],
+        "order_by": [{"column": "sales_sum", "descending": True}], "limit": 1})
+    assert total == 2
+    assert result.to_pylist() == [{"sales_sum": 17, "count_all": 2, "city": "Paris"}]
+    result, total = run_query(parquet, {"filters": [{"column": "city", "op": "contains", "value": "ly"}], "columns": ["sales"]})
+    assert result.column("sales").to_pylist() == [5, 4]
+    assert format_result(*run_query(parquet, {"columns": ["city"]}, max_rows=2)).endswith("(5 rows in total, the first 2 are shown)")
+    with pytest.raises(ValueError):
+        run_query(parquet, {"columns": ["country"]})
+    with pytest.raises(ValueError):
+        run_query(parquet, {"aggregations": [{"column": "sales", "function": "median"}]})
@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import uploads
+from uploads import sanitize_filename, unique_name, stage_uploads, UploadError
+
+
+@pytest.mark.parametrize("filename, expected", [
+    ("report.pdf", "report.pdf"),
+    ("../../etc/passwd", "passwd"),
+    ("C:\\Users\\me\\notes.txt", "notes.txt"),
+    (".settings.json", "settings.json"),
+    ("..index", "index"),
+    ("a\x00b\nc.txt", "abc.txt"),
+    ("rm -rf *; echo $HOME.md", "rm -rf __ echo _HOME.md"),
+    ("Cafe\u0301.docx", "Caf\u00e9.docx"),
+    ("", None),
+    ("...", None),
+    ("dir/", None),
+    ("__ .", None),
+])
+def test_sanitize_filename(filename, expected):
+    assert sanitize_filename(filename) == expected
+
+
+def test_sanitize_filename_cuts_long_names_keeping_the_extension():
+    name = sanitize_filename("x" * 300 + ".pdf")
+    assert len(name) == uploads.MAX_NAME_LENGTH
+    assert name.endswith("x.pdf")
+
+
+def test_unique_name_numbers_duplicates_ignoring_case():
+    taken = set()
+    assert [unique_name(name, taken) for name in ("a.pdf", "A.pdf", "a.pdf")] == ["a.pdf", "A (2).pdf", "a (3).pdf"]
+
+
+def upload(filename, content):
+    return SimpleNamespace(filename=filename, file=io.BytesIO(content))
+
+
+def test_stage_uploads_hashes_and_commits_files(tmp_path):
+    staged = asyncio.run(stage_uploads([upload("../a.txt", b"alpha"), upload("a.txt", b"beta"), upload("", b"")], str(tmp_path)))
+    assert [item.name for item in staged] == ["a.txt", "a (2).txt"]
+    assert staged[0].sha256 == hashlib.sha256(b"alpha").hexdigest() and staged[0].size == 5
+    assert not os.path.exists(tmp_path / "a.txt")
+    for item in staged:
+        item.commit()
+    assert sorted(os.listdir(tmp_path)) == ["a (2).txt", "a.txt"]
+    assert (tmp_path / "a (2).txt").read_bytes() == b"beta"
+
+
+def test_stage_uploads_over_a_limit_leaves_nothing(tmp_path, monkeypatch):
+    monkeypatch.setattr(uploads, "UPLOAD_MAX_FILE_MB", 1 / 1024)
+    monkeypatch.setattr(uploads, "UPLOAD_BLOCK_KB", 1)
+    with pytest.raises(UploadError, match="larger than"):
+        asyncio.run(stage_uploads([upload("small.txt", b"x" * 100), upload("large.txt", b"x" * 2048)], str(tmp_path)))
+    assert os.listdir(tmp_path) == []
+    with pytest.raises(UploadError):
+        asyncio.run(stage_uploads([upload("...", b"x")], str(tmp_path)))